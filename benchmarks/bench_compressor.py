@@ -0,0 +1,89 @@
+"""Compare files per second of the long-lived compressor worker pool
+against spawning a compressor process for every file
+
+Usage: python benchmarks/bench_compressor.py [--files 50] [--workers 1]
+
+"""
+import os
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+from kagin.compressor import CompressorPool, get_yui_compressor
+
+JS_SOURCE = """
+function greet_%(index)d(name) {
+    var message = 'Hello, ' + name + '!';
+    for (var index = 0; index < 10; index++) {
+        message = message + ' ' + index;
+    }
+    return message;
+}
+"""
+
+CSS_SOURCE = """
+.item-%(index)d {
+    background-color: #ffffff;
+    margin: 0px 0px 0px 0px;
+    padding: 10px;
+}
+"""
+
+
+def make_sources(dir, count):
+    filenames = []
+    for index in xrange(count):
+        if index % 2:
+            filename = os.path.join(dir, 'file%d.css' % index)
+            content = CSS_SOURCE % dict(index=index)
+        else:
+            filename = os.path.join(dir, 'file%d.js' % index)
+            content = JS_SOURCE % dict(index=index)
+        with open(filename, 'wt') as file:
+            file.write(content)
+        filenames.append(filename)
+    return filenames
+
+
+def bench_spawn(filenames):
+    yui_path = get_yui_compressor()
+    for filename in filenames:
+        subprocess.check_output(['java', '-jar', yui_path, filename])
+
+
+def bench_pool(filenames, workers):
+    with CompressorPool(workers) as pool:
+        for filename in filenames:
+            pool.compress_file(filename)
+
+
+def report(name, count, elapsed):
+    print '%-8s %5d files in %7.2fs, %8.2f files/s' % (
+        name, count, elapsed, count / elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    dir = tempfile.mkdtemp()
+    try:
+        filenames = make_sources(dir, args.files)
+
+        begin = time.time()
+        bench_spawn(filenames)
+        report('spawn', len(filenames), time.time() - begin)
+
+        begin = time.time()
+        bench_pool(filenames, args.workers)
+        report('pool', len(filenames), time.time() - begin)
+    finally:
+        shutil.rmtree(dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
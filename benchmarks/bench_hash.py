@@ -0,0 +1,85 @@
+"""Compare the old 4 KiB mmap.read loop with hashing slices of the mapping
+without copying, on many small files and a few large files
+
+Usage: python benchmarks/bench_hash.py [--small 2000] [--large 4]
+
+"""
+import os
+import time
+import mmap
+import shutil
+import hashlib
+import tempfile
+import argparse
+
+from kagin.hash import HashFile, get_hash_type
+
+
+def old_compute_hash(hash_type, filename):
+    hash = hash_type('')
+    if not os.path.getsize(filename):
+        return hash.hexdigest()
+    with open(filename, 'rb') as file:
+        map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        while True:
+            chunk = map.read(4096)
+            if not chunk:
+                break
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+def make_files(dir, prefix, count, size):
+    filenames = []
+    for index in xrange(count):
+        filename = os.path.join(dir, '%s%d' % (prefix, index))
+        with open(filename, 'wb') as file:
+            file.write(os.urandom(size))
+        filenames.append(filename)
+    return filenames
+
+
+def bench(name, func, filenames):
+    total_size = sum(os.path.getsize(filename) for filename in filenames)
+    begin = time.time()
+    for filename in filenames:
+        func(filename)
+    elapsed = time.time() - begin
+    print '%-24s %6d files in %6.3fs, %8.1f files/s, %8.1f MB/s' % (
+        name, len(filenames), elapsed, len(filenames) / elapsed,
+        total_size / 1048576.0 / elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--small', type=int, default=2000)
+    parser.add_argument('--large', type=int, default=4)
+    parser.add_argument('--large-size', type=int, default=64 * 1024 * 1024)
+    args = parser.parse_args()
+
+    dir = tempfile.mkdtemp()
+    try:
+        cases = [
+            ('small', make_files(dir, 'small', args.small, 4 * 1024)),
+            ('large', make_files(dir, 'large', args.large, args.large_size)),
+        ]
+        hash_types = [('md5', hashlib.md5)]
+        try:
+            hash_types.append(('blake2b-20', get_hash_type('blake2b', 10)))
+        except ImportError:
+            print 'blake2 is not available, skipped'
+
+        for case, filenames in cases:
+            for name, hash_type in hash_types:
+                hash_file = HashFile(dir, dir, hash_type=hash_type)
+                bench('%s old %s' % (case, name),
+                      lambda filename: old_compute_hash(hash_type, filename),
+                      filenames)
+                bench('%s new %s' % (case, name),
+                      hash_file.compute_hash, filenames)
+    finally:
+        shutil.rmtree(dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
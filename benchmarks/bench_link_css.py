@@ -0,0 +1,157 @@
+"""Compare the old replace_css_links, which compiles its pattern and parses
+every URL on each call, with a reused CSSLinkRewriter in memory and in
+streaming mode
+
+Usage: python benchmarks/bench_link_css.py [--file bootstrap.css]
+       [--repeat 20]
+
+Without --file, a stylesheet of a few MB with font and sprite links is
+generated.
+
+"""
+import os
+import re
+import time
+import shutil
+import logging
+import urlparse
+import tempfile
+import argparse
+
+from kagin.link_css import CSSLinkRewriter
+
+
+def old_replace_css_links(content, map_func, logger):
+    url_pattern = '(?P<url>[a-zA-Z0-9\-\./_\?=#&]+)'
+    pattern = re.compile(
+        r"""url\s*\(\s*['"]?""" + url_pattern + r"""['"]?\s*\)""",
+        flags=re.I | re.M
+    )
+    result = []
+    previous = 0
+    for match in pattern.finditer(content):
+        start = match.start(1)
+        end = match.end(1)
+        url = match.group(1)
+        endswith_q = False
+        striped_url = url
+        ori_result = urlparse.urlparse(url)
+        if ori_result.query or ori_result.fragment:
+            new_result = urlparse.ParseResult(
+                scheme=ori_result.scheme,
+                netloc=ori_result.netloc,
+                path=ori_result.path,
+                params=ori_result.params,
+                query='',
+                fragment=''
+            )
+            striped_url = new_result.geturl()
+            logger.info('Strip url to %s', striped_url)
+        if striped_url.endswith('?'):
+            striped_url = striped_url[:-1]
+            endswith_q = True
+        if '?' in url and '#' in url and url.index('?') < url.index('#'):
+            endswith_q = True
+        new_url = map_func(striped_url)
+        if new_url is None:
+            logger.info('Cannot find %r', striped_url)
+            result.append(content[previous:start])
+            result.append(url)
+            previous = end
+            continue
+        else:
+            if ori_result.query or endswith_q:
+                new_url = new_url + '?' + ori_result.query
+            if ori_result.fragment:
+                new_url = new_url + '#' + ori_result.fragment
+        logger.info('Replace %s with %s', url, new_url)
+        result.append(content[previous:start])
+        result.append(new_url)
+        previous = end
+    result.append(content[previous:])
+    return ''.join(result)
+
+
+def make_css(rules):
+    parts = []
+    for index in xrange(rules):
+        parts.append(
+            '.icon-%d { background: url("../img/sprite-%d.png?v=2") '
+            'no-repeat -%dpx 0; width: 16px; height: 16px; }\n'
+            % (index, index % 20, index % 400)
+        )
+        if index % 500 == 0:
+            parts.append(
+                "@font-face { font-family: 'F%d'; "
+                "src: url('../fonts/f.eot?#iefix&v=3.0.1') "
+                "format('embedded-opentype'), url('../fonts/f.woff?v=3.0.1')"
+                " format('woff'); }\n" % index
+            )
+    return ''.join(parts)
+
+
+def bench(name, func, repeat):
+    begin = time.time()
+    for _ in xrange(repeat):
+        func()
+    elapsed = (time.time() - begin) / repeat
+    print '%-24s %8.2f ms per run' % (name, elapsed * 1000)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--file')
+    parser.add_argument('--rules', type=int, default=30000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.WARNING)
+    if args.file:
+        with open(args.file, 'rt') as file:
+            content = file.read()
+    else:
+        content = make_css(args.rules)
+    print 'Stylesheet: %.1f MB, %d links' % (
+        len(content) / 1048576.0, content.lower().count('url('))
+
+    def map_func(url):
+        return 'hashed/' + url
+
+    rewriter = CSSLinkRewriter(logger=logger)
+    expected = old_replace_css_links(content, map_func, logger)
+    assert rewriter.rewrite(content, map_func) == expected
+
+    dir = tempfile.mkdtemp()
+    try:
+        input_path = os.path.join(dir, 'input.css')
+        output_path = os.path.join(dir, 'output.css')
+        with open(input_path, 'wt') as file:
+            file.write(content)
+
+        def old():
+            old_replace_css_links(content, map_func, logger)
+
+        def new():
+            rewriter.rewrite(content, map_func)
+
+        def stream():
+            with open(input_path, 'rt') as input_file:
+                with open(output_path, 'wt') as output_file:
+                    rewriter.rewrite_stream(input_file, output_file,
+                                            map_func)
+
+        old_elapsed = bench('replace_css_links (old)', old, args.repeat)
+        new_elapsed = bench('CSSLinkRewriter.rewrite', new, args.repeat)
+        stream_elapsed = bench('rewrite_stream', stream, args.repeat)
+        with open(output_path, 'rt') as file:
+            assert file.read() == expected
+        print 'Speedup: %.2fx in memory, %.2fx streaming' % (
+            old_elapsed / new_elapsed, old_elapsed / stream_elapsed)
+    finally:
+        shutil.rmtree(dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
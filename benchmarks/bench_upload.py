@@ -0,0 +1,93 @@
+"""Compare serial uploading with the concurrent Uploader against a fake S3
+with per-request latency, to show uploads of many small files are bound
+by round trips, then compare a single PUT of a large file with multipart
+uploads against a fake S3 with limited bandwidth per connection
+
+Usage: python benchmarks/bench_upload.py [--files 500] [--latency 0.02]
+       [--jobs 1,4,8,16] [--large-size 67108864] [--bandwidth 33554432]
+
+"""
+import os
+import time
+import shutil
+import logging
+import tempfile
+import argparse
+
+from kagin.storage import S3Storage
+from kagin.upload import Uploader, make_task
+from kagin.tests.fake_s3 import FakeS3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--size', type=int, default=4096)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jobs', default='1,4,8,16')
+    parser.add_argument('--large-size', type=int, default=64 * 1024 * 1024)
+    parser.add_argument('--bandwidth', type=int, default=32 * 1024 * 1024)
+    parser.add_argument('--part-jobs', default='1,4,8')
+    args = parser.parse_args()
+
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.WARNING)
+    dir = tempfile.mkdtemp()
+    try:
+        tasks = []
+        for index in xrange(args.files):
+            name = '%08x.%s' % (index, ('css', 'js', 'png')[index % 3])
+            path = os.path.join(dir, name)
+            with open(path, 'wb') as file:
+                file.write(os.urandom(args.size))
+            tasks.append(make_task(name, path))
+
+        serial = None
+        for jobs in map(int, args.jobs.split(',')):
+            service = FakeS3(latency=args.latency)
+            storage = S3Storage('http://example.com/',
+                                'https://example.com/', 'bucket', 'key',
+                                'secret', connection_factory=service)
+            uploader = Uploader(storage, jobs=jobs, logger=logger)
+            begin = time.time()
+            uploader.upload(tasks)
+            elapsed = time.time() - begin
+            if serial is None:
+                serial = elapsed
+            print '%3d jobs: %6d files in %6.2fs, %8.1f files/s, %.1fx' % (
+                jobs, len(tasks), elapsed, len(tasks) / elapsed,
+                serial / elapsed)
+
+        path = os.path.join(dir, 'large.mp4')
+        with open(path, 'wb') as file:
+            file.write(os.urandom(args.large_size))
+        single = None
+        for part_jobs in [0] + map(int, args.part_jobs.split(',')):
+            service = FakeS3(latency=args.latency,
+                             bandwidth=args.bandwidth)
+            threshold = None
+            if part_jobs:
+                threshold = 5 * 1024 * 1024
+            storage = S3Storage('http://example.com/',
+                                'https://example.com/', 'bucket', 'key',
+                                'secret', connection_factory=service,
+                                multipart_threshold=threshold,
+                                part_size=8 * 1024 * 1024,
+                                part_jobs=part_jobs, logger=logger)
+            begin = time.time()
+            storage.upload_file('large.mp4', path)
+            elapsed = time.time() - begin
+            if single is None:
+                single = elapsed
+            name = 'single PUT'
+            if part_jobs:
+                name = '%d part jobs' % part_jobs
+            print '%-13s %.1f MB in %6.2fs, %8.1f MB/s, %.1fx' % (
+                name + ':', args.large_size / 1048576.0, elapsed,
+                args.large_size / 1048576.0 / elapsed, single / elapsed)
+    finally:
+        shutil.rmtree(dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
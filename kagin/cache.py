@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import errno
+import logging
+import hashlib
+import threading
+
+from kagin.utils import atomic_open
+
+
+class MinifyCache(object):
+    """Persistent content-addressed cache of minified output, the least
+    recently used entries are evicted when the total size of the cache
+    exceeds max_size
+
+    """
+
+    def __init__(self, cache_dir, max_size=256 * 1024 * 1024, logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: path to cache directory
+        self.cache_dir = cache_dir
+        #: maximum total size of cache entries in bytes
+        self.max_size = max_size
+        #: number of cache hits
+        self.hits = 0
+        #: number of cache misses
+        self.misses = 0
+        self._lock = threading.Lock()
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def make_key(self, *parts):
+        """Make a cache key from parts, such as source content hash,
+        compressor identity and options
+
+        """
+        hash = hashlib.sha1()
+        for part in parts:
+            hash.update(repr(part))
+            hash.update('\0')
+        return hash.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key[2:])
+
+    def get(self, key):
+        """Get cached content of key, return None if there is no such
+        entry
+
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                content = file.read()
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            with self._lock:
+                self.misses += 1
+            return None
+        # mark as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return content
+
+    def set(self, key, content):
+        """Store content of key
+
+        """
+        path = self._path(key)
+        dir = os.path.dirname(path)
+        try:
+            os.makedirs(dir)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        # write to a temporary file then rename, so that a concurrent or
+        # interrupted build never sees a partial entry
+        with atomic_open(path, 'wb') as file:
+            file.write(content)
+
+    def prune(self):
+        """Evict least recently used entries until the total size is not
+        greater than max_size, return number of evicted entries
+
+        """
+        entries = []
+        total_size = 0
+        for root, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+        entries.sort()
+        evicted = 0
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            os.remove(path)
+            total_size -= size
+            evicted += 1
+        if evicted:
+            self.logger.info('Evicted %s minify cache entries', evicted)
+        return evicted
+
+    def report(self):
+        """Log hit/miss statistics
+
+        """
+        total = self.hits + self.misses
+        rate = 0
+        if total:
+            rate = 100.0 * self.hits / total
+        self.logger.info(
+            'Minify cache: %s hits, %s misses (%.1f%% hit rate)',
+            self.hits, self.misses, rate
+        )
+
+
+class HashCache(object):
+    """Persistent digest cache keyed by path, size, mtime and inode of
+    files, in the spirit of git's index, so that unchanged files do not
+    have to be read again
+
+    The cache is invalidated as a whole when hash name or hash version
+    changes, entries of files not seen in a run are dropped when saving.
+
+    """
+
+    #: files modified within this many seconds before they are hashed are
+    #: not cached, as a later modification may not change their mtime
+    racy_seconds = 2
+
+    def __init__(self, path, hash_name, hash_version='', logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: path to cache file
+        self.path = path
+        #: hash name and version, all entries are invalid if it changes
+        self.fingerprint = [hash_name, hash_version]
+        #: map from path to [size, mtime, inode, digest]
+        self.entries = {}
+        #: paths seen in current run
+        self.seen = set()
+        #: number of cache hits
+        self.hits = 0
+        #: number of cache misses
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Load cache file
+
+        """
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rt') as file:
+            content = file.read()
+        try:
+            data = json.loads(content)
+        except ValueError:
+            self.logger.warn('Ignore corrupted hash cache %s', self.path)
+            return
+        if data.get('fingerprint') != self.fingerprint:
+            self.logger.info('Hash type or version changed, '
+                             'invalidate hash cache')
+            return
+        self.entries = data['entries']
+
+    def get(self, path, stat):
+        """Get digest of path with given os.stat result, return None if
+        there is no valid entry
+
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            self.seen.add(path)
+            entry = self.entries.get(path)
+            if (entry is not None and
+                    entry[:3] == [stat.st_size, stat.st_mtime, stat.st_ino]):
+                self.hits += 1
+                return entry[3]
+            self.misses += 1
+        return None
+
+    def set(self, path, stat, digest):
+        """Set digest of path with given os.stat result
+
+        """
+        if stat.st_mtime >= time.time() - self.racy_seconds:
+            return
+        path = os.path.abspath(path)
+        with self._lock:
+            self.seen.add(path)
+            self.entries[path] = [
+                stat.st_size, stat.st_mtime, stat.st_ino, digest
+            ]
+
+    def save(self):
+        """Write entries of paths seen in current run to cache file
+        atomically
+
+        """
+        with self._lock:
+            entries = dict((path, entry)
+                           for path, entry in self.entries.iteritems()
+                           if path in self.seen)
+            dropped = len(self.entries) - len(entries)
+            self.entries = entries
+        with atomic_open(self.path, 'wt') as file:
+            json.dump(dict(
+                fingerprint=self.fingerprint,
+                entries=entries,
+            ), file)
+        self.logger.info(
+            'Hash cache: %s hits, %s misses, %s stale entries dropped',
+            self.hits, self.misses, dropped
+        )
+        self.seen = set()
+        self.hits = 0
+        self.misses = 0
+
+
+class ResolutionCache(object):
+    """In-memory cache of URL resolution in CSS files keyed by (directory
+    of CSS file, URL), as many CSS files refer to the same sprites and 
+    fonts. The resolve function must only depend on its arguments
+    
+    """
+    
+    def __init__(self, resolve, name='URL resolution', logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: function to resolve (directory, URL) to a result
+        self._resolve = resolve
+        #: name of the cache in reports
+        self.name = name
+        #: map from (directory, URL) to result
+        self.entries = {}
+        #: number of cache hits
+        self.hits = 0
+        #: number of cache misses
+        self.misses = 0
+        self._lock = threading.Lock()
+        
+    def resolve(self, dir, url):
+        """Get resolved result of URL in directory
+        
+        """
+        key = (dir, url)
+        try:
+            result = self.entries[key]
+        except KeyError:
+            result = self._resolve(dir, url)
+            with self._lock:
+                self.entries[key] = result
+                self.misses += 1
+            return result
+        with self._lock:
+            self.hits += 1
+        return result
+    
+    def report(self):
+        """Log hit/miss statistics and reset them
+        
+        """
+        total = self.hits + self.misses
+        if not total:
+            return
+        self.logger.info(
+            '%s cache: %s hits, %s misses (%.1f%% hit rate)',
+            self.name, self.hits, self.misses, 100.0 * self.hits / total
+        )
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,178 @@
+import os
+import logging
+import subprocess
+import Queue
+
+
+class CompressorError(RuntimeError):
+    """Raised when the compressor fails to compress a file
+
+    """
+
+
+def get_yui_compressor():
+    """Get path of yui compressor
+
+    """
+    pkg_dir = os.path.dirname(__file__)
+    return os.path.join(pkg_dir, 'yuicompressor-2.4.2.jar')
+
+
+def get_worker_script():
+    """Get path of the Rhino script which runs the compressor worker
+
+    """
+    pkg_dir = os.path.dirname(__file__)
+    return os.path.join(pkg_dir, 'yui_worker.js')
+
+
+def get_source_type(filename):
+    """Get source type (js or css) of a file for the compressor
+
+    """
+    _, ext = os.path.splitext(filename)
+    if ext.lower() == '.css':
+        return 'css'
+    return 'js'
+
+
+class YUICompressorWorker(object):
+    """A long-lived YUI Compressor process which compresses many files over
+    a pipe, so that we only pay JVM start up once
+
+    """
+
+    def __init__(self, jar_path=None, java='java', logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: path to YUI compressor jar file
+        self.jar_path = jar_path or get_yui_compressor()
+        #: java executable
+        self.java = java
+        #: the running JVM process
+        self.process = None
+
+    def start(self):
+        """Start the JVM process
+
+        """
+        self.logger.debug('Starting compressor worker ...')
+        self.process = subprocess.Popen(
+            [
+                self.java, '-cp', self.jar_path,
+                'org.mozilla.javascript.tools.shell.Main',
+                get_worker_script(),
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def compress(self, content, source_type):
+        """Compress content of given source type (js or css) and return
+        the result
+
+        """
+        if self.process is None:
+            self.start()
+        try:
+            self.process.stdin.write('%s %d\n' % (source_type, len(content)))
+            self.process.stdin.write(content)
+            self.process.stdin.flush()
+            header = self.process.stdout.readline()
+        except IOError, e:
+            self.close()
+            raise CompressorError('Compressor worker is gone: %s' % e)
+        if not header:
+            self.close()
+            raise CompressorError('Compressor worker exited unexpectedly')
+        try:
+            status, length = header.split()
+            length = int(length)
+        except ValueError:
+            self.close()
+            raise CompressorError('Malformed response header from '
+                                  'compressor worker: %r' % header)
+        try:
+            output = self.process.stdout.read(length)
+        except IOError, e:
+            self.close()
+            raise CompressorError('Compressor worker is gone: %s' % e)
+        if len(output) != length:
+            # the worker died in the middle of response
+            self.close()
+            raise CompressorError('Truncated response from compressor '
+                                  'worker, %d of %d bytes' % (len(output), 
+                                                              length))
+        if status != 'OK':
+            raise CompressorError(output)
+        return output
+
+    def compress_file(self, filename):
+        """Compress a file and return the result
+
+        """
+        with open(filename, 'rb') as file:
+            content = file.read()
+        try:
+            return self.compress(content, get_source_type(filename))
+        except CompressorError, e:
+            raise CompressorError('Failed to compress %s: %s' % (filename, e))
+
+    def close(self):
+        """Stop the JVM process
+
+        """
+        if self.process is None:
+            return
+        process = self.process
+        self.process = None
+        try:
+            process.stdin.close()
+        except IOError:
+            pass
+        process.wait()
+
+
+class CompressorPool(object):
+    """A small pool of compressor workers, each file is compressed by
+    the first idle worker
+
+    """
+
+    def __init__(self, size=1, jar_path=None, java='java', logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: name and version of the compressor
+        self.identity = os.path.basename(jar_path or get_yui_compressor())
+        #: all workers in this pool
+        self.workers = []
+        self._idle = Queue.Queue()
+        for _ in xrange(max(size, 1)):
+            worker = YUICompressorWorker(jar_path, java, logger=self.logger)
+            self.workers.append(worker)
+            self._idle.put(worker)
+
+    def compress_file(self, filename):
+        """Compress a file with an idle worker and return the result
+
+        """
+        worker = self._idle.get()
+        try:
+            return worker.compress_file(filename)
+        finally:
+            self._idle.put(worker)
+
+    def close(self):
+        """Stop all workers
+
+        """
+        for worker in self.workers:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,11 +1,106 @@
 import os
 import logging
 import hashlib
-import shutil
 import urlparse
+import posixpath
+import threading
+import time
+import tempfile
+from multiprocessing.pool import ThreadPool
 
-from kagin.link_css import replace_css_links
-from kagin.utils import url_path
+from kagin.link_css import CSSLinkRewriter
+from kagin.utils import url_path, atomic_open
+from kagin.staging import stage_file
+from kagin.inventory import AssetInventory
+from kagin.cache import ResolutionCache
+
+
+class HashCollisionError(ValueError):
+    """Raised when different files get the same truncated hash value
+    
+    """
+
+
+class DependencyCycleError(ValueError):
+    """Raised when CSS files refer to each other in a cycle, so that they
+    cannot be hashed in dependency order
+    
+    """
+
+
+def topological_sort(graph):
+    """Sort nodes of graph, a dict from node to nodes it depends on, so 
+    that every node comes after its dependencies, dependencies which are
+    not nodes of graph are ignored. Raise DependencyCycleError if there is 
+    a cycle
+    
+    """
+    order = []
+    # nodes are visiting if they are in the path, or done if they are in
+    # order already
+    visiting = []
+    done = set()
+    
+    def visit(node):
+        if node in done:
+            return
+        if node in visiting:
+            cycle = visiting[visiting.index(node):] + [node]
+            raise DependencyCycleError(
+                'Dependency cycle %s' % ' -> '.join(cycle)
+            )
+        visiting.append(node)
+        for dependency in sorted(graph[node]):
+            if dependency in graph:
+                visit(dependency)
+        visiting.pop()
+        done.add(node)
+        order.append(node)
+    
+    for node in sorted(graph):
+        visit(node)
+    return order
+
+
+def get_hash_type(name, digest_size=None):
+    """Get hash type by name, blake2b and blake2s (from hashlib, or the 
+    pyblake2 package for older Python) accept digest_size in bytes for 
+    shorter digests
+    
+    """
+    if name in ('blake2b', 'blake2s'):
+        module = hashlib
+        if not hasattr(hashlib, name):
+            import pyblake2 as module
+        constructor = getattr(module, name)
+        if digest_size is None:
+            return constructor
+        
+        def hash_type(data=''):
+            return constructor(data, digest_size=digest_size)
+        return hash_type
+    if digest_size is not None:
+        raise ValueError('digest_size is not supported by %s' % name)
+    constructor = getattr(hashlib, name, None)
+    if constructor is None:
+        return lambda data='': hashlib.new(name, data)
+    return constructor
+
+
+# HashFile, file map and route function of a link worker process
+_link_worker = None
+
+
+def _init_link_worker(hash_file, file_map, route_url):
+    global _link_worker
+    _link_worker = (hash_file, file_map, route_url)
+
+
+def _link_worker_task(task):
+    hash_file, file_map, route_url = _link_worker
+    input_url, file_path, output_filename = task
+    return hash_file.link_to_temp(input_url, file_path, output_filename, 
+                                  file_map, route_url)
 
 
 class HashFile(object):
@@ -21,13 +116,25 @@ class HashFile(object):
         hash_type=hashlib.md5, 
         hash_version='',
         exclude_files=None, 
+        manifest=None,
+        hash_cache=None,
+        jobs=1,
+        digest_length=None,
+        staging='copy',
+        link_processes=1,
         logger=None,
     ):
         self.logger = logger
         if self.logger is None:
             self.logger = logging.getLogger(__name__)
-        #: path to input directory
-        self.input_dir = input_dir
+        if isinstance(input_dir, basestring):
+            input_dir = [input_dir]
+        #: list of input directories layered as one input tree, files in 
+        #: later directories shadow files with the same relative path in 
+        #: earlier ones
+        self.input_dirs = list(input_dir)
+        #: path to the first input directory
+        self.input_dir = self.input_dirs[0]
         #: path to output directory
         self.output_dir = output_dir
         #: type of hash function to run, MD5 as default value
@@ -36,6 +143,55 @@ class HashFile(object):
         self.exclude_files = exclude_files
         #: the version string for generating different hash name
         self.hash_version = hash_version
+        #: BuildManifest for incremental build, outputs are always written
+        #: if it is None
+        self.manifest = manifest
+        #: HashCache for digests of unchanged files, always read files if 
+        #: it is None
+        self.hash_cache = hash_cache
+        #: number of files to hash concurrently
+        self.jobs = jobs
+        #: number of hex digits to keep in hash values, keep all if it is
+        #: None
+        self.digest_length = digest_length
+        #: how files are output, see kagin.staging.stage_file
+        self.staging = staging
+        #: number of processes to rewrite links in CSS files, rewrite in 
+        #: current process if it is 1
+        self.link_processes = link_processes
+        #: size of slices of memory mapped files fed to the hash
+        self.slice_size = 8 * 1024 * 1024
+        #: rewriter of links in CSS files
+        self.rewriter = CSSLinkRewriter(logger=self.logger)
+        #: cache of resolve_url results, shared by all CSS files
+        self.resolution_cache = ResolutionCache(self.resolve_url, 
+                                                logger=self.logger)
+        self._lock = threading.Lock()
+        
+    @property
+    def hash_length(self):
+        """Number of hex digits in hash values
+        
+        """
+        length = self.hash_type().digest_size * 2
+        if self.digest_length:
+            length = min(length, self.digest_length)
+        return length
+        
+    @property
+    def hash_name(self):
+        """Name of hash type with hash length, such as md5-32
+        
+        """
+        return '%s-%d' % (self.hash_type().name.lower(), self.hash_length)
+    
+    @property
+    def truncated(self):
+        """Whether hash values are shorter than 128 bits, so that collisions
+        have to be checked
+        
+        """
+        return self.hash_length < 32
         
     def compute_hash(self, filename):
         """Compute hash value of a file
@@ -43,82 +199,384 @@ class HashFile(object):
         """
         import mmap
         hash = self.hash_type(self.hash_version)
-        if not os.path.getsize(filename):
-            return hash.hexdigest()
-        chunk_size = 4096
-        with open(filename, 'rb') as file:
-            map = mmap.mmap(file.fileno(), 0, 
-                            access=mmap.ACCESS_READ)
-            while True:
-                chunk = map.read(chunk_size)
-                if not chunk:
-                    break
-                hash.update(chunk)
-        return hash.hexdigest()
-    
-    def run_hashing(self):
-        """Run hashing process
+        size = os.path.getsize(filename)
+        if size:
+            with open(filename, 'rb') as file:
+                map = mmap.mmap(file.fileno(), 0, 
+                                access=mmap.ACCESS_READ)
+                try:
+                    # feed slices of the mapping without copying them
+                    for offset in xrange(0, size, self.slice_size):
+                        hash.update(buffer(map, offset, self.slice_size))
+                finally:
+                    map.close()
+        return hash.hexdigest()[:self.digest_length]
+    
+    def compute_content_hash(self, content):
+        """Compute hash value of content in memory
+        
+        """
+        hash = self.hash_type(self.hash_version)
+        hash.update(content)
+        return hash.hexdigest()[:self.digest_length]
+    
+    def get_hash(self, filename, stat=None):
+        """Get hash value of a file from hash cache, compute it if it is
+        not cached
         
         """
+        if self.hash_cache is None:
+            return self.compute_hash(filename)
+        if stat is None:
+            stat = os.stat(filename)
+        hash = self.hash_cache.get(filename, stat)
+        if hash is None:
+            hash = self.compute_hash(filename)
+            self.hash_cache.set(filename, stat, hash)
+        return hash
+    
+    def scan(self):
+        """Scan input directories as one layered AssetInventory
+        
+        """
+        return AssetInventory.scan(self.input_dirs, logger=self.logger)
+    
+    def _hash_task(self, asset):
+        return self.hash_file(asset.file_path, asset.path, asset.stat)
+    
+    def _map(self, func, items):
+        """Map items with func, run in a pool of jobs threads when jobs is 
+        greater than 1, the results are in the same order as items
+        
+        """
+        if self.jobs <= 1 or len(items) <= 1:
+            return map(func, items)
+        pool = ThreadPool(min(self.jobs, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+    
+    def resolve_url(self, css_dir, url):
+        """Resolve URL in a CSS file in css_dir to a path in the input tree,
+        return None for absolute URLs
+        
+        """
+        parsed = urlparse.urlparse(url)
+        # we don't want to map absolute URLs
+        if parsed.scheme:
+            return
+        if parsed.path.startswith('/'):
+            return
+        return posixpath.normpath(posixpath.join(css_dir, url))
+    
+    def hash_file(self, file_path, input_path=None, stat=None):
+        """Hash a file and output it with hash file name, return a tuple
+        of (input path, output path, os.stat result, file path)
+        
+        """
+        if stat is None:
+            stat = os.stat(file_path)
+        # compute hash value of file here
+        hash = self.get_hash(file_path, stat)
+        _, ext = os.path.splitext(file_path)
+        output_name = os.path.join(self.output_dir, hash + ext)
+        # make relative path
+        if input_path is None:
+            input_path = url_path(file_path, self.input_dir)
+        output_path = url_path(output_name, self.output_dir)
+        result = (input_path, output_path, stat, file_path)
+        
+        if self.manifest is not None:
+            output = 'hash:' + output_path
+            inputs = [['digest', hash]]
+            with self._lock:
+                if self.manifest.is_fresh(output, inputs, output_name):
+                    return result
+                self.manifest.update(output, inputs)
+                # a new copy has links to be rewritten again
+                self.manifest.discard('link:' + output_path)
+        
+        # copy file, CSS files get a private copy as their links are 
+        # rewritten later
+        stage_file(file_path, output_name, self.staging, 
+                   private=ext.lower() == '.css')
+        self.logger.info('Output %s as %s', input_path, output_path)
+        return result
+    
+    def run_hashing(self, inventory=None, output_inventory=None):
+        """Run hashing process, input files are taken from inventory if it
+        is given, otherwise input directories are scanned. Hashed files are
+        added to output_inventory if it is given
+        
+        """
+        if inventory is None:
+            inventory = self.scan()
+        begin = time.time()
+        results = self._map(self._hash_task, list(inventory))
+        return self._finish_hashing(results, begin, output_inventory)
+    
+    def _finish_hashing(self, results, begin, output_inventory=None):
+        """Make file map from results of hash_file, check collisions and
+        report throughput
+        
+        """
+        elapsed = max(time.time() - begin, 1e-6)
+        
         file_map = {}
-        for root, _, filenames in os.walk(self.input_dir):
-            for filename in filenames:
-                file_path = os.path.join(root, filename)
-                # TODO: exclude files here
-                
-                # compute hash value of file here
-                hash = self.compute_hash(file_path)
-                _, ext = os.path.splitext(file_path)
-                output_name = os.path.join(self.output_dir, hash + ext)
-                
-                # copy file
-                shutil.copy(file_path, output_name)
-                # make relative path
-                input_path = url_path(file_path, self.input_dir)
-                output_path = url_path(output_name, self.output_dir)
-                file_map[input_path] = output_path
-                self.logger.info('Output %s as %s', input_path, output_path)
+        total_size = 0
+        for input_path, output_path, stat, _ in results:
+            file_map[input_path] = output_path
+            total_size += stat.st_size
+            if output_inventory is not None:
+                output_inventory.add(
+                    output_path, 
+                    os.path.join(self.output_dir, output_path), 
+                    stat,
+                )
+        if self.truncated:
+            self.check_collisions(results)
+        if self.hash_cache is not None:
+            self.hash_cache.save()
+        self.logger.info(
+            'Hashed %s files (%.1f MB) in %.2fs with %s jobs, '
+            '%.1f files/s, %.1f MB/s',
+            len(results), total_size / 1048576.0, elapsed, self.jobs,
+            len(results) / elapsed, total_size / 1048576.0 / elapsed
+        )
         return file_map
         
-    def run_linking(self, file_map, route_url):
-        """Run linking process
+    def check_collisions(self, results):
+        """Check that files with the same hash value have the same content,
+        raise HashCollisionError otherwise
+        
+        """
+        import filecmp
+        first_files = {}
+        for input_path, output_path, _, file_path in results:
+            first = first_files.setdefault(output_path, file_path)
+            if first == file_path:
+                continue
+            if not filecmp.cmp(first, file_path, shallow=False):
+                raise HashCollisionError(
+                    'Hash collision of %s and %s as %s, use a longer '
+                    'digest' % (first, file_path, output_path)
+                )
+        
+    def run_linking(self, file_map, route_url, inventory=None, 
+                    output_inventory=None):
+        """Run linking process, CSS files are taken from inventory if it is
+        given, otherwise input directories are scanned. Rewritten files are
+        updated in output_inventory if it is given
         
         """
-        for root, _, filenames in os.walk(self.input_dir):
-            for filename in filenames:
-                file_path = os.path.join(root, filename)
-                _, ext = os.path.splitext(file_path)
-                if ext.lower() != '.css':
+        if inventory is None:
+            inventory = self.scan()
+        css_files = inventory.by_ext('.css')
+        if (self.link_processes > 1 and len(css_files) > 1 and 
+                hasattr(os, 'fork')):
+            self._run_linking_parallel(css_files, file_map, route_url, 
+                                       output_inventory)
+            return
+        for asset in css_files:
+            input_url = asset.path
+            file_path = asset.file_path
+            
+            # list of [url, new url] resolved in this file
+            resolved = []
+            map_func = self._link_map_func(posixpath.dirname(input_url), 
+                                           file_map, route_url, resolved)
+            
+            # output filename
+            output_path = file_map.get(input_url)
+            output_filename = os.path.join(self.output_dir, output_path)
+            # the output is a copy of the input, read the input so that
+            # an output which is linked already can be linked again
+            with open(file_path, 'rt') as file:
+                if self.manifest is not None:
+                    # a CSS file has to be linked again when files it 
+                    # refers to get new hashed names
+                    self.rewriter.rewrite_stream(file, None, map_func)
+                    entry = 'link:' + output_path
+                    inputs = [['source', output_path]] + resolved
+                    if self.manifest.is_fresh(entry, inputs, 
+                                              output_filename):
+                        continue
+                    self.manifest.update(entry, inputs)
+                    file.seek(0)
+                # replace instead of writing in place, in case the output
+                # is a link to the input
+                with atomic_open(output_filename, 'wt') as output:
+                    self.rewriter.rewrite_stream(file, output, map_func)
+            if output_inventory is not None:
+                output_inventory.add(output_path, output_filename)
+        self.resolution_cache.report()
+        
+    def _link_map_func(self, css_dir, file_map, route_url, resolved):
+        """Make map function for links in a CSS file in css_dir, which 
+        appends [url, new url] to resolved
+        
+        """
+        def map_func(url):
+            # get CSS path in the input tree
+            css_url = self.resolution_cache.resolve(css_dir, url)
+            new_url = file_map.get(css_url)
+            if new_url is None:
+                return
+            new_url = route_url(new_url)
+            resolved.append([url, new_url])
+            return new_url
+        return map_func
+    
+    def link_to_temp(self, input_url, file_path, output_filename, file_map, 
+                     route_url):
+        """Rewrite links of a CSS file into a temporary file in the 
+        directory of output_filename, return a tuple of (temporary path, 
+        list of [url, new url] resolved)
+        
+        """
+        resolved = []
+        map_func = self._link_map_func(posixpath.dirname(input_url), 
+                                       file_map, route_url, resolved)
+        dir = os.path.dirname(os.path.abspath(output_filename))
+        fd, temp_path = tempfile.mkstemp(dir=dir)
+        try:
+            os.chmod(temp_path, 0644)
+            with os.fdopen(fd, 'wt') as output:
+                with open(file_path, 'rt') as file:
+                    self.rewriter.rewrite_stream(file, output, map_func)
+        except:
+            os.remove(temp_path)
+            raise
+        return temp_path, resolved
+    
+    def _run_linking_parallel(self, css_files, file_map, route_url, 
+                              output_inventory=None):
+        """Rewrite links of CSS files in a pool of link_processes processes.
+        The pool is forked after file_map is built, so workers share it 
+        with current process instead of receiving a pickled copy for each 
+        file. Workers write temporary files, which replace outputs here
+        
+        """
+        import multiprocessing
+        tasks = []
+        for asset in css_files:
+            output_path = file_map.get(asset.path)
+            output_filename = os.path.join(self.output_dir, output_path)
+            tasks.append((asset.path, asset.file_path, output_filename))
+        pool = multiprocessing.Pool(
+            min(self.link_processes, len(tasks)),
+            initializer=_init_link_worker,
+            initargs=(self, file_map, route_url),
+        )
+        try:
+            results = pool.map(_link_worker_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+            
+        for task, (temp_path, resolved) in zip(tasks, results):
+            input_url, _, output_filename = task
+            output_path = file_map.get(input_url)
+            if self.manifest is not None:
+                entry = 'link:' + output_path
+                inputs = [['source', output_path]] + resolved
+                if self.manifest.is_fresh(entry, inputs, output_filename):
+                    os.remove(temp_path)
                     continue
-                
-                # directory path of CSS file
-                css_dir = os.path.dirname(file_path)
-                if css_dir:
-                    css_dir = css_dir + '/'
-                input_url = url_path(file_path, self.input_dir)
-                
-                def map_func(url):
-                    parsed = urlparse.urlparse(url)
-                    # we don't want to map absolute URLs
-                    if parsed.scheme:
-                        return
-                    if parsed.path.startswith('/'):
-                        return
-                    
-                    # get CSS path in file system
-                    css_path = os.path.join(css_dir, url)
-                    css_path = os.path.normpath(css_path)
-                    css_url = url_path(css_path, self.input_dir)
-                    new_url = file_map.get(css_url)
-                    if new_url is None:
-                        return
-                    return route_url(new_url)
-                
-                # output filename
-                output_filename = file_map.get(input_url)
-                output_filename = os.path.join(self.output_dir, output_filename)
-                with open(output_filename, 'rt') as file:
-                    css_content = file.read()
-                output = replace_css_links(css_content, map_func, self.logger)
-                with open(output_filename, 'wt') as file:
-                    file.write(output)
+                self.manifest.update(entry, inputs)
+            os.rename(temp_path, output_filename)
+            if output_inventory is not None:
+                output_inventory.add(output_path, output_filename)
+        self.logger.info('Linked %s CSS files with %s processes', 
+                         len(tasks), self.link_processes)
+
+    def css_graph(self, inventory):
+        """Build graph of CSS files, a dict from path of each CSS file to
+        paths of files in inventory it refers to
+        
+        """
+        graph = {}
+        for asset in inventory.by_ext('.css'):
+            css_dir = posixpath.dirname(asset.path)
+            dependencies = set()
+            
+            def map_func(url):
+                path = self.resolution_cache.resolve(css_dir, url)
+                if path is not None and path in inventory:
+                    dependencies.add(path)
+            
+            with open(asset.file_path, 'rt') as file:
+                self.rewriter.rewrite_stream(file, None, map_func)
+            graph[asset.path] = dependencies
+        return graph
+    
+    def hash_css(self, asset, file_map, route_url, outputs):
+        """Rewrite links of a CSS file with file_map, then output it with
+        hash of the rewritten content, return a tuple as hash_file. outputs
+        is a dict from output path to content written in current run for
+        checking collisions
+        
+        """
+        css_dir = posixpath.dirname(asset.path)
+        
+        def map_func(url):
+            path = self.resolution_cache.resolve(css_dir, url)
+            new_url = file_map.get(path)
+            if new_url is None:
+                return
+            return route_url(new_url)
+        
+        with open(asset.file_path, 'rt') as file:
+            content = file.read()
+        output = self.rewriter.rewrite(content, map_func)
+        hash = self.compute_content_hash(output)
+        _, ext = os.path.splitext(asset.file_path)
+        output_name = os.path.join(self.output_dir, hash + ext)
+        output_path = url_path(output_name, self.output_dir)
+        
+        previous = outputs.setdefault(output_path, output)
+        if previous != output:
+            raise HashCollisionError(
+                'Hash collision of rewritten %s as %s, use a longer '
+                'digest' % (asset.file_path, output_path)
+            )
+        fresh = False
+        if self.manifest is not None:
+            entry = 'hash:' + output_path
+            inputs = [['digest', hash]]
+            fresh = self.manifest.is_fresh(entry, inputs, output_name)
+            if not fresh:
+                self.manifest.update(entry, inputs)
+        if not fresh:
+            with atomic_open(output_name, 'wt') as file:
+                file.write(output)
+            self.logger.info('Output %s as %s', asset.path, output_path)
+        return (asset.path, output_path, os.stat(output_name), output_name)
+    
+    def run_ordered(self, route_url, inventory=None, output_inventory=None):
+        """Run hashing and linking in dependency order, files which are not
+        CSS are hashed first, then CSS files are rewritten and hashed after
+        files they refer to, so that hash values of CSS files reflect 
+        rewritten links. Return the file map
+        
+        """
+        if inventory is None:
+            inventory = self.scan()
+        graph = self.css_graph(inventory)
+        order = topological_sort(graph)
+        begin = time.time()
+        files = [asset for asset in inventory if asset.path not in graph]
+        results = self._map(self._hash_task, files)
+        file_map = dict((result[0], result[1]) for result in results)
+        outputs = {}
+        for path in order:
+            result = self.hash_css(inventory.get(path), file_map, route_url, 
+                                   outputs)
+            file_map[path] = result[1]
+            results.append(result)
+        self.logger.info('Hashed %s CSS files in dependency order', 
+                         len(order))
+        self.resolution_cache.report()
+        return self._finish_hashing(results, begin, output_inventory)
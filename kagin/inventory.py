@@ -0,0 +1,148 @@
+import os
+import logging
+import mimetypes
+import collections
+
+from kagin.utils import url_path
+
+#: asset types of common extensions, others are guessed from MIME type
+ASSET_TYPES = {
+    '.css': 'css',
+    '.js': 'js',
+    '.html': 'html',
+    '.htm': 'html',
+    '.json': 'json',
+    '.svg': 'image',
+    '.woff': 'font',
+    '.woff2': 'font',
+    '.ttf': 'font',
+    '.otf': 'font',
+    '.eot': 'font',
+}
+
+
+def get_asset_type(ext):
+    """Get asset type (css, js, html, json, image, font, video, audio, text
+    or other) of a file extension
+
+    """
+    ext = ext.lower()
+    asset_type = ASSET_TYPES.get(ext)
+    if asset_type is not None:
+        return asset_type
+    mime_type, _ = mimetypes.guess_type('file' + ext)
+    if mime_type is None:
+        return 'other'
+    major = mime_type.split('/')[0]
+    if major in ('image', 'video', 'audio', 'text'):
+        return major
+    return 'other'
+
+
+#: an asset in the inventory, path is the URL-style path relative to the
+#: asset tree, file_path is the physical path, stat is the os.stat result
+Asset = collections.namedtuple('Asset', [
+    'path', 'file_path', 'size', 'mtime', 'ext', 'type', 'stat',
+])
+
+
+class AssetInventory(object):
+    """In-memory inventory of assets in a (layered) tree, built by scanning
+    the file system once and shared by build stages, so that stages query
+    it instead of walking and stating files again
+
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: map from path to Asset
+        self.assets = {}
+
+    @classmethod
+    def scan(cls, roots, logger=None):
+        """Scan directories as one layered tree and return the inventory,
+        files in later directories shadow files with the same relative
+        path in earlier ones
+
+        """
+        inventory = cls(logger=logger)
+        for root in roots:
+            if not os.path.isdir(root):
+                continue
+            for dir_path, _, filenames in os.walk(root):
+                for filename in filenames:
+                    file_path = os.path.join(dir_path, filename)
+                    inventory.add(url_path(file_path, root), file_path)
+        inventory.logger.debug('Scanned %s assets in %s',
+                               len(inventory), roots)
+        return inventory
+
+    def add(self, path, file_path, stat=None):
+        """Add or replace an asset, stat the file if stat is not given
+
+        """
+        if stat is None:
+            stat = os.stat(file_path)
+        _, ext = os.path.splitext(path)
+        asset = Asset(
+            path=path,
+            file_path=file_path,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            ext=ext.lower(),
+            type=get_asset_type(ext),
+            stat=stat,
+        )
+        self.assets[path] = asset
+        return asset
+
+    def refresh(self, path, file_path):
+        """Update an asset after the file changed, or remove it if the file
+        does not exist anymore
+
+        """
+        try:
+            return self.add(path, file_path)
+        except OSError:
+            self.remove(path)
+
+    def remove(self, path):
+        """Remove an asset if it exists
+
+        """
+        self.assets.pop(path, None)
+
+    def get(self, path):
+        return self.assets.get(path)
+
+    def __contains__(self, path):
+        return path in self.assets
+
+    def __len__(self):
+        return len(self.assets)
+
+    def __iter__(self):
+        """Iterate assets sorted by path
+
+        """
+        for path in sorted(self.assets):
+            yield self.assets[path]
+
+    def by_ext(self, *exts):
+        """Assets with given extensions (such as .css), sorted by path
+
+        """
+        exts = set(ext.lower() for ext in exts)
+        return [asset for asset in self if asset.ext in exts]
+
+    def by_type(self, *types):
+        """Assets of given types (such as css or image), sorted by path
+
+        """
+        return [asset for asset in self if asset.type in types]
+
+    @property
+    def total_size(self):
+        return sum(asset.size for asset in self.assets.itervalues())
@@ -0,0 +1,169 @@
+import os
+import json
+import hashlib
+import logging
+
+
+def build_fingerprint(inventory):
+    """Compute fingerprint of a build from paths and sizes of assets in an
+    AssetInventory of hash output, files are not read. Names of hashed
+    files contain digests of their content, so the fingerprint stays the
+    same when the same build is made again
+
+    """
+    digest = hashlib.md5()
+    for asset in inventory:
+        digest.update('%s\0%d\n' % (asset.path.encode('utf8'), asset.size))
+    return digest.hexdigest()
+
+
+class UploadJournal(object):
+    """On-disk journal of an upload of a build, so that an interrupted
+    upload can be resumed without listing the storage again. The first
+    line of the journal is the plan, the fingerprint of the build and
+    names of files to upload, every following line is a completed upload.
+    Completed uploads are appended and synced to disk in batches of
+    batch_size, so at most one batch is uploaded again after a crash
+
+    """
+
+    def __init__(self, path, fingerprint, bucket_name, batch_size=100,
+                 logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: path to journal file
+        self.path = path
+        #: fingerprint of the build to upload
+        self.fingerprint = fingerprint
+        #: name of bucket
+        self.bucket_name = bucket_name
+        #: number of completed uploads written to disk at once
+        self.batch_size = batch_size
+        #: names of files to upload, None if there is no plan yet
+        self.names = None
+        #: map from name to MD5 digest of completed uploads
+        self.done = {}
+        #: completed uploads not written to disk yet
+        self.pending = []
+        #: size of valid content in journal file
+        self.size = 0
+        self.file = None
+        self.load()
+
+    def load(self):
+        """Load journal from file, a journal of another build is ignored
+
+        """
+        self.names = None
+        self.done = {}
+        self.size = 0
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as file:
+            lines = file.read().splitlines(True)
+        try:
+            plan = json.loads(lines[0])
+        except (IndexError, ValueError):
+            self.logger.warn('Ignore corrupted upload journal %s', self.path)
+            return
+        if (plan.get('fingerprint') != self.fingerprint or
+                plan.get('bucket') != self.bucket_name):
+            self.logger.info('Upload journal is of another build, ignored')
+            return
+        self.names = plan['names']
+        self.size = len(lines[0])
+        for line in lines[1:]:
+            try:
+                if not line.endswith('\n'):
+                    raise ValueError('Incomplete line')
+                name, digest = json.loads(line)
+            except ValueError:
+                # the last line may be partially written before a crash
+                break
+            self.done[name] = digest
+            self.size += len(line)
+
+    @property
+    def resumable(self):
+        """Whether there is a plan of this build to resume
+
+        """
+        return self.names is not None
+
+    @property
+    def remaining(self):
+        """Names of planned files which are not uploaded yet
+
+        """
+        return [name for name in self.names if name not in self.done]
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def start(self, names):
+        """Start a new journal with names of files to upload
+
+        """
+        self.close()
+        self.names = list(names)
+        self.done = {}
+        self.file = open(self.path, 'wb')
+        self.file.write(json.dumps(dict(
+            fingerprint=self.fingerprint,
+            bucket=self.bucket_name,
+            names=self.names,
+        )) + '\n')
+        self._sync()
+
+    def open(self):
+        """Open the journal for appending completed uploads
+
+        """
+        if self.file is None:
+            self.file = open(self.path, 'r+b')
+            # drop the partially written line, if any
+            self.file.seek(self.size)
+            self.file.truncate()
+
+    def add(self, name, digest=None):
+        """Record a completed upload, written to disk when a batch is full
+
+        """
+        self.done[name] = digest
+        self.pending.append((name, digest))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write pending completed uploads to disk
+
+        """
+        if not self.pending:
+            return
+        self.open()
+        self.file.write(''.join(json.dumps(entry) + '\n'
+                                for entry in self.pending))
+        self._sync()
+        self.pending = []
+
+    def close(self):
+        """Flush and close the journal file
+
+        """
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        """Remove the journal after the upload is finished
+
+        """
+        self.close()
+        self.pending = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.names = None
+        self.done = {}
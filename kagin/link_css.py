@@ -2,41 +2,57 @@ import re
 import logging
 import urlparse
 
+_URL_CHARS = r'[a-zA-Z0-9\-\./_\?=#&]'
+
+#: pattern of url() in CSS, compiled once for all rewriters
+URL_PATTERN = re.compile(
+    r"""url\s*\(\s*['"]?(?P<url>""" + _URL_CHARS + r"""+)['"]?\s*\)""",
+    flags=re.I | re.M
+)
+
+# pattern of an unfinished url() at the end of a chunk, which may become
+# a match of URL_PATTERN with following content
+_PARTIAL_PATTERN = re.compile(
+    r"""u(?:r(?:l\s*(?:\(\s*['"]?""" + _URL_CHARS +
+    r"""*['"]?\s*)?)?)?\Z""",
+    flags=re.I
+)
+
+
+class CSSLinkRewriter(object):
+    """Rewriter of URL links in CSS, parse results of URLs are memoized, so
+    a rewriter is supposed to be reused for many CSS files
 
-def replace_css_links(content, map_func, logger=None):
-    """Replace CSS URL links
-    
     """
-    if logger is None:
-        logger = logging.getLogger(__name__)
-    url_pattern = '(?P<url>[a-zA-Z0-9\-\./_\?=#&]+)'
-    pattern = re.compile(
-        r"""url\s*\(\s*['"]?""" + url_pattern + r"""['"]?\s*\)""", 
-        flags=re.I | re.M
-    )
-    # result of all replaced lines
-    result = []
-    # start of previous match
-    previous = 0
-    for match in pattern.finditer(content): 
-        start = match.start(1)
-        end = match.end(1)
-        url = match.group(1)
 
+    def __init__(self, logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: map from URL to (stripped URL, query, fragment, ends with ?)
+        self.parsed_urls = {}
+
+    def parse_url(self, url):
+        """Parse URL into a tuple of (URL without query and fragment,
+        query, fragment, whether there is a question mark)
+
+        """
+        parsed = self.parsed_urls.get(url)
+        if parsed is not None:
+            return parsed
         endswith_q = False
         striped_url = url
         ori_result = urlparse.urlparse(url)
         if ori_result.query or ori_result.fragment:
             new_result = urlparse.ParseResult(
-                scheme=ori_result.scheme, 
-                netloc=ori_result.netloc, 
-                path=ori_result.path, 
-                params=ori_result.params, 
-                query='', 
-                fragment='' 
+                scheme=ori_result.scheme,
+                netloc=ori_result.netloc,
+                path=ori_result.path,
+                params=ori_result.params,
+                query='',
+                fragment=''
             )
             striped_url = new_result.geturl()
-            logger.info('Strip url to %s', striped_url)
 
         if striped_url.endswith('?'):
             striped_url = striped_url[:-1]
@@ -46,21 +62,81 @@ def replace_css_links(content, map_func, logger=None):
         if '?' in url and '#' in url and url.index('?') < url.index('#'):
             endswith_q = True
 
-        new_url = map_func(striped_url)
-        if new_url is None:
-            logger.info('Cannot find %r', striped_url)
-            result.append(content[previous:start])
-            result.append(url)
+        parsed = (striped_url, ori_result.query, ori_result.fragment,
+                  endswith_q)
+        self.parsed_urls[url] = parsed
+        return parsed
+
+    def _rewrite(self, content, map_func, write):
+        """Rewrite URL links in content with map_func, pass pieces of
+        result to write, or only call map_func if write is None
+
+        """
+        previous = 0
+        for match in URL_PATTERN.finditer(content):
+            start = match.start(1)
+            end = match.end(1)
+            url = match.group(1)
+            striped_url, query, fragment, endswith_q = self.parse_url(url)
+            if query or fragment:
+                self.logger.info('Strip url to %s', striped_url)
+
+            new_url = map_func(striped_url)
+            if new_url is None:
+                self.logger.info('Cannot find %r', striped_url)
+                continue
+            if query or endswith_q:
+                new_url = new_url + '?' + query
+            if fragment:
+                new_url = new_url + '#' + fragment
+            self.logger.info('Replace %s with %s', url, new_url)
+            if write is not None:
+                write(content[previous:start])
+                write(new_url)
             previous = end
-            continue
-        else:
-            if ori_result.query or endswith_q:
-                new_url = new_url + '?' + ori_result.query
-            if ori_result.fragment:
-                new_url = new_url + '#' + ori_result.fragment
-        logger.info('Replace %s with %s', url, new_url)
-        result.append(content[previous:start])
-        result.append(new_url)
-        previous = end
-    result.append(content[previous:])
-    return ''.join(result)
+        if write is not None:
+            write(content[previous:])
+
+    def rewrite(self, content, map_func):
+        """Replace URL links in content with results of map_func, links are
+        kept if map_func returns None
+
+        """
+        result = []
+        self._rewrite(content, map_func, result.append)
+        return ''.join(result)
+
+    def rewrite_stream(self, input_file, output_file, map_func,
+                       chunk_size=64 * 1024):
+        """Read CSS from input_file in chunks and write rewritten CSS to
+        output_file, so that only a chunk and an unfinished link at the end
+        of it are in memory. If output_file is None, only map_func is
+        called for the links
+
+        """
+        write = None
+        if output_file is not None:
+            write = output_file.write
+        pending = ''
+        while True:
+            chunk = input_file.read(chunk_size)
+            if not chunk:
+                break
+            content = pending + chunk
+            # a link may continue in next chunk, keep it for next round,
+            # an unfinished link never contains ")"
+            partial = _PARTIAL_PATTERN.search(content, 
+                                              content.rfind(')') + 1)
+            split = len(content)
+            if partial is not None:
+                split = partial.start()
+            self._rewrite(content[:split], map_func, write)
+            pending = content[split:]
+        self._rewrite(pending, map_func, write)
+
+
+def replace_css_links(content, map_func, logger=None):
+    """Replace CSS URL links
+    
+    """
+    return CSSLinkRewriter(logger).rewrite(content, map_func)
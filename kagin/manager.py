@@ -1,11 +1,24 @@
 import os
+import re
+import time
 import logging
 import shutil
 import json
+import hashlib
 
 from kagin.minify import FileConfig, Builder
-from kagin.hash import HashFile
-from storage import S3Storage
+from kagin.compressor import CompressorPool
+from kagin.cache import MinifyCache, HashCache
+from kagin.hash import HashFile, get_hash_type
+from kagin.manifest import BuildManifest, file_digest
+from kagin.watch import make_watcher
+from kagin.inventory import AssetInventory
+from kagin.precompress import Precompressor, gzip_file, ENCODING_SUFFIXES
+from kagin.upload import Uploader, HeaderPolicy, make_task
+from kagin.snapshot import RemoteSnapshot
+from kagin.journal import UploadJournal, build_fingerprint
+from kagin.utils import atomic_open
+from storage import S3Storage, parse_last_modified
 
 
 class KaginManager(object):
@@ -31,11 +44,25 @@ class KaginManager(object):
         self.file_map
         
         self.minify_dir = os.path.join(self.output_dir, 'minify')
-        self.hash_input_dir = os.path.join(self.output_dir, 'hash_input')
         self.hash_output_dir = os.path.join(self.output_dir, 'hash_output')
-        self.prepare_dir(self.minify_dir)
-        self.prepare_dir(self.hash_input_dir)
-        self.prepare_dir(self.hash_output_dir)
+        
+        #: how files are staged, see kagin.staging.stage_file
+        self.staging = self.config.get('staging', 'copy')
+        #: only rebuild outputs whose inputs changed since last build
+        self.incremental = self.config.get('incremental', False)
+        self.manifest = None
+        #: AssetInventory of hash input tree (input files overlaid with 
+        #: minified files), scanned once per build and shared by stages
+        self.inventory = None
+        #: AssetInventory of files in hash output directory
+        self.output_inventory = None
+        if self.incremental:
+            self.manifest = self.make_manifest()
+            self.ensure_dir(self.minify_dir)
+            self.ensure_dir(self.hash_output_dir)
+        else:
+            self.prepare_dir(self.minify_dir)
+            self.prepare_dir(self.hash_output_dir)
         
         self.mini_js_ext = '.mini.js'
         self.mini_css_ext = '.mini.css'
@@ -46,7 +73,8 @@ class KaginManager(object):
             name = group['name']
             files = group['files']
             gzip = group.get('gzip', True)
-            self.js_config.add_group(name, files, gzip)
+            minifier = group.get('minifier')
+            self.js_config.add_group(name, files, gzip, minifier)
             
         # init CSS groups
         self.css_config = FileConfig(self.input_dir)
@@ -54,12 +82,43 @@ class KaginManager(object):
             name = group['name']
             files = group['files']
             gzip = group.get('gzip', True)
-            self.css_config.add_group(name, files, gzip)
+            minifier = group.get('minifier')
+            self.css_config.add_group(name, files, gzip, minifier)
             
+        # hash input directory and minified files as one layered input 
+        # tree, instead of staging them into one directory
         self.hash_file = HashFile(
-            self.hash_input_dir, 
+            [self.input_dir, self.minify_dir], 
             self.hash_output_dir,
-            hash_version=self.config.get('hash_version', '')
+            hash_type=get_hash_type(
+                self.config.get('hash_type', 'md5'), 
+                self.config.get('hash_digest_size'),
+            ),
+            hash_version=self.config.get('hash_version', ''),
+            manifest=self.manifest,
+            jobs=self.config.get('hash_jobs', self.config.get('jobs', 1)),
+            digest_length=self.config.get('hash_length'),
+            staging=self.staging,
+            link_processes=self.config.get('link_processes', 1),
+        )
+        if self.config.get('hash_cache'):
+            self.hash_file.hash_cache = HashCache(
+                self.config['hash_cache'],
+                hash_name=self.hash_file.hash_name,
+                hash_version=self.hash_file.hash_version,
+                logger=self.logger,
+            )
+        
+    def make_manifest(self):
+        """Create BuildManifest for incremental build
+        
+        """
+        return BuildManifest(
+            self.config.get(
+                'manifest', 
+                os.path.join(self.output_dir, 'manifest.json')
+            ),
+            logger=self.logger,
         )
         
     def read_file_map(self):
@@ -78,38 +137,115 @@ class KaginManager(object):
             shutil.rmtree(path, ignore_errors=True)
         os.mkdir(path)
         
-    def copy_files(self, src, dest):
-        """Copy files in src directory to dest directory
-        
-        """
-        self.logger.debug('Copying files from %s to %s ...', src, dest)
-        for root, dirs, filenames in os.walk(src):
-            for dir in dirs:
-                dir_path = os.path.join(root, dir)
-                rel_dir = os.path.relpath(dir_path, src)
-                dest_dir = os.path.join(dest, rel_dir)
-                self.logger.debug('Create directory %s ...', dest_dir)
-                os.mkdir(dest_dir)
-            for filename in filenames:
-                file_path = os.path.join(root, filename)
-                repl_path = os.path.relpath(file_path, src)
-                dest_path = os.path.join(dest, repl_path)
-                shutil.copy(file_path, dest_path)
-        
-    def do_minify(self): 
-        builder = Builder(self.input_dir, self.minify_dir)
-        builder.build(self.js_config, self.mini_js_ext)
-        builder.build(self.css_config, self.mini_css_ext)
+    def ensure_dir(self, path):
+        """Make a directory if it does not exist
+        
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        
+    def remove_stale_outputs(self, stages):
+        """Remove outputs of given stages from previous builds which are 
+        not produced by current build anymore
+        
+        """
+        stage_dirs = dict(
+            minify=(self.minify_dir, self.inventory),
+            hash=(self.hash_output_dir, self.output_inventory),
+            gzip=(self.hash_output_dir, self.output_inventory),
+            precompress=(self.hash_output_dir, self.output_inventory),
+        )
+        for output in self.manifest.stale_outputs():
+            stage, _, rel_path = output.partition(':')
+            if stage not in stages:
+                continue
+            dir, inventory = stage_dirs[stage]
+            if inventory is not None:
+                inventory.remove(rel_path)
+            path = os.path.join(dir, rel_path)
+            if os.path.exists(path):
+                self.logger.info('Remove stale output %s', path)
+                os.remove(path)
+        
+    def make_minify_cache(self):
+        """Create MinifyCache from config, return None if there is no
+        minify_cache_dir in config
+        
+        """
+        cache_dir = self.config.get('minify_cache_dir')
+        if not cache_dir:
+            return
+        return MinifyCache(
+            cache_dir,
+            max_size=self.config.get('minify_cache_size', 256 * 1024 * 1024),
+            logger=self.logger,
+        )
+        
+    def do_minify(self, js_config=None, css_config=None): 
+        # number of files to minify concurrently
+        jobs = self.config.get('jobs', 1)
+        # number of long-lived compressor processes, 0 means spawning a
+        # new compressor process for every file
+        workers = self.config.get('compressor_workers', jobs)
+        cache = self.make_minify_cache()
+        # workers start on demand, so no JVM runs when everything is cached
+        compressor = None
+        if workers:
+            compressor = CompressorPool(workers, logger=self.logger)
+        try:
+            builder = Builder(
+                self.input_dir, 
+                self.minify_dir, 
+                compressor=compressor,
+                default_minifier=self.config.get('default_minifier', 'yui'),
+                cache=cache,
+                manifest=self.manifest,
+                jobs=jobs,
+                inventory=self.inventory,
+            )
+            builder.build_all([
+                (js_config or self.js_config, self.mini_js_ext),
+                (css_config or self.css_config, self.mini_css_ext),
+            ])
+        finally:
+            if compressor is not None:
+                compressor.close()
+        if cache is not None:
+            cache.prune()
+            cache.report()
         
     def do_hash(self):
         route_func = lambda name: name
         if self.config.get('absolute_hashed_url', False):
             route_func = self.route_hashed_url
-        self.file_map = self.hash_file.run_hashing()
-        self.hash_file.run_linking(self.file_map, route_func)
+        if self.inventory is None:
+            self.inventory = self.hash_file.scan()
+        self.output_inventory = AssetInventory(logger=self.logger)
+        if self.config.get('hash_dependency_order', False):
+            # hash CSS files after links in them are rewritten, so that
+            # their hashed names change with files they refer to
+            self.file_map = self.hash_file.run_ordered(
+                route_func,
+                self.inventory, 
+                self.output_inventory,
+            )
+            return
+        self.file_map = self.hash_file.run_hashing(
+            self.inventory, 
+            self.output_inventory,
+        )
+        self.hash_file.run_linking(
+            self.file_map, 
+            route_func, 
+            self.inventory, 
+            self.output_inventory,
+        )
 
     def _gzip_group(self, group_cfg, ext):
-        import gzip as gziplib
+        # deterministic output, so that unchanged content gets the same
+        # bytes in every build
+        level = self.config.get('gzip_level', 9)
+        max_effort = self.config.get('gzip_max_effort', False)
         for name, group in group_cfg.groups.iteritems():
             gzip = group['gzip']
             if not gzip:
@@ -121,20 +257,61 @@ class KaginManager(object):
                 filename, hashed_name
             )
             hashed_path = os.path.join(self.hash_output_dir, hashed_name)
-            with open(hashed_path, 'rb') as f:
-                content = f.read()
             hashed_name_base, hashed_ext = os.path.splitext(hashed_name)
             gzip_filename = hashed_name_base + self.gzip_ext + hashed_ext
             gzip_path = os.path.join(self.hash_output_dir, gzip_filename)
-            with gziplib.open(gzip_path, 'wb') as f:
-                f.write(content)
-            self.logger.info('Compressed to %s', gzip_filename)
             self.file_map[filename] = gzip_filename
+            if self.manifest is not None:
+                # the content of a hashed CSS file changes when its links
+                # are rewritten, so use digest of the content as input
+                output = 'gzip:' + gzip_filename
+                inputs = [
+                    [hashed_name, file_digest(hashed_path)],
+                    ['options', level, max_effort],
+                ]
+                if self.manifest.is_fresh(output, inputs, gzip_path):
+                    self.logger.info('%s is up to date', gzip_filename)
+                    self._add_output(gzip_filename, gzip_path)
+                    continue
+            gzip_file(hashed_path, gzip_path, level, max_effort)
+            self.logger.info('Compressed to %s', gzip_filename)
+            if self.manifest is not None:
+                self.manifest.update(output, inputs)
+            self._add_output(gzip_filename, gzip_path)
+
+    def _add_output(self, path, file_path):
+        if self.output_inventory is not None:
+            self.output_inventory.add(path, file_path)
 
     def do_gzip(self):
         self._gzip_group(self.js_config, self.mini_js_ext)
         self._gzip_group(self.css_config, self.mini_css_ext)
         
+    def do_precompress(self):
+        """Output precompressed variants of all compressible hashed files
+        if precompress is set in config, such as
+        
+            precompress=dict(
+                encodings=['gzip', 'br'],
+                gzip_level=9,
+                min_size=1024,
+            )
+        
+        """
+        options = self.config.get('precompress')
+        if not options:
+            return
+        if not isinstance(options, dict):
+            options = {}
+        precompressor = Precompressor(
+            self.hash_output_dir,
+            manifest=self.manifest,
+            jobs=self.config.get('jobs', 1),
+            logger=self.logger,
+            **options
+        )
+        precompressor.run(self.file_map, self.output_inventory)
+        
     def route_hashed_url(self, name, https=False):
         """Generate URL for hashed filename in storage
         
@@ -179,42 +356,429 @@ class KaginManager(object):
             return self.route_rel_url(name, https=https)
         return map(get_url, minified)
     
+    def write_file_map(self):
+        """Write file map atomically, so that readers never see a partial
+        file map
+        
+        """
+        path = self.config['file_map']
+        content = json.dumps(self.file_map)
+        with atomic_open(path, 'wt') as file:
+            file.write(content)
+        self.record_file_map_history(content)
+        
+    @property
+    def file_map_history_dir(self):
+        return self.config.get(
+            'file_map_history', 
+            os.path.join(self.output_dir, 'file_map_history'),
+        )
+        
+    def list_file_map_history(self):
+        """Get paths of file map versions in history, oldest first
+        
+        """
+        dir = self.file_map_history_dir
+        if not os.path.isdir(dir):
+            return []
+        names = sorted(name for name in os.listdir(dir) 
+                       if name.endswith('.json'))
+        return [os.path.join(dir, name) for name in names]
+    
+    def record_file_map_history(self, content):
+        """Keep a copy of file map content in history if it differs from 
+        the last version, at most file_map_history_size versions are kept
+        
+        """
+        digest = hashlib.md5(content).hexdigest()
+        history = self.list_file_map_history()
+        sequence = 0
+        if history:
+            last_name = os.path.basename(history[-1])
+            if last_name.endswith('-%s.json' % digest):
+                return
+            sequence = int(last_name.split('-', 1)[0]) + 1
+        dir = self.file_map_history_dir
+        self.ensure_dir(dir)
+        path = os.path.join(dir, '%08d-%s.json' % (sequence, digest))
+        with atomic_open(path, 'wt') as file:
+            file.write(content)
+        history.append(path)
+        size = self.config.get('file_map_history_size', 10)
+        for old_path in history[:max(0, len(history) - size)]:
+            os.remove(old_path)
+    
+    def finish_build(self):
+        """Perform processes after minification, hash, link and gzip files
+        then write file map
+        
+        """
+        self.do_hash()
+        self.do_gzip()
+        self.do_precompress()
+        
+        self.write_file_map()
+        if self.manifest is not None:
+            self.remove_stale_outputs(['hash', 'gzip', 'precompress'])
+            self.manifest.save()
+    
     def build(self):
         """Perform processes
         
         """
+        # scan input files once, minified files are added by the builder
+        self.inventory = AssetInventory.scan([self.input_dir], 
+                                             logger=self.logger)
         self.do_minify()
-        self.copy_files(self.input_dir, self.hash_input_dir)
-        self.copy_files(self.minify_dir, self.hash_input_dir)
-        self.do_hash()
-        self.do_gzip()
+        if self.manifest is not None:
+            self.remove_stale_outputs(['minify'])
+        self.finish_build()
+        self.logger.info('Finish building.')
+        
+    def rebuild(self, changed):
+        """Rebuild groups which include changed files (relative paths to 
+        input_dir), requires incremental build
         
-        with open(self.config['file_map'], 'wt') as file:
-            json.dump(self.file_map, file)
+        """
+        def affected(file_config):
+            filenames = [name for name in changed 
+                         if name in file_config.filename_map]
+            return file_config.subset(file_config.include_files(filenames))
             
-        self.logger.info('Finish building.')
+        js_config = affected(self.js_config)
+        css_config = affected(self.css_config)
+        self.logger.info(
+            'Rebuilding groups %s ...', 
+            sorted(js_config.groups) + sorted(css_config.groups)
+        )
+        for path in changed:
+            self.inventory.refresh(path, os.path.join(self.input_dir, path))
+        self.manifest.keep('minify:')
+        self.do_minify(js_config, css_config)
+        self.finish_build()
+        self.logger.info('Finish rebuilding.')
+        
+    def watch(self, debounce=0.2, interval=1.0):
+        """Watch input_dir and rebuild groups affected by changed files, 
+        inotify is used if pyinotify is available, otherwise polling every 
+        interval seconds. Changes within debounce seconds are rebuilt 
+        together. Watch mode always builds incrementally.
+        
+        """
+        if self.manifest is None:
+            self.incremental = True
+            self.manifest = self.make_manifest()
+            self.hash_file.manifest = self.manifest
+        self.build()
+        watcher = make_watcher(self.input_dir, interval=interval, 
+                               logger=self.logger)
+        self.logger.info('Watching %s ...', self.input_dir)
+        try:
+            for changed in watcher.iter_changes(debounce):
+                self.logger.info('%s files changed', len(changed))
+                # a broken file while editing should not end watching, it
+                # is rebuilt again when it is fixed
+                try:
+                    self.rebuild(changed)
+                except Exception:
+                    self.logger.exception('Failed to rebuild')
+        finally:
+            watcher.close()
+            
+    def make_snapshot(self):
+        """Create RemoteSnapshot from config, return None if there is no
+        remote_snapshot in config
+        
+        """
+        path = self.config.get('remote_snapshot')
+        if not path:
+            return
+        return RemoteSnapshot(
+            path, 
+            self.storage.bucket_name,
+            max_age=self.config.get('remote_snapshot_max_age', 24 * 60 * 60),
+            logger=self.logger,
+        )
             
-    def upload(self, overwire_all=False, overwire_css=True):
+    def referenced_names(self, file_map):
+        """Get names of files in storage referenced by a file map, hashed 
+        files replaced by their gzip variants in the file map are included
+        
+        """
+        names = set()
+        for name in file_map.itervalues():
+            names.add(name)
+            base, ext = os.path.splitext(name)
+            if base.endswith(self.gzip_ext):
+                names.add(base[:-len(self.gzip_ext)] + ext)
+        return names
+        
+    def output_name_pattern(self):
+        """Get compiled pattern of names of hashed files, such as 
+        <hex digits of hash_length>.gzip.js
+        
+        """
+        suffixes = set(ENCODING_SUFFIXES.values())
+        suffixes.add(self.gzip_ext)
+        return re.compile(r'^[0-9a-f]{%d}(%s)?(\.[^./]+)?$' % (
+            self.hash_file.hash_length, 
+            '|'.join(re.escape(suffix) for suffix in sorted(suffixes)),
+        ))
+        
+    def gc(self, keep=None, grace=None, dry_run=False):
+        """Remove hashed files in storage which are referenced by neither 
+        current file map nor last keep versions in file map history. Files
+        whose names do not look like hashed files are never removed, so 
+        that other files in a shared bucket are safe. Files modified in 
+        last grace seconds are kept, as they may belong to a deploy in 
+        progress. Files are removed with batched multi-object delete 
+        requests concurrently. Return (number, bytes) of removed files, or 
+        of files to remove in dry run. Raise RuntimeError if current file 
+        map is missing or empty
+        
+        """
+        if keep is None:
+            keep = self.config.get('gc_keep_versions', 5)
+        if grace is None:
+            grace = self.config.get('gc_grace', 7 * 24 * 60 * 60)
+        file_map = self.file_map
+        if not file_map:
+            # without a file map, every file would be considered garbage
+            raise RuntimeError('File map %s is missing or empty, refuse to '
+                               'remove files' % self.config['file_map'])
+        live = self.referenced_names(file_map)
+        previous = 0
+        for path in reversed(self.list_file_map_history()):
+            if previous >= keep:
+                break
+            with open(path, 'rt') as file:
+                old_file_map = json.load(file)
+            # current file map is usually the last version in history
+            if old_file_map == file_map:
+                continue
+            live |= self.referenced_names(old_file_map)
+            previous += 1
+        self.logger.info('%s files are referenced by current and %s '
+                         'previous file maps', len(live), previous)
+        
         self.logger.info('Getting name list from storage ...')
-        names = self.storage.get_names()
-        self.logger.info('Got %s file names', len(names))
-        self.logger.debug('Names: %r', names)
+        deadline = time.time() - grace
+        pattern = self.output_name_pattern()
+        sizes = {}
+        recent = 0
+        for key in self.storage.iter_keys():
+            if key.name in live or not pattern.match(key.name):
+                continue
+            if (key.last_modified and 
+                    parse_last_modified(key.last_modified) > deadline):
+                recent += 1
+                continue
+            sizes[key.name] = key.size
+        total_size = sum(sizes.itervalues())
+        if dry_run:
+            self.logger.info('Would remove %s files (%.1f MB), %s recent '
+                             'files kept', len(sizes), 
+                             total_size / 1048576.0, recent)
+            return len(sizes), total_size
+        
+        self.logger.info('Removing %s files (%.1f MB) ...', len(sizes), 
+                         total_size / 1048576.0)
+        errors = self.storage.remove_many(
+            sorted(sizes),
+            batch_size=self.config.get('gc_batch_size', 1000),
+            jobs=self.config.get('gc_jobs', 4),
+        )
+        for name, message in errors:
+            self.logger.error('Failed to remove %s: %s', name, message)
+            del sizes[name]
+        snapshot = self.make_snapshot()
+        if snapshot is not None and snapshot.listed_at is not None:
+            for name in sizes:
+                snapshot.remove(name)
+            snapshot.save()
+        total_size = sum(sizes.itervalues())
+        self.logger.info('Removed %s files (%.1f MB), %s failed', 
+                         len(sizes), total_size / 1048576.0, len(errors))
+        return len(sizes), total_size
+        
+    def make_journal(self, inventory):
+        """Create UploadJournal of the build in inventory, return None if
+        upload_journal in config is disabled
+        
+        """
+        path = self.config.get(
+            'upload_journal', 
+            os.path.join(self.output_dir, 'upload_journal'),
+        )
+        if not path:
+            return
+        return UploadJournal(
+            path,
+            build_fingerprint(inventory),
+            self.storage.bucket_name,
+            batch_size=self.config.get('upload_journal_batch', 100),
+            logger=self.logger,
+        )
+        
+    def make_header_policy(self):
+        """Create HeaderPolicy of an upload from config
+        
+        """
+        return HeaderPolicy(
+            hashed_max_age=self.config.get('hashed_max_age', 
+                                           365 * 24 * 60 * 60),
+            unhashed_max_age=self.config.get('unhashed_max_age', 5 * 60),
+        )
+        
+    def is_immutable(self, name, hashed_names):
+        """Determine whether content of a file in hash output never changes
+        under its name. Without hash_dependency_order, links in CSS files 
+        are rewritten after hashing, so CSS files (and their compressed 
+        variants) get new content under the same name
+        
+        """
+        if name not in hashed_names:
+            return False
+        _, ext = os.path.splitext(name)
+        if ext.lower() == '.css':
+            return self.config.get('hash_dependency_order', False)
+        return True
+        
+    def make_upload_task(self, asset, digest, policy, hashed_names):
+        """Make UploadTask of an asset in hash output directory, with 
+        headers of the HeaderPolicy by whether it is immutable
+        
+        """
+        kwargs = policy.get_args(asset.path, 
+                                 self.is_immutable(asset.path, hashed_names))
+        kwargs['metadata'] = dict(md5=digest)
+        return make_task(asset.path, asset.file_path, **kwargs)
+            
+    def plan_upload(self, inventory, snapshot, policy, overwire_all, 
+                    overwire_css, refresh_snapshot, sync):
+        """Determine files to upload by comparing inventory with files in 
+        storage, return a list of UploadTask
         
-        for root, _, filenames in os.walk(self.hash_output_dir):
-            for filename in filenames:
-                _, ext = os.path.splitext(filename)
+        """
+        if snapshot is None:
+            self.logger.info('Getting name list from storage ...')
+            remote = dict((key.name, key.etag) 
+                          for key in self.storage.iter_keys())
+        elif refresh_snapshot or not snapshot.fresh:
+            self.logger.info('Getting name list from storage ...')
+            snapshot.refresh(self.storage)
+            remote = snapshot.keys
+        else:
+            self.logger.info('Using remote snapshot %s', snapshot.path)
+            remote = snapshot.keys
+        self.logger.info('Got %s file names', len(remote))
+        
+        hashed_names = self.referenced_names(self.file_map or {})
+        tasks = []
+        skipped_size = 0
+        for asset in inventory:
+            filename = asset.path
+            # only read files to compare in sync mode or to upload
+            digest = None
+            if sync:
+                digest = file_digest(asset.file_path)
+                if self.is_synced(filename, digest, remote):
+                    self.logger.info('%s is unchanged, skipped', filename)
+                    skipped_size += asset.size
+                    continue
+            else:
                 force_upload = False
-                if ext.lower() == '.css' and overwire_css:
+                if asset.ext == '.css' and overwire_css:
                     force_upload = True
-                if filename in names and not force_upload and not overwire_all:
+                if (filename in remote and not force_upload and 
+                        not overwire_all):
                     self.logger.info('%s already exists, skipped', filename)
+                    skipped_size += asset.size
                     continue
-                file_path = os.path.join(root, filename)
-                self.logger.info('Uploading %s ...', filename)
-
-                # TODO: use a better approach to determine gziped file
-                if self.gzip_ext in file_path:
-                    self.storage.upload_file(filename, file_path, content_encoding='gzip')
-                else:
-                    self.storage.upload_file(filename, file_path)
+            if digest is None:
+                digest = file_digest(asset.file_path)
+            tasks.append(self.make_upload_task(asset, digest, policy, 
+                                               hashed_names))
+        self.logger.info('%.1f MB of existing files skipped', 
+                         skipped_size / 1048576.0)
+        return tasks
+            
+    def is_synced(self, name, digest, remote):
+        """Determine whether remote file of name has content with MD5 
+        digest, remote is a map from name to ETag
+        
+        """
+        etag = remote.get(name)
+        if etag and '-' in etag:
+            # ETag of a multipart upload is not MD5 of the content, use 
+            # the digest stored in metadata instead
+            etag = self.storage.get_metadata(name, 'md5')
+        return etag == digest
+        
+    def upload(self, overwire_all=False, overwire_css=True, 
+               refresh_snapshot=False, sync=None):
+        """Upload hashed files which do not exist in storage yet. In sync
+        mode, files are compared by MD5 digest with ETag of remote files, 
+        only files whose content differs are uploaded, overwire_css is 
+        ignored. Completed uploads are recorded in a journal of the build,
+        an interrupted upload of the same build is resumed from the 
+        journal without listing the storage
+        
+        """
+        if sync is None:
+            sync = self.config.get('upload_sync', False)
+        snapshot = self.make_snapshot()
+        inventory = self.output_inventory
+        if inventory is None:
+            inventory = AssetInventory.scan([self.hash_output_dir], 
+                                            logger=self.logger)
+        journal = self.make_journal(inventory)
+        # Expires of all files is computed once per deploy
+        policy = self.make_header_policy()
+        if journal is not None and journal.resumable:
+            # resume an interrupted upload of the same build, without 
+            # listing the storage again
+            remaining = set(journal.remaining)
+            hashed_names = self.referenced_names(self.file_map or {})
+            self.logger.info('Resuming upload from journal %s, %s of %s '
+                             'files done', journal.path, len(journal.done),
+                             len(journal.names))
+            tasks = [
+                self.make_upload_task(asset, file_digest(asset.file_path), 
+                                      policy, hashed_names)
+                for asset in inventory if asset.path in remaining
+            ]
+        else:
+            tasks = self.plan_upload(inventory, snapshot, policy, 
+                                     overwire_all, overwire_css, 
+                                     refresh_snapshot, sync)
+            if journal is not None:
+                journal.start(task.name for task in tasks)
+            
+        self.logger.info('Uploading %s files ...', len(tasks))
+        uploader = Uploader(
+            self.storage, 
+            jobs=self.config.get('upload_jobs', 8),
+            retries=self.config.get('upload_retries', 3),
+            logger=self.logger,
+        )
+        
+        def uploaded(task, key):
+            digest = task.kwargs['metadata']['md5']
+            if journal is not None:
+                journal.add(task.name, digest)
+            if snapshot is not None:
+                snapshot.add(task.name, digest)
+            
+        try:
+            uploader.upload(tasks, uploaded)
+        finally:
+            # keep uploaded files in journal and snapshot even if some 
+            # failed, so that next upload resumes from there
+            if journal is not None:
+                journal.close()
+            if snapshot is not None:
+                snapshot.save()
+        if journal is not None:
+            journal.remove()
         self.logger.info('Finish uploading.')
@@ -0,0 +1,111 @@
+import os
+import json
+import logging
+import hashlib
+
+from kagin.utils import atomic_open
+
+
+def file_digest(path, hash_type=hashlib.md5, chunk_size=64 * 1024):
+    """Compute hex digest of file content
+
+    """
+    hash = hash_type()
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+class BuildManifest(object):
+    """Dependency manifest of an incremental build, it maps each output to
+    the inputs (with content digests) it was built from, so that outputs
+    whose inputs did not change can be skipped
+
+    Outputs are named as ``<stage>:<path>``, for example
+    ``minify:base.mini.js`` or ``gzip:0123abcd.gzip.js``, inputs can be any
+    JSON value, usually a list of ``[path, digest]`` pairs.
+
+    """
+
+    def __init__(self, path, logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: path to manifest file
+        self.path = path
+        #: map from output to its inputs
+        self.entries = {}
+        #: outputs checked or updated in current build
+        self.touched = set()
+        self.load()
+
+    def load(self):
+        """Load manifest from file
+
+        """
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rt') as file:
+            content = file.read()
+        try:
+            self.entries = json.loads(content)
+        except ValueError:
+            self.logger.warn('Ignore corrupted manifest %s', self.path)
+
+    def is_fresh(self, output, inputs, output_path=None):
+        """Return True if output was built from the same inputs and the
+        output file (if given) still exists, output is marked as touched
+
+        """
+        self.touched.add(output)
+        if output_path is not None and not os.path.exists(output_path):
+            return False
+        return self.entries.get(output) == inputs
+
+    def update(self, output, inputs):
+        """Record inputs of a freshly built output
+
+        """
+        self.touched.add(output)
+        self.entries[output] = inputs
+
+    def keep(self, prefix):
+        """Mark outputs starting with prefix as touched, so that a partial
+        build keeps outputs it did not check
+
+        """
+        for output in self.entries:
+            if output.startswith(prefix):
+                self.touched.add(output)
+
+    def discard(self, output):
+        """Forget an output, so that it will be built next time
+
+        """
+        self.entries.pop(output, None)
+
+    def stale_outputs(self):
+        """Outputs of previous builds which were not touched by current
+        build
+
+        """
+        return [output for output in self.entries
+                if output not in self.touched]
+
+    def save(self):
+        """Write outputs touched by current build to manifest file
+        atomically
+
+        """
+        entries = dict((output, inputs)
+                       for output, inputs in self.entries.iteritems()
+                       if output in self.touched)
+        with atomic_open(self.path, 'wt') as file:
+            json.dump(entries, file)
+        self.entries = entries
+        self.touched = set()
@@ -0,0 +1,281 @@
+import os
+import re
+import logging
+import subprocess
+
+from kagin.compressor import get_yui_compressor
+
+
+class Minifier(object):
+    """Base class of minifier backends
+
+    """
+    #: name and version of the minifier, as a part of cache keys
+    identity = None
+
+    def minify_file(self, filename):
+        """Minify a file and return the output
+
+        """
+        raise NotImplementedError
+
+
+class YUIMinifier(Minifier):
+    """Minify with YUI Compressor, through a long-lived compressor (such as
+    CompressorPool) if given, otherwise spawn a compressor process for each
+    file
+
+    """
+
+    def __init__(self, compressor=None):
+        self.compressor = compressor
+        self.identity = getattr(compressor, 'identity', None)
+        if self.identity is None:
+            self.identity = os.path.basename(get_yui_compressor())
+
+    def minify_file(self, filename):
+        if self.compressor is not None:
+            return self.compressor.compress_file(filename)
+        yui_path = get_yui_compressor()
+        return subprocess.check_output(['java', '-jar', yui_path, filename])
+
+
+class JavascriptMinify(object):
+    """A conservative JavaScript minifier in the spirit of Douglas
+    Crockford's JSMin, it removes comments and unnecessary whitespace but
+    never renames anything
+
+    """
+
+    def __init__(self, content):
+        self.content = content.replace('\r\n', '\n').replace('\r', '\n')
+        self.index = 0
+        self.lookahead = None
+        self.output = []
+        self.a = '\n'
+        self.b = None
+
+    @staticmethod
+    def is_alphanum(c):
+        return bool(c) and (c.isalnum() or c in '$_\\' or ord(c) > 126)
+
+    def get(self):
+        c = self.lookahead
+        self.lookahead = None
+        if c is None:
+            if self.index >= len(self.content):
+                return ''
+            c = self.content[self.index]
+            self.index += 1
+        if c >= ' ' or c == '\n' or c == '':
+            return c
+        return ' '
+
+    def peek(self):
+        self.lookahead = self.get()
+        return self.lookahead
+
+    def next(self):
+        c = self.get()
+        if c != '/':
+            return c
+        p = self.peek()
+        if p == '/':
+            while c > '\n':
+                c = self.get()
+            return c
+        if p == '*':
+            self.get()
+            while True:
+                c = self.get()
+                if c == '*' and self.peek() == '/':
+                    self.get()
+                    return ' '
+                if c == '':
+                    raise ValueError('Unterminated comment')
+        return c
+
+    def put(self, c):
+        self.output.append(c)
+
+    def action(self, d):
+        if d <= 1:
+            self.put(self.a)
+        if d <= 2:
+            self.a = self.b
+            if self.a in ('"', "'", '`'):
+                while True:
+                    self.put(self.a)
+                    self.a = self.get()
+                    if self.a == self.b:
+                        break
+                    if self.a == '\\':
+                        self.put(self.a)
+                        self.a = self.get()
+                    if self.a == '':
+                        raise ValueError('Unterminated string literal')
+        if d <= 3:
+            self.b = self.next()
+            if self.b == '/' and self.a in '(,=:[!&|?+-~*/{};\n':
+                self.put(self.a)
+                # keep a regular expression after division or 
+                # multiplication from becoming a comment
+                if self.a in '/*':
+                    self.put(' ')
+                self.put(self.b)
+                while True:
+                    self.a = self.get()
+                    if self.a == '[':
+                        # a slash in a character class does not end the
+                        # regular expression
+                        while True:
+                            self.put(self.a)
+                            self.a = self.get()
+                            if self.a == ']':
+                                break
+                            if self.a == '\\':
+                                self.put(self.a)
+                                self.a = self.get()
+                            if self.a == '':
+                                raise ValueError('Unterminated regular '
+                                                 'expression class')
+                    elif self.a == '/':
+                        break
+                    elif self.a == '\\':
+                        self.put(self.a)
+                        self.a = self.get()
+                    if self.a == '':
+                        raise ValueError('Unterminated regular expression')
+                    self.put(self.a)
+                self.b = self.next()
+
+    def minify(self):
+        is_alphanum = self.is_alphanum
+        self.action(3)
+        while self.a != '':
+            a, b = self.a, self.b
+            if a == ' ':
+                last = self.output[-1] if self.output else ''
+                # keep the space between two names and in "a + +b"
+                if ((is_alphanum(b) and is_alphanum(last)) or
+                        (b in ('+', '-') and last == b)):
+                    self.action(1)
+                else:
+                    self.action(2)
+            elif a == '\n':
+                if b in ('{', '[', '(', '+', '-', '!', '~'):
+                    self.action(1)
+                elif b == ' ':
+                    self.action(3)
+                elif is_alphanum(b):
+                    self.action(1)
+                else:
+                    self.action(2)
+            elif b == ' ':
+                if is_alphanum(a) or a in ('+', '-'):
+                    self.action(1)
+                else:
+                    self.action(3)
+            elif b == '\n':
+                if a in ('}', ']', ')', '+', '-', '"', "'", '`'):
+                    self.action(1)
+                elif is_alphanum(a):
+                    self.action(1)
+                else:
+                    self.action(3)
+            else:
+                self.action(1)
+        return ''.join(self.output).strip()
+
+
+def minify_js(content):
+    """Minify JavaScript content
+
+    """
+    return JavascriptMinify(content).minify()
+
+
+_CSS_TOKEN = re.compile(
+    r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)''',
+    flags=re.S
+)
+_CSS_SPACES = re.compile(r'\s+')
+_CSS_PUNCTUATION = re.compile(r' ?([{};,>]) ?')
+
+
+def _compact_css(text):
+    text = _CSS_SPACES.sub(' ', text)
+    text = _CSS_PUNCTUATION.sub(r'\1', text)
+    text = text.replace(': ', ':')
+    return text.replace(';}', '}')
+
+
+def minify_css(content):
+    """Minify CSS content, strings and comments start with ``/*!`` are kept
+
+    """
+    parts = []
+    previous = 0
+    for match in _CSS_TOKEN.finditer(content):
+        parts.append(_compact_css(content[previous:match.start()]))
+        string, comment = match.groups()
+        if string is not None:
+            parts.append(string)
+        elif comment.startswith('/*!'):
+            parts.append(comment)
+        previous = match.end()
+    parts.append(_compact_css(content[previous:]))
+    return ''.join(parts).strip()
+
+
+class PythonMinifier(Minifier):
+    """In-process pure Python minifier, no process spawn and no JVM
+
+    """
+    identity = 'kagin-python-minifier-1'
+
+    def minify_file(self, filename):
+        with open(filename, 'rb') as file:
+            content = file.read()
+        _, ext = os.path.splitext(filename)
+        if ext.lower() == '.css':
+            return minify_css(content)
+        return minify_js(content)
+
+
+class PassThroughMinifier(Minifier):
+    """Output already minified files (such as ``*.min.js`` vendor files or
+    files with very long lines) as they are, other files are minified with
+    the fallback minifier
+
+    """
+    #: suffixes of already minified files
+    suffixes = ('.min.js', '-min.js', '.min.css', '-min.css')
+
+    def __init__(self, fallback, max_line_length=1000, logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: minifier for files which are not minified yet
+        self.fallback = fallback
+        #: files with a line longer than this are seen as minified
+        self.max_line_length = max_line_length
+        self.identity = 'passthrough-%s+%s' % (max_line_length,
+                                               fallback.identity)
+
+    def is_minified(self, filename, content):
+        """Determine whether a file is minified already
+
+        """
+        if filename.lower().endswith(self.suffixes):
+            return True
+        return any(len(line) >= self.max_line_length
+                   for line in content.splitlines())
+
+    def minify_file(self, filename):
+        with open(filename, 'rb') as file:
+            content = file.read()
+        if self.is_minified(filename, content):
+            self.logger.info('%s is minified already, skipped', filename)
+            return content.strip()
+        return self.fallback.minify_file(filename)
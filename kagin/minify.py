@@ -1,9 +1,14 @@
 import os
 import logging
-import subprocess
+import hashlib
 import urlparse
+from multiprocessing.pool import ThreadPool
 
-from kagin.link_css import replace_css_links
+from kagin.link_css import CSSLinkRewriter
+from kagin.minifiers import YUIMinifier, PythonMinifier, PassThroughMinifier
+from kagin.manifest import file_digest
+from kagin.cache import ResolutionCache
+from kagin.utils import atomic_open
 
 
 class FileConfig(object):
@@ -22,14 +27,16 @@ class FileConfig(object):
         #: map from filename to group name
         self.filename_map = {}
         
-    def add_group(self, name, filenames, gzip=True):
-        """Add file group
+    def add_group(self, name, filenames, gzip=True, minifier=None):
+        """Add file group, minifier is name of the minifier backend for 
+        this group, default minifier of builder is used if it is None
         
         """
         assert name not in self.groups 
         self.groups[name] = dict(
             filenames=filenames,
-            gzip=gzip
+            gzip=gzip,
+            minifier=minifier,
         )
         for filename in filenames:
             self.filename_map[filename] = name
@@ -43,28 +50,100 @@ class FileConfig(object):
             group_name = self.filename_map[filename]
             groups.add(group_name)
         return groups
+    
+    def subset(self, names):
+        """Return a new FileConfig with only groups in names
+        
+        """
+        config = FileConfig(self.input_dir, logger=self.logger)
+        for name in names:
+            config.groups[name] = self.groups[name]
+            for filename in self.groups[name]['filenames']:
+                config.filename_map[filename] = name
+        return config
 
 
 class Builder(object):
     """Builder builds CSS or JS file groups into minified files
     
     """
-    def __init__(self, input_dir, output_dir, logger=None):
+    def __init__(
+        self, 
+        input_dir, 
+        output_dir, 
+        compressor=None, 
+        minifiers=None,
+        default_minifier='yui',
+        cache=None,
+        manifest=None,
+        jobs=1, 
+        inventory=None,
+        logger=None,
+    ):
         self.logger = logger
         if self.logger is None:
             self.logger = logging.getLogger(__name__)
         self.input_dir = input_dir
         self.output_dir = output_dir
+        #: long-lived compressor (such as CompressorPool) to use, spawn
+        #: a compressor process for each file if it is None
+        self.compressor = compressor
+        yui = YUIMinifier(compressor)
+        #: map from name to minifier backend
+        self.minifiers = dict(
+            yui=yui,
+            python=PythonMinifier(),
+            passthrough=PassThroughMinifier(yui, logger=self.logger),
+        )
+        if minifiers:
+            self.minifiers.update(minifiers)
+        #: name of minifier backend for groups without one
+        self.default_minifier = default_minifier
+        #: MinifyCache for minified output, no cache if it is None
+        self.cache = cache
+        #: BuildManifest for incremental build, build all groups if it is 
+        #: None
+        self.manifest = manifest
+        #: number of files to minify concurrently
+        self.jobs = jobs
+        #: AssetInventory of output files, built groups are added to it if
+        #: it is not None
+        self.inventory = inventory
+        #: rewriter of links in CSS files
+        self.rewriter = CSSLinkRewriter(logger=self.logger)
+        #: cache of resolve_link results, shared by all CSS files
+        self.resolution_cache = ResolutionCache(
+            self.resolve_link, 
+            name='CSS link',
+            logger=self.logger,
+        )
         
-    def _get_yui_compressor(self):
-        """Get path of yui compressor
+    def get_minifier(self, name=None):
+        """Get minifier backend by name, return the default one if name
+        is None
         
         """
-        import kagin
-        pkg_dir = os.path.dirname(kagin.__file__)
-        path = os.path.join(pkg_dir, 'yuicompressor-2.4.2.jar')
-        return path
+        return self.minifiers[name or self.default_minifier]
     
+    def compress(self, filename, minifier=None):
+        """Compress a file with minifier backend and return the output
+        
+        """
+        return self.get_minifier(minifier).minify_file(filename)
+    
+    @staticmethod
+    def resolve_link(rel_dir, url):
+        """Resolve URL relative to rel_dir, return None for absolute URLs
+        
+        """
+        parsed = urlparse.urlparse(url)
+        # we don't want to map absolute URLs
+        if parsed.scheme:
+            return
+        if parsed.path.startswith('/'):
+            return
+        return urlparse.urljoin(rel_dir, url)
+        
     def link_css(self, content, old_path, new_path):
         """Replace URL links in CSS content and return result
         
@@ -81,40 +160,141 @@ class Builder(object):
             rel_dir = rel_dir + '/'
         
         def map_func(url):
-            parsed = urlparse.urlparse(url)
-            # we don't want to map absolute URLs
-            if parsed.scheme:
-                return
-            if parsed.path.startswith('/'):
-                return
-            return urlparse.urljoin(rel_dir, url)
-        
-        output = replace_css_links(content, map_func, self.logger)
+            return self.resolution_cache.resolve(rel_dir, url)
+        
+        output = self.rewriter.rewrite(content, map_func)
         return output
         
-    def minify(self, input_files, output_path, link_css=True):
-        minified = []
-        yui_path = self._get_yui_compressor()
-        for filename in input_files:
-            self.logger.info('Minifying %s ...', filename)
-            output = subprocess.check_output(['java', '-jar', 
-                                              yui_path, filename])
-            _, ext = os.path.splitext(filename)
-            if link_css and ext.lower() == '.css':
-                old_path = os.path.relpath(filename, self.input_dir)
-                new_path = os.path.relpath(output_path, self.output_dir)
-                output = self.link_css(output, old_path, new_path)
-            minified.append(output)
+    def minify_file(
+        self, 
+        filename, 
+        output_path, 
+        link_css=True, 
+        minifier=None,
+    ):
+        """Minify a file for output_path and return the output
+        
+        """
+        _, ext = os.path.splitext(filename)
+        old_path = None
+        new_path = None
+        if link_css and ext.lower() == '.css':
+            old_path = os.path.relpath(filename, self.input_dir)
+            new_path = os.path.relpath(output_path, self.output_dir)
             
+        key = None
+        if self.cache is not None:
+            with open(filename, 'rb') as file:
+                content_hash = hashlib.sha1(file.read()).hexdigest()
+            key = self.cache.make_key(
+                content_hash, 
+                self.get_minifier(minifier).identity, 
+                link_css, 
+                old_path, 
+                new_path,
+            )
+            output = self.cache.get(key)
+            if output is not None:
+                self.logger.info('Minifying %s ... (cached)', filename)
+                return output
+        
+        self.logger.info('Minifying %s ...', filename)
+        output = self.compress(filename, minifier)
+        if old_path is not None:
+            output = self.link_css(output, old_path, new_path)
+        if key is not None:
+            self.cache.set(key, output)
+        return output
+    
+    def _minify_task(self, task):
+        return self.minify_file(*task)
+    
+    def _map(self, func, items):
+        """Map items with func, run in a pool of jobs threads when jobs is 
+        greater than 1, the results are in the same order as items
+        
+        """
+        if self.jobs <= 1 or len(items) <= 1:
+            return map(func, items)
+        pool = ThreadPool(min(self.jobs, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+    
+    def _write_output(self, output_path, minified):
         file_content = '\n'.join(minified)
-        with open(output_path, 'wt') as file:
+        # replace instead of writing in place, as the old output may be
+        # hard linked by later build stages
+        with atomic_open(output_path, 'wt') as file:
             file.write(file_content)
         
-    def build(self, file_config, ext):
-        for name, group in file_config.groups.iteritems():
-            filenames = group['filenames']
+    def minify(self, input_files, output_path, link_css=True, minifier=None):
+        tasks = [(filename, output_path, link_css, minifier) 
+                 for filename in input_files]
+        minified = self._map(self._minify_task, tasks)
+        self._write_output(output_path, minified)
+        
+    def _manifest_entry(self, output_path, input_files, minifier=None):
+        """Manifest output name and inputs of a group
+        
+        """
+        output = 'minify:' + os.path.relpath(output_path, self.output_dir)
+        inputs = [['compressor', self.get_minifier(minifier).identity]]
+        for filename in input_files:
+            inputs.append([
+                os.path.relpath(filename, self.input_dir), 
+                file_digest(filename),
+            ])
+        return output, inputs
+    
+    def _add_output(self, output_filename):
+        if self.inventory is None:
+            return
+        path = os.path.relpath(output_filename, self.output_dir)
+        self.inventory.add(path.replace(os.sep, '/'), output_filename)
 
-            output_filename = os.path.join(self.output_dir, name + ext)
-            input_files = [os.path.join(file_config.input_dir, name) 
-                           for name in filenames]
-            self.minify(input_files, output_filename)
+    def build(self, file_config, ext):
+        self.build_all([(file_config, ext)])
+        
+    def build_all(self, configs):
+        """Build groups of a list of (file_config, ext), files of all groups
+        are minified concurrently when jobs is greater than 1
+        
+        """
+        tasks = []
+        # list of (output path, input files, manifest entry)
+        outputs = []
+        for file_config, ext in configs:
+            for name, group in file_config.groups.iteritems():
+                filenames = group['filenames']
+                minifier = group.get('minifier')
+    
+                output_filename = os.path.join(self.output_dir, name + ext)
+                input_files = [os.path.join(file_config.input_dir, name) 
+                               for name in filenames]
+                entry = None
+                if self.manifest is not None:
+                    entry = self._manifest_entry(output_filename, 
+                                                 input_files, minifier)
+                    if self.manifest.is_fresh(*entry, 
+                                              output_path=output_filename):
+                        self.logger.info('%s is up to date', output_filename)
+                        self._add_output(output_filename)
+                        continue
+                outputs.append((output_filename, input_files, entry))
+                tasks.extend((filename, output_filename, True, minifier) 
+                             for filename in input_files)
+                
+        minified = self._map(self._minify_task, tasks)
+        offset = 0
+        for output_filename, input_files, entry in outputs:
+            count = len(input_files)
+            self._write_output(output_filename, 
+                               minified[offset:offset + count])
+            offset += count
+            if entry is not None:
+                self.manifest.update(*entry)
+            self._add_output(output_filename)
+        self.resolution_cache.report()
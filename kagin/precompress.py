@@ -0,0 +1,328 @@
+import os
+import zlib
+import struct
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from kagin.manifest import file_digest
+from kagin.utils import atomic_open
+
+#: extensions of files worth compressing, files of text type (by MIME type)
+#: are compressed as well
+COMPRESSIBLE_EXTENSIONS = frozenset([
+    '.css', '.js', '.json', '.map', '.html', '.htm', '.xml', '.txt',
+    '.svg', '.ttf', '.otf', '.eot', '.ico',
+])
+
+#: map from encoding to the suffix of compressed variants, a variant of
+#: 0123abcd.js is named as 0123abcd.gzip.js
+ENCODING_SUFFIXES = {
+    'gzip': '.gzip',
+    'br': '.br',
+}
+
+
+def get_variant_name(name, encoding):
+    """Get name of compressed variant of file name with encoding
+
+    """
+    base, ext = os.path.splitext(name)
+    return base + ENCODING_SUFFIXES[encoding] + ext
+
+
+def get_content_encoding(name):
+    """Get content encoding of a compressed variant by its file name,
+    return None if it is not a compressed variant
+
+    """
+    base, _ = os.path.splitext(name)
+    for encoding, suffix in ENCODING_SUFFIXES.iteritems():
+        if base.endswith(suffix):
+            return encoding
+    return None
+
+
+#: header of gzip output, with no file name, zero mtime and unknown OS,
+#: so that the same content is always compressed to the same bytes
+GZIP_HEADER = '\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff'
+
+#: (level, strategy) to try in maximum effort mode
+MAX_EFFORT_OPTIONS = [
+    (level, strategy)
+    for level in (9, 8, 6)
+    for strategy in (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED,
+                     zlib.Z_HUFFMAN_ONLY)
+]
+
+
+class _SizeCounter(object):
+    """File-like object which only counts size of written data
+
+    """
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+def gzip_stream(input_file, output_file, level=9,
+                strategy=zlib.Z_DEFAULT_STRATEGY, chunk_size=64 * 1024):
+    """Compress input_file to output_file in gzip format deterministically,
+    in chunks of chunk_size, return size of compressed data
+
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                  zlib.DEF_MEM_LEVEL, strategy)
+    crc = zlib.crc32('')
+    size = 0
+    output_file.write(GZIP_HEADER)
+    compressed_size = len(GZIP_HEADER)
+    while True:
+        chunk = input_file.read(chunk_size)
+        if not chunk:
+            break
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        data = compressor.compress(chunk)
+        output_file.write(data)
+        compressed_size += len(data)
+    data = compressor.flush() + struct.pack(
+        '<II', crc & 0xffffffff, size & 0xffffffff)
+    output_file.write(data)
+    return compressed_size + len(data)
+
+
+def gzip_file(src, dest, level=9, max_effort=False, chunk_size=64 * 1024):
+    """Compress file src to dest in gzip format deterministically, with
+    bounded memory. In maximum effort mode, levels and strategies in 
+    MAX_EFFORT_OPTIONS are tried and the smallest output is kept. Return
+    size of dest
+
+    """
+    options = [(level, zlib.Z_DEFAULT_STRATEGY)]
+    if max_effort:
+        sizes = []
+        for option in MAX_EFFORT_OPTIONS:
+            counter = _SizeCounter()
+            with open(src, 'rb') as input_file:
+                gzip_stream(input_file, counter, *option,
+                            chunk_size=chunk_size)
+            sizes.append((counter.size, option))
+        # the first option wins ties
+        options = [min(sizes, key=lambda item: item[0])[1]]
+    with open(src, 'rb') as input_file:
+        with atomic_open(dest, 'wb') as output_file:
+            return gzip_stream(input_file, output_file, *options[0],
+                               chunk_size=chunk_size)
+
+
+def brotli_compress(content, quality=11):
+    """Compress content in brotli format, requires the brotli package
+
+    """
+    import brotli
+    return brotli.compress(content, quality=quality)
+
+
+class Precompressor(object):
+    """Output precompressed variants of compressible files, such as CSS,
+    SVG, JSON and fonts, for every encoding. A variant is only kept when
+    it is meaningfully smaller than the original file
+
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        encodings=('gzip', 'br'),
+        gzip_level=9,
+        gzip_max_effort=False,
+        brotli_quality=11,
+        extensions=COMPRESSIBLE_EXTENSIONS,
+        min_size=1024,
+        max_ratio=0.9,
+        manifest=None,
+        jobs=1,
+        logger=None,
+    ):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: directory of files to compress, variants are output here too
+        self.output_dir = output_dir
+        #: compression level of gzip
+        self.gzip_level = gzip_level
+        #: try levels and strategies of gzip for the smallest output
+        self.gzip_max_effort = gzip_max_effort
+        #: compression quality of brotli
+        self.brotli_quality = brotli_quality
+        #: extensions of files to compress
+        self.extensions = frozenset(ext.lower() for ext in extensions)
+        #: files smaller than this are not compressed
+        self.min_size = min_size
+        #: variants are kept only if their size divided by size of the
+        #: original file is not greater than this
+        self.max_ratio = max_ratio
+        #: BuildManifest for incremental build, always compress if it is
+        #: None
+        self.manifest = manifest
+        #: number of files to compress concurrently
+        self.jobs = jobs
+        #: encodings to output
+        self.encodings = []
+        for encoding in encodings:
+            if encoding == 'br':
+                try:
+                    import brotli
+                except ImportError:
+                    self.logger.warn('brotli is not available, skip br '
+                                     'variants')
+                    continue
+            self.encodings.append(encoding)
+        self._lock = threading.Lock()
+
+    def identity(self, encoding):
+        """Encoding and its options, as a part of manifest inputs
+
+        """
+        if encoding == 'gzip':
+            if self.gzip_max_effort:
+                return 'gzip-max'
+            return 'gzip-%d' % self.gzip_level
+        return 'br-%d' % self.brotli_quality
+
+    def compress(self, path, variant_path, encoding):
+        """Compress file path to variant_path with encoding, return size of
+        the variant
+
+        """
+        if encoding == 'gzip':
+            return gzip_file(path, variant_path, self.gzip_level,
+                             self.gzip_max_effort)
+        with open(path, 'rb') as file:
+            compressed = brotli_compress(file.read(), self.brotli_quality)
+        with atomic_open(variant_path, 'wb') as file:
+            file.write(compressed)
+        return len(compressed)
+
+    def is_compressible(self, asset):
+        """Determine whether an asset in inventory should be compressed
+
+        """
+        if asset.size < self.min_size:
+            return False
+        if get_content_encoding(asset.path) is not None:
+            return False
+        return asset.ext in self.extensions or asset.type == 'text'
+
+    def _fresh(self, output, inputs, variant_path):
+        """Return True if the variant is kept and up to date, False if the
+        variant is dropped and the file did not change, or None if it has
+        to be compressed again
+
+        """
+        with self._lock:
+            if self.manifest.is_fresh(output, inputs + [['kept', True]],
+                                      variant_path):
+                return True
+            if self.manifest.is_fresh(output, inputs + [['kept', False]]):
+                return False
+        return None
+
+    def compress_file(self, name, encodings=None):
+        """Output compressed variants of a file in output_dir with encodings
+        (all encodings if it is None), return list of (encoding, variant
+        name) of kept variants
+
+        """
+        if encodings is None:
+            encodings = self.encodings
+        path = os.path.join(self.output_dir, name)
+        digest = None
+        if self.manifest is not None:
+            digest = file_digest(path)
+        size = os.path.getsize(path)
+        variants = []
+        for encoding in encodings:
+            variant_name = get_variant_name(name, encoding)
+            variant_path = os.path.join(self.output_dir, variant_name)
+            if self.manifest is not None:
+                output = 'precompress:' + variant_name
+                inputs = [[name, digest], ['encoding',
+                                           self.identity(encoding)]]
+                fresh = self._fresh(output, inputs, variant_path)
+                if fresh is not None:
+                    if fresh:
+                        variants.append((encoding, variant_name))
+                    continue
+            compressed_size = self.compress(path, variant_path, encoding)
+            kept = compressed_size <= size * self.max_ratio
+            if kept:
+                variants.append((encoding, variant_name))
+                self.logger.info('Compressed %s to %s (%.1f%%)', name,
+                                 variant_name,
+                                 100.0 * compressed_size / size)
+            else:
+                self.logger.info('%s variant of %s is not small enough, '
+                                 'dropped', encoding, name)
+                os.remove(variant_path)
+            if self.manifest is not None:
+                with self._lock:
+                    self.manifest.update(output, inputs + [['kept', kept]])
+        return variants
+
+    def run(self, file_map, inventory):
+        """Compress files of file_map values which are compressible
+        according to inventory of output_dir, add variants to file_map as
+        ``<path>.<encoding>`` and to inventory, return number of variants.
+        A file_map value which is already a compressed variant (such as a
+        gzipped group) gets the other encodings of its original file
+
+        """
+        tasks = []
+        encodings = {}
+        for path, name in sorted(file_map.iteritems()):
+            todo = self.encodings
+            existing = get_content_encoding(name)
+            if existing is not None:
+                base, ext = os.path.splitext(name)
+                name = base[:-len(ENCODING_SUFFIXES[existing])] + ext
+                todo = [encoding for encoding in self.encodings
+                        if encoding != existing]
+            asset = inventory.get(name)
+            if asset is None or not todo or not self.is_compressible(asset):
+                continue
+            tasks.append((path, name))
+            encodings.setdefault(name, set()).update(todo)
+        names = sorted(encodings)
+
+        def compress(name):
+            return self.compress_file(name, [
+                encoding for encoding in self.encodings
+                if encoding in encodings[name]
+            ])
+
+        if self.jobs > 1 and len(names) > 1:
+            pool = ThreadPool(min(self.jobs, len(names)))
+            try:
+                results = pool.map(compress, names)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(compress, names)
+        variants = dict(zip(names, results))
+        count = 0
+        for path, name in tasks:
+            for encoding, variant_name in variants[name]:
+                file_map[path + '.' + encoding] = variant_name
+                inventory.add(variant_name,
+                              os.path.join(self.output_dir, variant_name))
+                count += 1
+        self.logger.info('Precompressed %s files into %s variants',
+                         len(names),
+                         sum(len(result) for result in results))
+        return count
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import logging
+
+from kagin.utils import atomic_open
+
+
+class RemoteSnapshot(object):
+    """Local snapshot of keys in remote storage, a map from name to ETag,
+    so that consecutive deploys know what exists remotely without listing
+    the whole bucket again. The snapshot is listed again when it is older
+    than max_age seconds, or it was taken of another bucket or prefix
+
+    """
+
+    def __init__(self, path, bucket_name, prefix='', max_age=24 * 60 * 60,
+                 logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: path to snapshot file
+        self.path = path
+        #: name of bucket
+        self.bucket_name = bucket_name
+        #: prefix of keys in snapshot
+        self.prefix = prefix
+        #: seconds before the snapshot has to be listed again
+        self.max_age = max_age
+        #: map from name to ETag (None if unknown) of keys
+        self.keys = {}
+        #: time of last listing, None if there is no valid snapshot
+        self.listed_at = None
+        self.load()
+
+    def load(self):
+        """Load snapshot from file
+
+        """
+        self.keys = {}
+        self.listed_at = None
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rt') as file:
+            content = file.read()
+        try:
+            data = json.loads(content)
+        except ValueError:
+            self.logger.warn('Ignore corrupted remote snapshot %s', self.path)
+            return
+        if (data.get('bucket') != self.bucket_name or
+                data.get('prefix') != self.prefix):
+            self.logger.info('Remote snapshot is taken of another bucket, '
+                             'ignored')
+            return
+        self.keys = data['keys']
+        self.listed_at = data['listed_at']
+
+    @property
+    def fresh(self):
+        """Whether the snapshot can be used without listing again
+
+        """
+        if self.listed_at is None:
+            return False
+        return time.time() - self.listed_at <= self.max_age
+
+    def refresh(self, storage):
+        """List keys of storage into the snapshot
+
+        """
+        begin = time.time()
+        self.keys = dict((key.name, key.etag)
+                         for key in storage.iter_keys(self.prefix))
+        self.listed_at = begin
+        self.logger.info('Listed %s keys in %.2fs', len(self.keys),
+                         time.time() - begin)
+
+    def add(self, name, etag=None):
+        """Record an uploaded key
+
+        """
+        self.keys[name] = etag
+
+    def remove(self, name):
+        """Record a removed key
+
+        """
+        self.keys.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def save(self):
+        """Write snapshot to file atomically
+
+        """
+        with atomic_open(self.path, 'wt') as file:
+            json.dump(dict(
+                bucket=self.bucket_name,
+                prefix=self.prefix,
+                listed_at=self.listed_at,
+                keys=self.keys,
+            ), file)
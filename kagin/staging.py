@@ -0,0 +1,92 @@
+import os
+import errno
+import shutil
+import threading
+
+#: available staging strategies
+STRATEGIES = ('copy', 'hardlink', 'reflink', 'auto')
+
+#: ioctl request number of FICLONE on Linux
+FICLONE = 0x40049409
+
+
+def reflink(src, dest):
+    """Clone src as dest sharing the same extents (copy-on-write), raise
+    IOError or OSError if the file system does not support it
+
+    """
+    import fcntl
+    with open(src, 'rb') as src_file:
+        with open(dest, 'wb') as dest_file:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+
+
+def copy_range(src, dest):
+    """Copy src to dest in kernel with copy_file_range, raise OSError if it
+    is not available
+
+    """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is None:
+        raise OSError(errno.ENOSYS, 'copy_file_range is not available')
+    with open(src, 'rb') as src_file:
+        with open(dest, 'wb') as dest_file:
+            remaining = os.fstat(src_file.fileno()).st_size
+            while remaining > 0:
+                copied = copy_file_range(src_file.fileno(),
+                                         dest_file.fileno(), remaining)
+                if not copied:
+                    break
+                remaining -= copied
+
+
+def _stage(src, dest, strategy, private):
+    if strategy == 'hardlink' and not private:
+        try:
+            os.link(src, dest)
+            return 'hardlink'
+        except OSError:
+            pass
+    if strategy in ('hardlink', 'reflink', 'auto'):
+        for method, func in [('reflink', reflink), ('copy_range', copy_range)]:
+            try:
+                func(src, dest)
+            except (IOError, OSError):
+                continue
+            shutil.copystat(src, dest)
+            return method
+    shutil.copy2(src, dest)
+    return 'copy'
+
+
+def stage_file(src, dest, strategy='copy', private=False):
+    """Make the content of src available at dest and return the method
+    actually used (hardlink, reflink, copy_range or copy), mode and mtime
+    of src are kept
+
+    With hardlink strategy, files are hard linked unless private is True,
+    private files (such as CSS files whose links are rewritten later) get
+    a copy of their own. With reflink strategy, files are cloned where the
+    file system supports it. The auto strategy uses reflink, then
+    copy_file_range, and never hard links, so that editing a source file in
+    place never changes built files. All strategies fall back to a plain
+    copy.
+
+    The file is staged under a temporary name which then replaces dest, so
+    an existing link at dest is never written through, and threads staging
+    the same dest concurrently (inputs with the same content) do not race
+
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError('Unknown staging strategy %r' % strategy)
+    # unique to the process and thread
+    temp_path = '%s.%d-%d.tmp' % (dest, os.getpid(), 
+                                  threading.current_thread().ident)
+    try:
+        method = _stage(src, temp_path, strategy, private)
+        os.rename(temp_path, dest)
+    except:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+    return method
@@ -1,8 +1,35 @@
+import os
+import copy
+import time
+import calendar
+import email.utils
 import urlparse
 import logging
+import threading
+import collections
+from multiprocessing.pool import ThreadPool
 
-from boto.s3.connection import S3Connection
-from boto.s3.key import Key
+#: a key in storage, etag is the quoted-stripped ETag, which is the MD5 of
+#: content for objects which are not uploaded in multiple parts
+RemoteKey = collections.namedtuple('RemoteKey', [
+    'name', 'etag', 'size', 'last_modified',
+])
+
+
+def parse_last_modified(value):
+    """Parse last modified time of a key in listing, such as 
+    2013-01-31T12:00:00.000Z, into seconds since epoch
+    
+    """
+    return calendar.timegm(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+def format_http_date(timestamp):
+    """Format seconds since epoch as HTTP date, such as
+    Thu, 31 Jan 2013 12:00:00 GMT
+    
+    """
+    return email.utils.formatdate(timestamp, usegmt=True)
 
 
 class S3Storage(object):
@@ -18,6 +45,12 @@ class S3Storage(object):
         access_key, 
         secret_key, 
         default_headers=None,
+        connection_factory=None,
+        multipart_threshold=64 * 1024 * 1024,
+        part_size=16 * 1024 * 1024,
+        part_jobs=4,
+        part_retries=3,
+        retry_backoff=0.5,
         logger=None
     ):
         self.logger = logger
@@ -30,20 +63,65 @@ class S3Storage(object):
         self.secret_key = secret_key
         self.bucket_name = bucket_name
         self.default_headers = default_headers
+        #: function to create a connection with access key and secret key,
+        #: boto S3Connection is used if it is None
+        self.connection_factory = connection_factory
+        #: files not smaller than this are uploaded in multiple parts, 
+        #: never if it is None
+        self.multipart_threshold = multipart_threshold
+        #: size of parts in bytes, at least 5 MB for S3
+        self.part_size = part_size
+        #: number of parts of a file to upload concurrently
+        self.part_jobs = part_jobs
+        #: number of times to retry a failed part
+        self.part_retries = part_retries
+        #: seconds to wait before the first retry, doubled for every retry
+        self.retry_backoff = retry_backoff
+        # connections are not thread-safe, so every thread has its own
+        # connection and bucket
+        self._local = threading.local()
+        self._bucket_created = False
+        self._lock = threading.Lock()
+        
+    def make_connection(self):
+        """Create a new connection to S3
+        
+        """
+        factory = self.connection_factory
+        if factory is None:
+            from boto.s3.connection import S3Connection
+            factory = S3Connection
+        return factory(self.access_key, self.secret_key)
         
     @property
     def conn(self):
-        if hasattr(self, '_conn'):
-            return self._conn
-        self._conn = S3Connection(self.access_key, self.secret_key)
-        return self._conn
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self.make_connection()
+        return conn
     
     @property
     def bucket(self):
-        if hasattr(self, '_bucket'):
-            return self._bucket
-        self._bucket = self.conn.create_bucket(self.bucket_name)
-        return self._bucket
+        bucket = getattr(self._local, 'bucket', None)
+        if bucket is not None:
+            return bucket
+        with self._lock:
+            # create the bucket once, other threads only get it
+            if not self._bucket_created:
+                bucket = self.conn.create_bucket(self.bucket_name)
+                self._bucket_created = True
+        if bucket is None:
+            bucket = self.conn.get_bucket(self.bucket_name, validate=False)
+        self._local.bucket = bucket
+        return bucket
+    
+    def reset_connection(self):
+        """Drop connection of current thread, for example after an error,
+        a new one is created when it is used next time
+        
+        """
+        self._local.conn = None
+        self._local.bucket = None
         
     def route_url(self, name, https=False):
         """Get URL of object in storage by name
@@ -60,11 +138,43 @@ class S3Storage(object):
         """
         return self.bucket.get_key(name) is not None
     
-    def get_names(self):
-        """Get a list of existing name of files
+    def iter_keys(self, prefix='', page_size=1000):
+        """Iterate RemoteKey of files whose name starts with prefix, page 
+        by page, so that keys of a large bucket are never all in memory
+        
+        """
+        marker = ''
+        pages = 0
+        while True:
+            keys = self.bucket.get_all_keys(prefix=prefix, marker=marker, 
+                                            max_keys=page_size)
+            pages += 1
+            for key in keys:
+                etag = key.etag
+                if etag:
+                    etag = etag.strip('"')
+                yield RemoteKey(key.name, etag, key.size, key.last_modified)
+            if not keys or not keys.is_truncated:
+                break
+            marker = keys[-1].name
+        self.logger.debug('Listed %s pages of keys with prefix %r', pages, 
+                          prefix)
+    
+    def get_metadata(self, name, field):
+        """Get a metadata field of a file, return None if there is no such
+        file or field
         
         """
-        return [key.name for key in self.bucket.get_all_keys()]
+        key = self.bucket.get_key(name)
+        if key is None:
+            return None
+        return key.get_metadata(field)
+    
+    def get_names(self, prefix=''):
+        """Get a set of existing name of files
+        
+        """
+        return set(key.name for key in self.iter_keys(prefix))
     
     def _upload_args(
         self, 
@@ -72,46 +182,140 @@ class S3Storage(object):
         content_encoding=None,
         cache_control=None,
         expires=None, 
+        vary=None,
+        metadata=None,
         reduced_redundancy=True
     ):
-        import datetime
-        import email
-        import time
-        
         headers = self.default_headers or {}
         headers = headers.copy()
         if expires:
-            due = (datetime.datetime.now() + expires).timetuple()
-            headers['Expires'] = \
-                '%s GMT' % email.Utils.formatdate(time.mktime(due))
+            # an HTTP date computed by caller, or a timedelta from now
+            if not isinstance(expires, basestring):
+                expires = format_http_date(
+                    time.time() + expires.days * 86400 + expires.seconds
+                )
+            headers['Expires'] = expires
         if content_type:
             headers['Content-Type'] = content_type
         if cache_control:
             headers['Cache-Control'] = cache_control
         if content_encoding:
             headers['Content-Encoding'] = content_encoding
+        if vary:
+            headers['Vary'] = vary
+        for name, value in (metadata or {}).iteritems():
+            headers['x-amz-meta-' + name] = value
         return dict(headers=headers, reduced_redundancy=reduced_redundancy)
         
     def upload(self, name, data, **kwargs):
         """Upload data
         
         """
-        key = Key(self.bucket, name)
+        key = self.bucket.new_key(name)
         args = self._upload_args(**kwargs)
         key.set_contents_from_string(data, **args)
         
     def upload_file(self, name, filename, **kwargs
                     ):
-        """Upload data from file
+        """Upload data from file, in multiple parts if it is not smaller
+        than multipart_threshold
         
         """
-        key = Key(self.bucket, name)
+        if (self.multipart_threshold is not None and 
+                os.path.getsize(filename) >= self.multipart_threshold):
+            return self.upload_multipart(name, filename, **kwargs)
+        key = self.bucket.new_key(name)
         args = self._upload_args(**kwargs)
         key.set_contents_from_filename(filename, **args)
+        return key
+        
+    def _upload_part(self, multipart, filename, part):
+        """Upload a part of (part number, offset, size) of file with 
+        retries, through connection of current thread
+        
+        """
+        number, offset, size = part
+        for attempt in xrange(self.part_retries + 1):
+            # a copy of the upload bound to bucket of current thread
+            thread_multipart = copy.copy(multipart)
+            thread_multipart.bucket = self.bucket
+            try:
+                with open(filename, 'rb') as file:
+                    file.seek(offset)
+                    thread_multipart.upload_part_from_file(file, number, 
+                                                           size=size)
+                return
+            except Exception, e:
+                self.reset_connection()
+                if attempt == self.part_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                self.logger.warn('Failed to upload part %s of %s (%s), '
+                                 'retry in %.1fs', number, multipart.key_name, 
+                                 e, delay)
+                time.sleep(delay)
+        
+    def upload_multipart(self, name, filename, **kwargs):
+        """Upload data from file in parts of part_size concurrently, parts
+        are streamed from the file, so only a buffer of each part is in 
+        memory. The upload is cancelled if a part fails after all retries
+        
+        """
+        size = os.path.getsize(filename)
+        parts = [
+            (number + 1, offset, min(self.part_size, size - offset))
+            for number, offset in enumerate(xrange(0, size, self.part_size))
+        ]
+        args = self._upload_args(**kwargs)
+        multipart = self.bucket.initiate_multipart_upload(name, **args)
+        self.logger.info('Uploading %s in %s parts ...', name, len(parts))
+        pool = ThreadPool(max(1, min(self.part_jobs, len(parts))))
+        try:
+            pool.map(lambda part: self._upload_part(multipart, filename, 
+                                                    part), parts)
+            return multipart.complete_upload()
+        except:
+            multipart.cancel_upload()
+            raise
+        finally:
+            pool.close()
+            pool.join()
         
     def remove(self, name):
         """Remove file
         
         """
-        key = Key(self.bucket, name)
+        key = self.bucket.new_key(name)
         key.delete()
+        
+    def _remove_batch(self, names):
+        """Remove a batch of files with one multi-object delete request, 
+        return list of (name, error message) of files failed to remove
+        
+        """
+        try:
+            result = self.bucket.delete_keys(names, quiet=True)
+        except Exception, e:
+            self.reset_connection()
+            return [(name, str(e)) for name in names]
+        return [(error.key, error.message) for error in result.errors]
+        
+    def remove_many(self, names, batch_size=1000, jobs=4):
+        """Remove files with multi-object delete requests of at most 
+        batch_size (limited to 1000 by S3) keys, jobs requests are sent 
+        concurrently. Return list of (name, error message) of files failed 
+        to remove
+        
+        """
+        names = list(names)
+        batches = [names[index:index + batch_size] 
+                   for index in xrange(0, len(names), batch_size)]
+        if not batches:
+            return []
+        pool = ThreadPool(max(1, min(jobs, len(batches))))
+        try:
+            results = pool.map(self._remove_batch, batches)
+        finally:
+            pool.close()
+            pool.join()
+        return [error for errors in results for error in errors]
@@ -0,0 +1,236 @@
+"""In-memory stand-in of boto S3 connections, buckets and keys for tests
+and benchmarks, with optional latency and injected failures
+
+"""
+import time
+import hashlib
+import itertools
+import threading
+
+
+class FakeS3Error(IOError):
+    pass
+
+
+class FakeKey(object):
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.data = None
+        self.headers = {}
+        self.metadata = {}
+        self.size = 0
+        self.etag = None
+        self.last_modified = None
+
+    def _store(self, data, headers=None, etag=None):
+        self.data = data
+        self.headers = dict(headers or {})
+        self.metadata = dict(
+            (name[len('x-amz-meta-'):], value)
+            for name, value in self.headers.iteritems()
+            if name.lower().startswith('x-amz-meta-')
+        )
+        self.size = len(data)
+        self.etag = etag or '"%s"' % hashlib.md5(data).hexdigest()
+        self.last_modified = time.strftime('%Y-%m-%dT%H:%M:%S.000Z',
+                                           time.gmtime())
+        with self.bucket.lock:
+            self.bucket.keys[self.name] = self
+
+    def set_contents_from_string(self, data, headers=None, **kwargs):
+        self.bucket.service.request('PUT', self.name, len(data))
+        self._store(data, headers)
+
+    def set_contents_from_filename(self, filename, headers=None, **kwargs):
+        with open(filename, 'rb') as file:
+            data = file.read()
+        self.bucket.service.request('PUT', self.name, len(data))
+        self._store(data, headers)
+
+    def get_metadata(self, name):
+        return self.metadata.get(name)
+
+    def delete(self):
+        self.bucket.delete_key(self.name)
+
+
+class FakeMultiPartUpload(object):
+
+    def __init__(self, bucket, key_name, id, headers):
+        self.bucket = bucket
+        self.key_name = key_name
+        self.id = id
+        self.headers = headers
+
+    def upload_part_from_file(self, fp, part_num, size=None):
+        service = self.bucket.service
+        data = fp.read(size)
+        service.request('PUT', '%s?partNumber=%d' % (self.key_name,
+                                                     part_num), len(data))
+        with service.lock:
+            service.uploads[self.id][part_num] = data
+
+    def complete_upload(self):
+        service = self.bucket.service
+        service.request('POST', self.key_name)
+        with service.lock:
+            parts = service.uploads.pop(self.id)
+        numbers = sorted(parts)
+        assert numbers == range(1, len(numbers) + 1)
+        digests = ''.join(hashlib.md5(parts[number]).digest()
+                          for number in numbers)
+        etag = '"%s-%d"' % (hashlib.md5(digests).hexdigest(), len(numbers))
+        key = self.bucket.new_key(self.key_name)
+        key._store(''.join(parts[number] for number in numbers),
+                   self.headers, etag)
+        return key
+
+    def cancel_upload(self):
+        service = self.bucket.service
+        service.request('DELETE', self.key_name)
+        with service.lock:
+            service.uploads.pop(self.id, None)
+
+
+class FakeResultSet(list):
+    is_truncated = False
+
+
+class FakeDeleteError(object):
+
+    def __init__(self, key, message):
+        self.key = key
+        self.code = 'InternalError'
+        self.message = message
+
+
+class FakeMultiDeleteResult(object):
+
+    def __init__(self):
+        self.deleted = []
+        self.errors = []
+
+
+class FakeBucket(object):
+
+    def __init__(self, service, name):
+        self.service = service
+        self.name = name
+        #: map from name to FakeKey
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def new_key(self, name):
+        return FakeKey(self, name)
+
+    def initiate_multipart_upload(self, name, headers=None, **kwargs):
+        self.service.request('POST', name)
+        with self.service.lock:
+            id = str(next(self.service.upload_ids))
+            self.service.uploads[id] = {}
+        return FakeMultiPartUpload(self, name, id, headers)
+
+    def get_key(self, name):
+        self.service.request('HEAD', name)
+        return self.keys.get(name)
+
+    def get_all_keys(self, prefix='', marker='', max_keys=1000):
+        self.service.request('GET', prefix)
+        with self.lock:
+            names = [name for name in sorted(self.keys) 
+                     if name.startswith(prefix) and name > marker]
+            result = FakeResultSet(self.keys[name] 
+                                   for name in names[:max_keys])
+        result.is_truncated = len(names) > max_keys
+        return result
+
+    def delete_key(self, name):
+        self.service.request('DELETE', name)
+        with self.lock:
+            self.keys.pop(name, None)
+
+    def delete_keys(self, keys, quiet=False, **kwargs):
+        names = list(keys)
+        assert len(names) <= 1000
+        self.service.request('POST', '?delete')
+        result = FakeMultiDeleteResult()
+        for name in names:
+            # failures injected to a key fail only the key
+            with self.service.lock:
+                remaining = self.service.failures.get(name, 0)
+                if remaining:
+                    self.service.failures[name] = remaining - 1
+            if remaining:
+                result.errors.append(FakeDeleteError(name, 'Injected'))
+                continue
+            with self.lock:
+                self.keys.pop(name, None)
+            if not quiet:
+                result.deleted.append(name)
+        return result
+
+
+class FakeS3(object):
+    """Fake S3 service, call it with access key and secret key to make a
+    connection, so that it can be used as connection_factory of S3Storage
+
+    """
+
+    def __init__(self, latency=0, bandwidth=None, failures=None):
+        #: seconds of delay of every request
+        self.latency = latency
+        #: bytes per second of every connection, unlimited if it is None
+        self.bandwidth = bandwidth
+        #: map from key name to number of times requests to it fail
+        self.failures = dict(failures or {})
+        #: map from name to FakeBucket
+        self.buckets = {}
+        #: map from id to parts (map from part number to data) of
+        #: multipart uploads in progress
+        self.uploads = {}
+        self.upload_ids = itertools.count(1)
+        #: number of connections created
+        self.connections = 0
+        #: list of (method, key name) of requests
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def __call__(self, access_key, secret_key):
+        with self.lock:
+            self.connections += 1
+        return FakeS3Connection(self)
+
+    def bucket(self, name):
+        with self.lock:
+            bucket = self.buckets.get(name)
+            if bucket is None:
+                bucket = self.buckets[name] = FakeBucket(self, name)
+            return bucket
+
+    def request(self, method, name, size=0):
+        with self.lock:
+            self.requests.append((method, name))
+            remaining = self.failures.get(name, 0)
+            if remaining:
+                self.failures[name] = remaining - 1
+        delay = self.latency
+        if self.bandwidth:
+            delay += float(size) / self.bandwidth
+        if delay:
+            time.sleep(delay)
+        if remaining:
+            raise FakeS3Error('Injected failure of %s %s' % (method, name))
+
+
+class FakeS3Connection(object):
+
+    def __init__(self, service):
+        self.service = service
+
+    def create_bucket(self, name):
+        return self.service.bucket(name)
+
+    def get_bucket(self, name, validate=True):
+        return self.service.bucket(name)
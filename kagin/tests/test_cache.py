@@ -0,0 +1,197 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+
+class TestMinifyCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def make_one(self, *args, **kwargs):
+        from kagin.cache import MinifyCache
+        return MinifyCache(self.cache_dir, *args, **kwargs)
+
+    def test_get_set(self):
+        cache = self.make_one()
+        key = cache.make_key('hash', 'yuicompressor-2.4.2.jar', True)
+        self.assertNotEqual(key, cache.make_key('hash', 'other', True))
+        self.assertNotEqual(key, cache.make_key(
+            'hash', 'yuicompressor-2.4.2.jar', False))
+        self.assertEqual(cache.get(key), None)
+        cache.set(key, 'var a=1;')
+        self.assertEqual(cache.get(key), 'var a=1;')
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_prune(self):
+        cache = self.make_one(max_size=20)
+        keys = [cache.make_key(index) for index in xrange(3)]
+        for index, key in enumerate(keys):
+            cache.set(key, 'x' * 10)
+            path = cache._path(key)
+            past = time.time() - 100 + index
+            os.utime(path, (past, past))
+        # use the oldest one, so that it becomes the most recently used
+        cache.get(keys[0])
+        self.assertEqual(cache.prune(), 1)
+        self.assertEqual(cache.get(keys[1]), None)
+        self.assertEqual(cache.get(keys[0]), 'x' * 10)
+        self.assertEqual(cache.get(keys[2]), 'x' * 10)
+
+    def test_builder_uses_cache(self):
+        from kagin.minify import Builder
+        from kagin.tests.test_minify import FakeCompressor
+        input_dir = tempfile.mkdtemp()
+        output_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(input_dir, 'a.js')
+            with open(filename, 'wt') as file:
+                file.write('var a = 1;')
+            output_path = os.path.join(output_dir, 'all.mini.js')
+            compressor = FakeCompressor()
+            builder = Builder(input_dir, output_dir, compressor=compressor,
+                              cache=self.make_one())
+            builder.minify([filename], output_path)
+            builder.minify([filename], output_path)
+            self.assertEqual(compressor.filenames, [filename])
+            with open(output_path, 'rt') as file:
+                self.assertEqual(file.read(), 'var a = 1;')
+        finally:
+            shutil.rmtree(input_dir, ignore_errors=True)
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+
+class TestHashCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.dir, 'hash_cache.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def make_one(self, *args, **kwargs):
+        from kagin.cache import HashCache
+        return HashCache(self.cache_path, *args, **kwargs)
+
+    def write_file(self, name, content, mtime=1000000):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wt') as file:
+            file.write(content)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_hash_file_uses_cache(self):
+        from kagin.hash import HashFile
+        input_dir = os.path.join(self.dir, 'input')
+        output_dir = os.path.join(self.dir, 'output')
+        os.mkdir(input_dir)
+        os.mkdir(output_dir)
+        self.write_file('input/a.txt', 'a')
+        self.write_file('input/b.txt', 'b')
+
+        def run():
+            cache = self.make_one('md5')
+            hash_file = HashFile(input_dir, output_dir, hash_cache=cache)
+            computed = []
+            compute_hash = hash_file.compute_hash
+
+            def count_compute_hash(filename):
+                computed.append(os.path.basename(filename))
+                return compute_hash(filename)
+            hash_file.compute_hash = count_compute_hash
+            return hash_file.run_hashing(), sorted(computed)
+
+        file_map, computed = run()
+        self.assertEqual(computed, ['a.txt', 'b.txt'])
+        self.assertEqual(run(), (file_map, []))
+
+        # changed file is hashed again
+        self.write_file('input/b.txt', 'bb')
+        new_file_map, computed = run()
+        self.assertEqual(computed, ['b.txt'])
+        self.assertNotEqual(new_file_map['b.txt'], file_map['b.txt'])
+
+    def test_invalidation(self):
+        path = self.write_file('a.txt', 'a')
+        stat = os.stat(path)
+        cache = self.make_one('md5', 'v1')
+        cache.set(path, stat, 'digest')
+        cache.save()
+        self.assertEqual(self.make_one('md5', 'v1').get(path, stat), 'digest')
+        self.assertEqual(self.make_one('md5', 'v2').get(path, stat), None)
+        self.assertEqual(self.make_one('sha1', 'v1').get(path, stat), None)
+
+    def test_racy_entry_not_cached(self):
+        path = self.write_file('a.txt', 'a', mtime=time.time())
+        cache = self.make_one('md5')
+        cache.set(path, os.stat(path), 'digest')
+        self.assertEqual(cache.get(path, os.stat(path)), None)
+
+    def test_compaction(self):
+        a = self.write_file('a.txt', 'a')
+        b = self.write_file('b.txt', 'b')
+        cache = self.make_one('md5')
+        cache.set(a, os.stat(a), 'digest a')
+        cache.set(b, os.stat(b), 'digest b')
+        cache.save()
+
+        cache = self.make_one('md5')
+        self.assertEqual(cache.get(a, os.stat(a)), 'digest a')
+        cache.save()
+        self.assertEqual(self.make_one('md5').entries.keys(), 
+                         [os.path.abspath(a)])
+
+
+class TestResolutionCache(unittest.TestCase):
+
+    def test_resolve(self):
+        from kagin.cache import ResolutionCache
+        calls = []
+
+        def resolve(dir, url):
+            calls.append((dir, url))
+            return dir + '/' + url
+        cache = ResolutionCache(resolve)
+        self.assertEqual(cache.resolve('css', 'a.png'), 'css/a.png')
+        self.assertEqual(cache.resolve('css', 'a.png'), 'css/a.png')
+        self.assertEqual(cache.resolve('img', 'a.png'), 'img/a.png')
+        self.assertEqual(calls, [('css', 'a.png'), ('img', 'a.png')])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_shared_by_css_files(self):
+        from kagin.hash import HashFile
+        input_dir = tempfile.mkdtemp()
+        output_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(input_dir, 'sprite.png'), 'wb') as file:
+                file.write('png')
+            for index in xrange(3):
+                path = os.path.join(input_dir, '%d.css' % index)
+                with open(path, 'wt') as file:
+                    file.write('p { background: url(sprite.png); }')
+            hash_file = HashFile(input_dir, output_dir)
+            cache = hash_file.resolution_cache
+            file_map = hash_file.run_hashing()
+            hash_file.run_linking(file_map, lambda name: name)
+            self.assertEqual(cache.entries, {('', 'sprite.png'): 'sprite.png'})
+        finally:
+            shutil.rmtree(input_dir, ignore_errors=True)
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestMinifyCache))
+    suite.addTest(unittest.makeSuite(TestHashCache))
+    suite.addTest(unittest.makeSuite(TestResolutionCache))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 
 class TestHashFile(unittest.TestCase):
@@ -31,9 +34,248 @@ class TestHashFile(unittest.TestCase):
         assert_url_path('c:\\base\\a\\b\\..\\myfile.txt', 
                         'c:\\base', 'a/myfile.txt')
         
+
+
+class TestHashing(unittest.TestCase):
+    
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.input_dir, ignore_errors=True)
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+        
+    def write_file(self, name, content):
+        with open(os.path.join(self.input_dir, name), 'wt') as file:
+            file.write(content)
+            
+    def read_output(self, name):
+        with open(os.path.join(self.output_dir, name), 'rt') as file:
+            return file.read()
+        
+    def build(self):
+        from kagin.hash import HashFile
+        from kagin.manifest import BuildManifest
+        manifest = BuildManifest(os.path.join(self.output_dir, 'manifest'))
+        hash_file = HashFile(self.input_dir, self.output_dir, 
+                             manifest=manifest)
+        file_map = hash_file.run_hashing()
+        hash_file.run_linking(file_map, lambda name: name)
+        manifest.save()
+        return file_map
+    
+    def test_relink_changed_reference(self):
+        self.write_file('a.png', 'image 1')
+        self.write_file('a.css', 'html { background: url(a.png); }')
+        file_map = self.build()
+        css_name = file_map['a.css']
+        self.assertEqual(self.read_output(css_name), 
+                         'html { background: url(%s); }' % file_map['a.png'])
+        
+        # nothing changed, the output is not written again
+        os.utime(os.path.join(self.output_dir, css_name), (0, 0))
+        self.build()
+        self.assertEqual(
+            os.stat(os.path.join(self.output_dir, css_name)).st_mtime, 0)
+        
+        # referenced image changed, so the CSS file is linked again
+        self.write_file('a.png', 'image 2')
+        new_file_map = self.build()
+        self.assertEqual(new_file_map['a.css'], css_name)
+        self.assertNotEqual(new_file_map['a.png'], file_map['a.png'])
+        self.assertEqual(
+            self.read_output(css_name), 
+            'html { background: url(%s); }' % new_file_map['a.png']
+        )
+        
+    def test_parallel_hashing(self):
+        from kagin.hash import HashFile
+        os.mkdir(os.path.join(self.input_dir, 'img'))
+        for index in xrange(20):
+            self.write_file('img/%d.png' % index, 'image %d' % (index % 5))
+        
+        def run(jobs):
+            output_dir = tempfile.mkdtemp()
+            try:
+                hash_file = HashFile(self.input_dir, output_dir, jobs=jobs)
+                return hash_file.run_hashing(), sorted(os.listdir(output_dir))
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+                
+        file_map, outputs = run(1)
+        self.assertEqual(len(file_map), 20)
+        self.assertEqual(len(outputs), 5)
+        self.assertEqual(run(4), (file_map, outputs))
+        
+    def test_parallel_duplicate_content(self):
+        from kagin.hash import HashFile
+        content = 'image' * 20000
+        for index in xrange(200):
+            self.write_file('%d.png' % index, content)
+        for staging in ['copy', 'hardlink']:
+            output_dir = tempfile.mkdtemp()
+            try:
+                # all inputs are staged to the same output concurrently
+                hash_file = HashFile(self.input_dir, output_dir, jobs=8, 
+                                     staging=staging)
+                file_map = hash_file.run_hashing()
+                self.assertEqual(len(set(file_map.values())), 1)
+                output_path = os.path.join(output_dir, file_map['0.png'])
+                self.assertEqual(os.listdir(output_dir), 
+                                 [file_map['0.png']])
+                with open(output_path, 'rt') as file:
+                    self.assertEqual(file.read(), content)
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+        
+    def test_layered_input(self):
+        from kagin.hash import HashFile
+        minify_dir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(self.input_dir, 'img'))
+            self.write_file('img/a.png', 'image')
+            self.write_file('base.mini.css', 'old')
+            with open(os.path.join(minify_dir, 'base.mini.css'), 'wt') as file:
+                file.write('html { background: url(img/a.png); }')
+            hash_file = HashFile([self.input_dir, minify_dir], 
+                                 self.output_dir)
+            file_map = hash_file.run_hashing()
+            hash_file.run_linking(file_map, lambda name: name)
+            self.assertEqual(sorted(file_map), ['base.mini.css', 'img/a.png'])
+            # the minified file shadows the one in input directory
+            self.assertEqual(
+                self.read_output(file_map['base.mini.css']),
+                'html { background: url(%s); }' % file_map['img/a.png']
+            )
+        finally:
+            shutil.rmtree(minify_dir, ignore_errors=True)
+        
+    def test_compute_hash_slices(self):
+        import hashlib
+        from kagin.hash import HashFile
+        content = ''.join(chr(index % 256) for index in xrange(10000))
+        self.write_file('data.bin', content)
+        hash_file = HashFile(self.input_dir, self.output_dir, 
+                             hash_version='v1')
+        hash_file.slice_size = 4096
+        path = os.path.join(self.input_dir, 'data.bin')
+        self.assertEqual(hash_file.compute_hash(path), 
+                         hashlib.md5('v1' + content).hexdigest())
+        self.write_file('empty', '')
+        path = os.path.join(self.input_dir, 'empty')
+        self.assertEqual(hash_file.compute_hash(path), 
+                         hashlib.md5('v1').hexdigest())
+        
+    def test_truncated_digest(self):
+        from kagin.hash import HashFile, HashCollisionError
+        self.write_file('a.txt', 'a')
+        self.write_file('b.txt', 'a')
+        hash_file = HashFile(self.input_dir, self.output_dir, 
+                             digest_length=8)
+        self.assertTrue(hash_file.truncated)
+        self.assertEqual(hash_file.hash_name, 'md5-8')
+        file_map = hash_file.run_hashing()
+        self.assertEqual(file_map['a.txt'], file_map['b.txt'])
+        self.assertEqual(len(file_map['a.txt']), len('12345678.txt'))
+        
+        # 17 different files can't have 16 different hash values
+        for index in xrange(17):
+            self.write_file('%d.txt' % index, str(index))
+        hash_file = HashFile(self.input_dir, self.output_dir, 
+                             digest_length=1)
+        self.assertRaises(HashCollisionError, hash_file.run_hashing)
+        
+    def test_blake2(self):
+        from kagin.hash import HashFile, get_hash_type
+        try:
+            hash_type = get_hash_type('blake2b', 10)
+        except ImportError:
+            self.skipTest('blake2 is not available')
+        self.write_file('a.txt', 'a')
+        hash_file = HashFile(self.input_dir, self.output_dir, 
+                             hash_type=hash_type)
+        self.assertEqual(hash_file.hash_name, 'blake2b-20')
+        self.assertEqual(len(hash_file.run_hashing()['a.txt']), 
+                         len('a' * 20 + '.txt'))
+
+    def test_dependency_order(self):
+        from kagin.hash import HashFile
+        os.mkdir(os.path.join(self.input_dir, 'css'))
+        self.write_file('a.png', 'image 1')
+        self.write_file('b.png', 'image')
+        self.write_file('css/base.css', 'p { background: url(../a.png); }')
+        self.write_file('css/main.css', '@import url(base.css);')
+        self.write_file('other.css', 'p { background: url(b.png); }')
+
+        def build():
+            hash_file = HashFile(self.input_dir, self.output_dir)
+            return hash_file.run_ordered(lambda name: name)
+
+        file_map = build()
+        self.assertEqual(
+            self.read_output(file_map['css/base.css']),
+            'p { background: url(%s); }' % file_map['a.png']
+        )
+        self.assertEqual(self.read_output(file_map['css/main.css']),
+                         '@import url(%s);' % file_map['css/base.css'])
+
+        # only files refer to the changed image get new names
+        self.write_file('a.png', 'image 2')
+        new_file_map = build()
+        for name in ('a.png', 'css/base.css', 'css/main.css'):
+            self.assertNotEqual(new_file_map[name], file_map[name])
+        for name in ('b.png', 'other.css'):
+            self.assertEqual(new_file_map[name], file_map[name])
+
+    def test_parallel_linking(self):
+        from kagin.hash import HashFile
+        from kagin.manifest import BuildManifest
+        os.mkdir(os.path.join(self.input_dir, 'css'))
+        for index in xrange(4):
+            self.write_file('%d.png' % index, 'image %d' % index)
+        for index in xrange(10):
+            self.write_file('css/%d.css' % index,
+                            'p { background: url(../%d.png); }\n'
+                            'a { background: url(missing.png); }' %
+                            (index % 4))
+
+        def run(processes, output_dir):
+            manifest = BuildManifest(os.path.join(output_dir, 'manifest'))
+            hash_file = HashFile(self.input_dir, output_dir,
+                                 manifest=manifest,
+                                 link_processes=processes)
+            file_map = hash_file.run_hashing()
+            hash_file.run_linking(file_map, lambda name: '/' + name)
+            manifest.save()
+            outputs = {}
+            for filename in os.listdir(output_dir):
+                with open(os.path.join(output_dir, filename), 'rt') as file:
+                    outputs[filename] = file.read()
+            return outputs
+
+        serial = run(1, self.output_dir)
+        output_dir = tempfile.mkdtemp()
+        try:
+            self.assertEqual(run(4, output_dir), serial)
+            # fresh outputs are kept, and no temporary file is left
+            self.assertEqual(run(4, output_dir), serial)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    def test_dependency_cycle(self):
+        from kagin.hash import HashFile, DependencyCycleError
+        self.write_file('a.css', '@import url(b.css);')
+        self.write_file('b.css', '@import url(a.css);')
+        hash_file = HashFile(self.input_dir, self.output_dir)
+        self.assertRaises(DependencyCycleError, hash_file.run_ordered,
+                          lambda name: name)
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TestHashFile))
+    suite.addTest(unittest.makeSuite(TestHashing))
     return suite
         
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestAssetInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.dir, name)
+        dir = os.path.dirname(path)
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        with open(path, 'wt') as file:
+            file.write(content)
+        return path
+
+    def test_scan(self):
+        from kagin.inventory import AssetInventory
+        self.write_file('input/a.js', 'var a;')
+        self.write_file('input/css/b.css', 'b { }')
+        self.write_file('input/img/c.PNG', 'png')
+        self.write_file('minify/a.js', 'var a=1;')
+        self.write_file('minify/all.mini.css', 'b{}')
+        inventory = AssetInventory.scan([
+            os.path.join(self.dir, 'input'),
+            os.path.join(self.dir, 'minify'),
+            os.path.join(self.dir, 'missing'),
+        ])
+        self.assertEqual([asset.path for asset in inventory],
+                         ['a.js', 'all.mini.css', 'css/b.css', 'img/c.PNG'])
+        # later roots shadow earlier ones
+        asset = inventory.get('a.js')
+        self.assertEqual(asset.file_path,
+                         os.path.join(self.dir, 'minify', 'a.js'))
+        self.assertEqual(asset.size, 8)
+        self.assertEqual(asset.type, 'js')
+        self.assertEqual([asset.path for asset in inventory.by_ext('.css')],
+                         ['all.mini.css', 'css/b.css'])
+        self.assertEqual([asset.path for asset in inventory.by_type('image')],
+                         ['img/c.PNG'])
+        self.assertEqual(inventory.total_size, 8 + 3 + 5 + 3)
+
+    def test_refresh(self):
+        from kagin.inventory import AssetInventory
+        path = self.write_file('a.js', 'var a;')
+        inventory = AssetInventory.scan([self.dir])
+        self.write_file('a.js', 'var a = 1;')
+        inventory.refresh('a.js', path)
+        self.assertEqual(inventory.get('a.js').size, 10)
+        os.remove(path)
+        inventory.refresh('a.js', path)
+        self.assertFalse('a.js' in inventory)
+        self.assertEqual(len(inventory), 0)
+
+    def test_hash_with_inventory(self):
+        from kagin.inventory import AssetInventory
+        from kagin.hash import HashFile
+        input_dir = os.path.join(self.dir, 'input')
+        output_dir = os.path.join(self.dir, 'output')
+        self.write_file('input/a.txt', 'a')
+        self.write_file('input/b.css', 'b { background: url(a.txt); }')
+        os.mkdir(output_dir)
+        inventory = AssetInventory.scan([input_dir])
+        output_inventory = AssetInventory()
+        hash_file = HashFile(input_dir, output_dir)
+        file_map = hash_file.run_hashing(inventory, output_inventory)
+        hash_file.run_linking(file_map, lambda name: name, inventory,
+                              output_inventory)
+        self.assertEqual(sorted(asset.path for asset in output_inventory),
+                         sorted(os.listdir(output_dir)))
+        css = output_inventory.get(file_map['b.css'])
+        self.assertEqual(css.size, os.path.getsize(css.file_path))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestAssetInventory))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestUploadJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def make_one(self, fingerprint='build', **kwargs):
+        from kagin.journal import UploadJournal
+        return UploadJournal(self.path, fingerprint, 'bucket', **kwargs)
+
+    def lines(self):
+        with open(self.path, 'rb') as file:
+            return file.read().splitlines()
+
+    def test_fingerprint(self):
+        from kagin.inventory import AssetInventory
+        from kagin.journal import build_fingerprint
+        with open(os.path.join(self.dir, 'a.css'), 'wb') as file:
+            file.write('a')
+        inventory = AssetInventory.scan([self.dir])
+        fingerprint = build_fingerprint(inventory)
+        self.assertEqual(build_fingerprint(AssetInventory.scan([self.dir])),
+                         fingerprint)
+        with open(os.path.join(self.dir, 'a.css'), 'wb') as file:
+            file.write('ab')
+        self.assertNotEqual(
+            build_fingerprint(AssetInventory.scan([self.dir])), fingerprint)
+
+    def test_batch(self):
+        journal = self.make_one(batch_size=2)
+        self.assertFalse(journal.resumable)
+        journal.start(['a.css', 'b.js', 'c.png'])
+        journal.add('a.css', 'a')
+        # not written until the batch is full
+        self.assertEqual(len(self.lines()), 1)
+        journal.add('b.js', 'b')
+        self.assertEqual(len(self.lines()), 3)
+        journal.close()
+
+        journal = self.make_one()
+        self.assertTrue(journal.resumable)
+        self.assertEqual(journal.done, {'a.css': 'a', 'b.js': 'b'})
+        self.assertEqual(journal.remaining, ['c.png'])
+        # journal of another build is ignored
+        self.assertFalse(self.make_one('other').resumable)
+
+        journal.remove()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(self.make_one().resumable)
+
+    def test_partial_line(self):
+        journal = self.make_one()
+        journal.start(['a.css', 'b.js'])
+        journal.add('a.css', 'a')
+        journal.close()
+        with open(self.path, 'ab') as file:
+            file.write('["b.js", "b')
+
+        journal = self.make_one()
+        self.assertEqual(journal.remaining, ['b.js'])
+        journal.add('b.js', 'b')
+        journal.close()
+        self.assertEqual(self.make_one().done, {'a.css': 'a', 'b.js': 'b'})
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestUploadJournal))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -130,7 +130,30 @@ class TestLinkFile(unittest.TestCase):
           font-style: normal;
         }"""
         self.assertMultiLineEqual(result, expected)
-        
+
+    def test_rewrite_stream(self):
+        from cStringIO import StringIO
+        from kagin.link_css import CSSLinkRewriter
+        rewriter = CSSLinkRewriter()
+
+        def map_func(path):
+            return 'hashed-' + path
+
+        css = """
+        html { background: url( "a.png?v=1" ); }
+        p { background: URL(img/b.png#x) } menu { }
+        u { background: url('c.png'); } url
+        """
+        expected = rewriter.rewrite(css, map_func)
+        self.assertTrue('url( "hashed-a.png?v=1" )' in expected)
+        self.assertTrue('URL(hashed-img/b.png#x)' in expected)
+        # links crossing chunk boundaries are rewritten as a whole
+        for chunk_size in xrange(1, len(css) + 1):
+            output = StringIO()
+            rewriter.rewrite_stream(StringIO(css), output, map_func,
+                                    chunk_size=chunk_size)
+            self.assertEqual(output.getvalue(), expected)
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TestLinkFile))
@@ -0,0 +1,402 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestUpload(unittest.TestCase):
+
+    def setUp(self):
+        from kagin.tests.fake_s3 import FakeS3
+        self.dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.dir, 'input')
+        self.output_dir = os.path.join(self.dir, 'output')
+        os.mkdir(self.input_dir)
+        os.mkdir(self.output_dir)
+        self.service = FakeS3()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def write_file(self, name, content):
+        with open(os.path.join(self.input_dir, name), 'wb') as file:
+            file.write(content)
+
+    def make_one(self, **kwargs):
+        from kagin.manager import KaginManager
+        config = dict(
+            input_dir=self.input_dir,
+            output_dir=self.output_dir,
+            file_map=os.path.join(self.dir, 'file_map.json'),
+            storage=dict(
+                http_url_prefix='http://example.com/',
+                https_url_prefix='https://example.com/',
+                bucket_name='bucket',
+                access_key='access key',
+                secret_key='secret key',
+                connection_factory=self.service,
+            ),
+            js_groups=[],
+            css_groups=[],
+            upload_jobs=2,
+        )
+        config.update(kwargs)
+        return KaginManager(config)
+
+    def puts(self):
+        puts = [name for method, name in self.service.requests
+                if method == 'PUT']
+        del self.service.requests[:]
+        return sorted(puts)
+
+    def test_sync(self):
+        self.write_file('a.css', 'p { background: url(b.png); }')
+        self.write_file('b.png', 'png')
+        manager = self.make_one(upload_sync=True)
+        manager.finish_build()
+        # file map is written atomically with readable mode
+        mode = os.stat(os.path.join(self.dir, 'file_map.json')).st_mode
+        self.assertEqual(mode & 0777, 0644)
+        manager.upload()
+        self.assertEqual(len(self.puts()), 2)
+        keys = self.service.bucket('bucket').keys
+        css_name = manager.file_map['a.css']
+        self.assertEqual(keys[css_name].metadata['md5'],
+                         keys[css_name].etag.strip('"'))
+
+        # unchanged CSS is not uploaded again in sync mode
+        manager.upload()
+        self.assertEqual(self.puts(), [])
+        manager.upload(sync=False)
+        self.assertEqual(self.puts(), [css_name])
+
+        # content differs from remote
+        keys[css_name].etag = '"other"'
+        manager.upload()
+        self.assertEqual(self.puts(), [css_name])
+
+        # multipart ETag is not MD5, digest in metadata is used
+        keys[css_name].etag = '"other-2"'
+        manager.upload()
+        self.assertEqual(self.puts(), [])
+
+    def test_cache_headers(self):
+        from kagin.tests.fake_s3 import FakeS3
+        self.write_file('a.css', 'p { background: url(b.png); }' * 100)
+        self.write_file('b.png', 'png b')
+        self.write_file('c.png', 'png c')
+        immutable = 'public, max-age=31536000, immutable'
+        for dependency_order, css_cache_control in [
+            (False, 'public, max-age=300'),
+            (True, immutable),
+        ]:
+            self.service = FakeS3()
+            manager = self.make_one(
+                hash_dependency_order=dependency_order,
+                precompress=dict(encodings=['gzip']),
+            )
+            manager.finish_build()
+            manager.upload()
+            keys = self.service.bucket('bucket').keys
+            css_name = manager.file_map['a.css']
+            gzip_name = manager.file_map['a.css.gzip']
+            b_headers = keys[manager.file_map['b.png']].headers
+            c_headers = keys[manager.file_map['c.png']].headers
+            self.assertEqual(b_headers['Cache-Control'], immutable)
+            self.assertEqual(b_headers['Content-Type'], 'image/png')
+            # Expires is computed once per deploy
+            self.assertEqual(b_headers['Expires'], c_headers['Expires'])
+            # links in CSS files are rewritten under the same name unless
+            # they are hashed in dependency order
+            for name in [css_name, gzip_name]:
+                headers = keys[name].headers
+                self.assertEqual(headers['Cache-Control'], css_cache_control)
+                self.assertEqual(headers['Content-Type'], 'text/css')
+            self.assertEqual(keys[gzip_name].headers['Content-Encoding'], 
+                             'gzip')
+            self.assertEqual(keys[gzip_name].headers['Vary'], 
+                             'Accept-Encoding')
+
+    def test_snapshot(self):
+        self.write_file('b.png', 'png')
+        snapshot = os.path.join(self.dir, 'snapshot.json')
+        manager = self.make_one(remote_snapshot=snapshot)
+        manager.finish_build()
+        manager.upload()
+        self.assertEqual(self.puts(), [manager.file_map['b.png']])
+
+        # uploaded files are in snapshot, so no listing is needed, and 
+        # skipped files are not read
+        from kagin import manager as manager_module
+        file_digest = manager_module.file_digest
+        digested = []
+
+        def counted_digest(path):
+            digested.append(path)
+            return file_digest(path)
+
+        manager = self.make_one(remote_snapshot=snapshot)
+        manager.finish_build()
+        manager_module.file_digest = counted_digest
+        try:
+            manager.upload()
+        finally:
+            manager_module.file_digest = file_digest
+        self.assertEqual(self.service.requests, [])
+        self.assertEqual(digested, [])
+
+    def test_resume(self):
+        from kagin.upload import UploadError
+        self.write_file('a.png', 'a')
+        self.write_file('b.png', 'b')
+        self.write_file('c.png', 'c')
+        manager = self.make_one(upload_retries=0, upload_journal_batch=1)
+        manager.finish_build()
+        failed_name = manager.file_map['b.png']
+        self.service.failures[failed_name] = 1
+        self.assertRaises(UploadError, manager.upload)
+        self.assertEqual(len(self.puts()), 3)
+
+        # only the failed file is uploaded again, without listing
+        manager = self.make_one()
+        manager.finish_build()
+        manager.upload()
+        self.assertEqual(self.service.requests, [('PUT', failed_name)])
+        del self.service.requests[:]
+
+        # journal is removed after the upload is finished
+        manager.upload()
+        self.assertTrue(('GET', '') in self.service.requests)
+        self.assertEqual(self.puts(), [])
+
+
+    def test_gc(self):
+        history = os.path.join(self.dir, 'history')
+        names = []
+        for index in xrange(4):
+            self.write_file('a.png', 'png %d' % index)
+            manager = self.make_one(file_map_history=history, 
+                                    file_map_history_size=3)
+            manager.finish_build()
+            manager.upload()
+            names.append(manager.file_map['a.png'])
+        self.assertEqual(len(os.listdir(history)), 3)
+        # the same file map is not recorded again
+        manager.write_file_map()
+        self.assertEqual(len(os.listdir(history)), 3)
+        bucket = self.service.bucket('bucket')
+        self.assertEqual(set(bucket.keys), set(names))
+
+        # recently uploaded files are kept
+        self.assertEqual(manager.gc(keep=1, dry_run=True), (0, 0))
+        for name in names:
+            bucket.keys[name].last_modified = '2013-01-31T12:00:00.000Z'
+        self.assertEqual(manager.gc(keep=1, dry_run=True), (2, 10))
+        self.assertEqual(set(bucket.keys), set(names))
+        self.assertEqual(manager.gc(keep=1), (2, 10))
+        self.assertEqual(set(bucket.keys), set(names[2:]))
+        self.assertEqual(manager.gc(keep=0), (1, 5))
+        self.assertEqual(set(bucket.keys), set(names[3:]))
+
+
+    def test_gc_guard(self):
+        bucket = self.service.bucket('bucket')
+        old_names = ['unrelated/logo.png', 'abcd.js', 
+                     'a' * 32 + '.gzip.js', 'b' * 32 + '.css.br']
+        for name in old_names:
+            bucket.new_key(name).set_contents_from_string('x')
+            bucket.keys[name].last_modified = '2013-01-31T12:00:00.000Z'
+        # refuse to remove everything without a file map
+        manager = self.make_one()
+        self.assertRaises(RuntimeError, manager.gc)
+        self.assertEqual(set(bucket.keys), set(old_names))
+
+        self.write_file('a.png', 'png')
+        manager.finish_build()
+        manager.upload()
+        # only names of hashed files are removed
+        self.assertEqual(manager.gc(), (1, 1))
+        self.assertEqual(set(bucket.keys), set([
+            'unrelated/logo.png', 'abcd.js', 'b' * 32 + '.css.br',
+            manager.file_map['a.png'],
+        ]))
+
+
+class TestWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.dir, 'input')
+        self.output_dir = os.path.join(self.dir, 'output')
+        os.mkdir(self.input_dir)
+        os.mkdir(self.output_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def write_file(self, name, content):
+        with open(os.path.join(self.input_dir, name), 'wb') as file:
+            file.write(content)
+
+    def test_broken_edit(self):
+        import logging
+        from kagin import manager as manager_module
+        from kagin.manager import KaginManager
+        test = self
+
+        class FakeWatcher(object):
+            def __init__(self, path, **kwargs):
+                pass
+
+            def iter_changes(self, debounce):
+                test.write_file('a.js', 'var b="unterminated;')
+                yield set(['a.js'])
+                test.write_file('a.js', 'var b = "fixed";')
+                yield set(['a.js'])
+
+            def close(self):
+                pass
+
+        self.write_file('a.js', 'var a = 1;')
+        logger = logging.getLogger('test_watch')
+        logger.disabled = True
+        manager = KaginManager(dict(
+            input_dir=self.input_dir,
+            output_dir=self.output_dir,
+            file_map=os.path.join(self.dir, 'file_map.json'),
+            storage=dict(
+                http_url_prefix='http://example.com/',
+                https_url_prefix='https://example.com/',
+                bucket_name='bucket',
+                access_key='access key',
+                secret_key='secret key',
+            ),
+            js_groups=[dict(name='all', files=['a.js'], gzip=False,
+                            minifier='python')],
+            css_groups=[],
+        ), logger=logger)
+        make_watcher = manager_module.make_watcher
+        manager_module.make_watcher = FakeWatcher
+        try:
+            manager.watch()
+        finally:
+            manager_module.make_watcher = make_watcher
+        path = os.path.join(manager.hash_output_dir,
+                            manager.file_map['all.mini.js'])
+        with open(path, 'rb') as file:
+            self.assertTrue('fixed' in file.read())
+
+
+class TestIncrementalBuild(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.dir, 'input')
+        self.output_dir = os.path.join(self.dir, 'output')
+        os.mkdir(self.input_dir)
+        os.mkdir(self.output_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def write_file(self, name, content):
+        with open(os.path.join(self.input_dir, name), 'wb') as file:
+            file.write(content)
+
+    def build(self):
+        import logging
+        from kagin.manager import KaginManager
+        logger = logging.getLogger('test_incremental')
+        logger.disabled = True
+        manager = KaginManager(dict(
+            input_dir=self.input_dir,
+            output_dir=self.output_dir,
+            file_map=os.path.join(self.dir, 'file_map.json'),
+            storage=dict(
+                http_url_prefix='http://example.com/',
+                https_url_prefix='https://example.com/',
+                bucket_name='bucket',
+                access_key='access key',
+                secret_key='secret key',
+            ),
+            js_groups=[dict(name='all', files=['a.js', 'b.js'],
+                            minifier='python')],
+            css_groups=[dict(name='style', files=['s.css'],
+                             minifier='python')],
+            incremental=True,
+        ), logger=logger)
+        manager.build()
+        return manager
+
+    def outputs(self, dir):
+        """Map from name to (inode, mtime) of files in dir, so that
+        rewritten files are told apart
+
+        """
+        outputs = {}
+        for name in os.listdir(dir):
+            stat = os.stat(os.path.join(dir, name))
+            outputs[name] = (stat.st_ino, stat.st_mtime)
+        return outputs
+
+    def test_rebuild(self):
+        self.write_file('a.js', 'var a = 1;')
+        self.write_file('b.js', 'var b = 2;')
+        self.write_file('s.css', 'p { background: url(img.png); }')
+        self.write_file('img.png', 'image 1')
+        self.write_file('other.png', 'other')
+        manager = self.build()
+        file_map = dict(manager.file_map)
+        minified = self.outputs(manager.minify_dir)
+        hashed = self.outputs(manager.hash_output_dir)
+
+        # nothing is rewritten when nothing changed
+        manager = self.build()
+        self.assertEqual(manager.file_map, file_map)
+        self.assertEqual(self.outputs(manager.minify_dir), minified)
+        self.assertEqual(self.outputs(manager.hash_output_dir), hashed)
+
+        self.write_file('a.js', 'var a = 3;')
+        self.write_file('img.png', 'image 2')
+        manager = self.build()
+        changed = set(name for name, value in manager.file_map.iteritems()
+                      if file_map.get(name) != value)
+        self.assertEqual(changed, set(['a.js', 'img.png', 'all.mini.js']))
+        # only the affected group is minified again
+        new_minified = self.outputs(manager.minify_dir)
+        self.assertEqual(new_minified['style.mini.css'],
+                         minified['style.mini.css'])
+        self.assertNotEqual(new_minified['all.mini.js'],
+                            minified['all.mini.js'])
+
+        new_hashed = self.outputs(manager.hash_output_dir)
+        # stale hashed files of old content are removed
+        stale = set([file_map['a.js'], file_map['img.png'],
+                     file_map['all.mini.js'],
+                     file_map['all.mini.js'].replace('.gzip', '')])
+        self.assertEqual(stale & set(new_hashed), set())
+        self.assertEqual(set(hashed) - set(new_hashed), stale)
+        for name in stale:
+            self.assertFalse(name in manager.output_inventory)
+        # CSS files linking to the changed image are rewritten in place,
+        # other outputs are untouched
+        rewritten = set(name for name in set(hashed) & set(new_hashed)
+                        if hashed[name] != new_hashed[name])
+        self.assertEqual(rewritten, set([
+            file_map['s.css'], file_map['style.mini.css'],
+            file_map['style.mini.css'].replace('.gzip', ''),
+        ]))
+        with open(os.path.join(manager.hash_output_dir,
+                               file_map['s.css']), 'rb') as file:
+            self.assertTrue(manager.file_map['img.png'] in file.read())
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestUpload))
+    suite.addTest(unittest.makeSuite(TestWatch))
+    suite.addTest(unittest.makeSuite(TestIncrementalBuild))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,254 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+
+def has_java():
+    try:
+        subprocess.check_output(['java', '-version'],
+                                stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return True
+
+
+class FakeCompressor(object):
+
+    def __init__(self):
+        self.filenames = []
+
+    def compress_file(self, filename):
+        self.filenames.append(filename)
+        with open(filename, 'rt') as file:
+            return file.read().strip()
+
+
+class TestBuilder(unittest.TestCase):
+
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir, ignore_errors=True)
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.input_dir, name)
+        with open(path, 'wt') as file:
+            file.write(content)
+        return path
+
+    def make_one(self, *args, **kwargs):
+        from kagin.minify import Builder
+        return Builder(*args, **kwargs)
+
+    def test_build_with_compressor(self):
+        from kagin.minify import FileConfig
+        self.write_file('a.js', 'var a = 1;\n')
+        self.write_file('b.js', 'var b = 2;\n')
+        config = FileConfig(self.input_dir)
+        config.add_group('all', ['a.js', 'b.js'])
+
+        compressor = FakeCompressor()
+        builder = self.make_one(self.input_dir, self.output_dir,
+                                compressor=compressor)
+        builder.build(config, '.mini.js')
+
+        self.assertEqual(compressor.filenames, [
+            os.path.join(self.input_dir, 'a.js'),
+            os.path.join(self.input_dir, 'b.js'),
+        ])
+        with open(os.path.join(self.output_dir, 'all.mini.js'), 'rt') as file:
+            self.assertEqual(file.read(), 'var a = 1;\nvar b = 2;')
+
+    def test_parallel_build(self):
+        from kagin.minify import FileConfig
+        js_config = FileConfig(self.input_dir)
+        css_config = FileConfig(self.input_dir)
+        for group in xrange(4):
+            js_files = []
+            css_files = []
+            for index in xrange(8):
+                name = 'g%d_f%d' % (group, index)
+                self.write_file(name + '.js', 'var %s = 1;\n' % name)
+                self.write_file(name + '.css', '.%s { }\n' % name)
+                js_files.append(name + '.js')
+                css_files.append(name + '.css')
+            js_config.add_group('group%d' % group, js_files)
+            css_config.add_group('group%d' % group, css_files)
+        configs = [(js_config, '.mini.js'), (css_config, '.mini.css')]
+
+        def build(jobs):
+            output_dir = tempfile.mkdtemp()
+            try:
+                builder = self.make_one(self.input_dir, output_dir,
+                                        compressor=FakeCompressor(),
+                                        jobs=jobs)
+                builder.build_all(configs)
+                outputs = {}
+                for filename in os.listdir(output_dir):
+                    path = os.path.join(output_dir, filename)
+                    with open(path, 'rb') as file:
+                        outputs[filename] = file.read()
+                return outputs
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+
+        serial = build(1)
+        self.assertEqual(len(serial), 8)
+        self.assertEqual(build(8), serial)
+
+    def test_group_minifier(self):
+        from kagin.minify import FileConfig
+        self.write_file('a.js', 'var  a = 1; // comment\n')
+        self.write_file('jquery.min.js', 'var b=2;\n')
+        self.write_file('c.js', 'var c = 3;\n')
+        config = FileConfig(self.input_dir)
+        config.add_group('app', ['a.js'], minifier='python')
+        config.add_group('vendor', ['jquery.min.js', 'c.js'], 
+                         minifier='passthrough')
+
+        compressor = FakeCompressor()
+        builder = self.make_one(self.input_dir, self.output_dir,
+                                compressor=compressor)
+        builder.build(config, '.mini.js')
+
+        # only c.js is not minified yet, so it goes to the fallback
+        self.assertEqual(compressor.filenames, 
+                         [os.path.join(self.input_dir, 'c.js')])
+        with open(os.path.join(self.output_dir, 'app.mini.js'), 'rt') as file:
+            self.assertEqual(file.read(), 'var a=1;')
+        with open(os.path.join(self.output_dir, 'vendor.mini.js'), 
+                  'rt') as file:
+            self.assertEqual(file.read(), 'var b=2;\nvar c = 3;')
+
+    @unittest.skipUnless(has_java(), 'java is not available')
+    def test_worker_matches_spawn(self):
+        from kagin.compressor import CompressorPool
+        filenames = [
+            self.write_file('a.js', 'function foo(bar) { return bar + 1; }'),
+            self.write_file('b.css', 'html { color : #ffffff ; }'),
+            self.write_file('c.js', 'var x = "\xe4\xbd\xa0\xe5\xa5\xbd";'),
+        ]
+        spawn = self.make_one(self.input_dir, self.output_dir)
+        with CompressorPool(2) as pool:
+            worker = self.make_one(self.input_dir, self.output_dir,
+                                   compressor=pool)
+            for filename in filenames:
+                self.assertEqual(worker.compress(filename),
+                                 spawn.compress(filename))
+
+
+#: a fake compressor worker speaking the protocol of yui_worker.js, which
+#: upper-cases content, or misbehaves as content asks
+FAKE_WORKER = r'''
+import sys
+while True:
+    header = sys.stdin.readline()
+    if not header:
+        break
+    source_type, length = header.split()
+    content = sys.stdin.read(int(length))
+    if content == 'truncate':
+        sys.stdout.write('OK 100\n' + 'short')
+        sys.stdout.flush()
+        break
+    elif content == 'malformed':
+        sys.stdout.write('garbage\n')
+    elif content == 'error':
+        sys.stdout.write('ERROR 6\nbroken')
+    else:
+        output = content.upper()
+        sys.stdout.write('OK %d\n%s' % (len(output), output))
+    sys.stdout.flush()
+'''
+
+
+class TestCompressorWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.java = os.path.join(self.dir, 'fake_java')
+        with open(self.java, 'wt') as file:
+            file.write('#!%s\n' % sys.executable)
+            file.write(FAKE_WORKER)
+        os.chmod(self.java, 0755)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_protocol(self):
+        from kagin.compressor import YUICompressorWorker, CompressorError
+        worker = YUICompressorWorker(java=self.java)
+        try:
+            self.assertEqual(worker.compress('var a;', 'js'), 'VAR A;')
+            # an error of the file keeps the worker
+            self.assertRaises(CompressorError, worker.compress, 'error', 
+                              'js')
+            process = worker.process
+            self.assertEqual(worker.compress('p {}', 'css'), 'P {}')
+            self.assertTrue(worker.process is process)
+
+            # a broken response never passes as output, and the worker is
+            # replaced by a new one
+            for content in ['malformed', 'truncate']:
+                self.assertRaises(CompressorError, worker.compress, 
+                                  content, 'js')
+                self.assertEqual(worker.process, None)
+                self.assertEqual(worker.compress('b', 'js'), 'B')
+        finally:
+            worker.close()
+
+
+class TestPythonMinifier(unittest.TestCase):
+
+    def test_minify_js(self):
+        from kagin.minifiers import minify_js
+        self.assertEqual(minify_js("""
+            // comment
+            var x = a + +b;  /* block */
+            var re = /ab[/]c/g, s = "a  // b";
+            function foo ( bar ) {
+                return bar - -1
+            }
+            x = y
+            ++z
+        """), 'var x=a+ +b;var re=/ab[/]c/g,s="a  // b";'
+              'function foo(bar){return bar- -1}\nx=y\n++z')
+        self.assertEqual(minify_js('x = y / /re/.source;'), 
+                         'x=y/ /re/.source;')
+        self.assertEqual(minify_js('x = y * /re/.source;'), 
+                         'x=y* /re/.source;')
+
+    def test_minify_css(self):
+        from kagin.minifiers import minify_css
+        self.assertEqual(minify_css("""
+            /* comment */
+            html , body > p {
+                color: red ;
+                content: "a  ;  b" ;
+            }
+            /*! license */
+        """), 'html,body>p{color:red;content:"a  ;  b"}/*! license */')
+
+    def test_passthrough_detection(self):
+        from kagin.minifiers import PassThroughMinifier, PythonMinifier
+        minifier = PassThroughMinifier(PythonMinifier(), max_line_length=10)
+        self.assertTrue(minifier.is_minified('jquery.min.js', 'var a;'))
+        self.assertTrue(minifier.is_minified('a.js', 'var a,b,c,d,e;'))
+        self.assertFalse(minifier.is_minified('a.js', 'var a;\nvar b;'))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestBuilder))
+    suite.addTest(unittest.makeSuite(TestCompressorWorker))
+    suite.addTest(unittest.makeSuite(TestPythonMinifier))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,169 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+
+class TestPrecompressor(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def write_file(self, name, content):
+        with open(os.path.join(self.output_dir, name), 'wb') as file:
+            file.write(content)
+
+    def make_one(self, *args, **kwargs):
+        from kagin.precompress import Precompressor
+        kwargs.setdefault('encodings', ['gzip'])
+        return Precompressor(self.output_dir, *args, **kwargs)
+
+    def make_inventory(self):
+        from kagin.inventory import AssetInventory
+        return AssetInventory.scan([self.output_dir])
+
+    def test_variant_name(self):
+        from kagin.precompress import get_variant_name, get_content_encoding
+        self.assertEqual(get_variant_name('0123.svg', 'gzip'),
+                         '0123.gzip.svg')
+        self.assertEqual(get_variant_name('0123.svg', 'br'), '0123.br.svg')
+        self.assertEqual(get_content_encoding('0123.gzip.svg'), 'gzip')
+        self.assertEqual(get_content_encoding('0123.br.svg'), 'br')
+        self.assertEqual(get_content_encoding('0123.svg'), None)
+
+    def test_run(self):
+        svg = '<svg>' + '<path d="M0 0"/>' * 200 + '</svg>'
+        self.write_file('aaaa.svg', svg)
+        self.write_file('bbbb.png', 'png' * 1000)
+        self.write_file('cccc.css', 'p { }')
+        self.write_file('dddd.ttf', os.urandom(4096))
+        file_map = {
+            'logo.svg': 'aaaa.svg',
+            'img/logo.svg': 'aaaa.svg',
+            'a.png': 'bbbb.png',
+            'a.css': 'cccc.css',
+            'font.ttf': 'dddd.ttf',
+        }
+        inventory = self.make_inventory()
+        precompressor = self.make_one(jobs=4)
+        self.assertEqual(precompressor.run(file_map, inventory), 2)
+        self.assertEqual(file_map['logo.svg.gzip'], 'aaaa.gzip.svg')
+        self.assertEqual(file_map['img/logo.svg.gzip'], 'aaaa.gzip.svg')
+        # not in allowlist, too small, or not small enough after compression
+        self.assertEqual(sorted(os.listdir(self.output_dir)), [
+            'aaaa.gzip.svg', 'aaaa.svg', 'bbbb.png', 'cccc.css', 'dddd.ttf',
+        ])
+        self.assertTrue('aaaa.gzip.svg' in inventory)
+        path = os.path.join(self.output_dir, 'aaaa.gzip.svg')
+        with gzip.open(path, 'rb') as file:
+            self.assertEqual(file.read(), svg)
+
+    def test_gzipped_group(self):
+        import sys
+        import zlib
+        import types
+        brotli = types.ModuleType('brotli')
+        brotli.compress = lambda content, quality: zlib.compress(content)
+        original = sys.modules.get('brotli')
+        sys.modules['brotli'] = brotli
+        try:
+            script = 'var a = 1;\n' * 500
+            self.write_file('eeee.js', script)
+            self.write_file('eeee.gzip.js', 'gzipped group')
+            file_map = {'all.mini.js': 'eeee.gzip.js'}
+            precompressor = self.make_one(encodings=['gzip', 'br'])
+            self.assertEqual(precompressor.run(file_map, 
+                                               self.make_inventory()), 1)
+        finally:
+            if original is None:
+                del sys.modules['brotli']
+            else:
+                sys.modules['brotli'] = original
+        # the gzipped group gets br variant of its original file, and its 
+        # gzip variant is kept as it is
+        self.assertEqual(file_map['all.mini.js.br'], 'eeee.br.js')
+        path = os.path.join(self.output_dir, 'eeee.br.js')
+        with open(path, 'rb') as file:
+            self.assertEqual(zlib.decompress(file.read()), script)
+        path = os.path.join(self.output_dir, 'eeee.gzip.js')
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), 'gzipped group')
+
+    def test_incremental(self):
+        from kagin.manifest import BuildManifest
+        self.write_file('aaaa.json', '[' + '1, ' * 1000 + '1]')
+        self.write_file('bbbb.json', os.urandom(2048))
+        manifest = BuildManifest(os.path.join(self.output_dir, 'manifest'))
+        precompressor = self.make_one(manifest=manifest)
+        compressed = []
+        compress = precompressor.compress
+
+        def count_compress(path, variant_path, encoding):
+            compressed.append(os.path.basename(path))
+            return compress(path, variant_path, encoding)
+        precompressor.compress = count_compress
+        file_map = {'a.json': 'aaaa.json', 'b.json': 'bbbb.json'}
+        precompressor.run(dict(file_map), self.make_inventory())
+        self.assertEqual(len(compressed), 2)
+
+        # both kept and dropped variants are not compressed again
+        new_file_map = dict(file_map)
+        precompressor.run(new_file_map, self.make_inventory())
+        self.assertEqual(len(compressed), 2)
+        self.assertEqual(new_file_map['a.json.gzip'], 'aaaa.gzip.json')
+        self.assertFalse('b.json.gzip' in new_file_map)
+
+
+class TestGzip(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_deterministic(self):
+        from kagin.precompress import gzip_file
+        src = os.path.join(self.dir, 'a.js')
+        content = 'var a = 1;\n' * 10000
+        with open(src, 'wb') as file:
+            file.write(content)
+        outputs = []
+        for index in xrange(2):
+            dest = os.path.join(self.dir, 'a%d.gzip.js' % index)
+            size = gzip_file(src, dest, chunk_size=1000)
+            self.assertEqual(size, os.path.getsize(dest))
+            with open(dest, 'rb') as file:
+                outputs.append(file.read())
+            with gzip.open(dest, 'rb') as file:
+                self.assertEqual(file.read(), content)
+            os.utime(src, (index, index))
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_max_effort(self):
+        from kagin.precompress import gzip_file
+        src = os.path.join(self.dir, 'a.css')
+        content = ''.join('.a%d { color: #%06x; }\n' % (index, index * 7919)
+                          for index in xrange(5000))
+        with open(src, 'wb') as file:
+            file.write(content)
+        dest = os.path.join(self.dir, 'a.gzip.css')
+        sizes = [gzip_file(src, dest, level=level) for level in (6, 8, 9)]
+        size = gzip_file(src, dest, max_effort=True)
+        self.assertTrue(size <= min(sizes))
+        with gzip.open(dest, 'rb') as file:
+            self.assertEqual(file.read(), content)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestPrecompressor))
+    suite.addTest(unittest.makeSuite(TestGzip))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
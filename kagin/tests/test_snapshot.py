@@ -0,0 +1,83 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+
+def make_storage(service):
+    from kagin.storage import S3Storage
+    return S3Storage(
+        'http://example.com/', 'https://example.com/', 'bucket',
+        'access key', 'secret key', connection_factory=service,
+    )
+
+
+class TestRemoteSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        from kagin.tests.fake_s3 import FakeS3
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'snapshot.json')
+        self.service = FakeS3()
+        self.storage = make_storage(self.service)
+        for index in xrange(25):
+            key = self.storage.bucket.new_key('a/%02d.png' % index)
+            key.set_contents_from_string('png %d' % index)
+        self.storage.bucket.new_key('b.css').set_contents_from_string('b')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def make_one(self, *args, **kwargs):
+        from kagin.snapshot import RemoteSnapshot
+        return RemoteSnapshot(self.path, 'bucket', *args, **kwargs)
+
+    def test_iter_keys(self):
+        import hashlib
+        keys = list(self.storage.iter_keys('a/', page_size=10))
+        self.assertEqual([key.name for key in keys],
+                         ['a/%02d.png' % index for index in xrange(25)])
+        self.assertEqual(keys[0].etag, hashlib.md5('png 0').hexdigest())
+        self.assertEqual(keys[0].size, 5)
+        # three pages of the prefix
+        self.assertEqual(self.service.requests.count(('GET', 'a/')), 3)
+        self.assertEqual(self.storage.get_names(),
+                         set([key.name for key in keys] + ['b.css']))
+
+    def test_remove_many(self):
+        self.service.failures['a/03.png'] = 1
+        names = ['a/%02d.png' % index for index in xrange(25)]
+        errors = self.storage.remove_many(names, batch_size=10)
+        self.assertEqual([name for name, _ in errors], ['a/03.png'])
+        self.assertEqual(self.service.requests.count(('POST', '?delete')), 3)
+        self.assertEqual(self.storage.get_names(), set(['a/03.png', 'b.css']))
+        self.assertEqual(self.storage.remove_many([]), [])
+
+    def test_snapshot(self):
+        snapshot = self.make_one()
+        self.assertFalse(snapshot.fresh)
+        snapshot.refresh(self.storage)
+        snapshot.add('c.js', 'etag')
+        snapshot.remove('b.css')
+        snapshot.save()
+
+        snapshot = self.make_one()
+        self.assertTrue(snapshot.fresh)
+        self.assertEqual(len(snapshot), 26)
+        self.assertTrue('c.js' in snapshot)
+        self.assertFalse('b.css' in snapshot)
+        # expired, or taken of another prefix
+        snapshot.listed_at = time.time() - 100
+        snapshot.save()
+        self.assertFalse(self.make_one(max_age=10).fresh)
+        self.assertFalse(self.make_one('a/').fresh)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestRemoteSnapshot))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
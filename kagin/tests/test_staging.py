@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestStageFile(unittest.TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.dir, 'src.png')
+        self.dest = os.path.join(self.dir, 'dest.png')
+        with open(self.src, 'wb') as file:
+            file.write('image')
+        os.utime(self.src, (1000000, 1000000))
+        
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        
+    def stage(self, *args, **kwargs):
+        from kagin.staging import stage_file
+        return stage_file(self.src, self.dest, *args, **kwargs)
+    
+    def assert_staged(self, same_inode):
+        with open(self.dest, 'rb') as file:
+            self.assertEqual(file.read(), 'image')
+        src_stat = os.stat(self.src)
+        dest_stat = os.stat(self.dest)
+        self.assertEqual(dest_stat.st_mtime, src_stat.st_mtime)
+        self.assertEqual(dest_stat.st_ino == src_stat.st_ino, same_inode)
+    
+    def test_copy(self):
+        self.assertEqual(self.stage('copy'), 'copy')
+        self.assert_staged(False)
+        
+    def test_hardlink(self):
+        self.assertEqual(self.stage('hardlink'), 'hardlink')
+        self.assert_staged(True)
+        # staging again replaces the link instead of writing through it
+        self.assertNotEqual(self.stage('hardlink', private=True), 'hardlink')
+        self.assert_staged(False)
+        
+    def test_auto(self):
+        self.assertIn(self.stage('auto'), ('reflink', 'copy_range', 'copy'))
+        self.assert_staged(False)
+        
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, self.stage, 'symlink')
+        
+    def test_atomic_open_breaks_link(self):
+        from kagin.utils import atomic_open
+        self.stage('hardlink')
+        with atomic_open(self.dest, 'wb') as file:
+            file.write('rewritten')
+        with open(self.src, 'rb') as file:
+            self.assertEqual(file.read(), 'image')
+        with open(self.dest, 'rb') as file:
+            self.assertEqual(file.read(), 'rewritten')
+        
+        
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestStageFile))
+    return suite
+        
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
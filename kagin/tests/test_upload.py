@@ -0,0 +1,165 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def make_storage(self, service):
+        from kagin.storage import S3Storage
+        return S3Storage(
+            'http://example.com/', 'https://example.com/', 'bucket', 
+            'access key', 'secret key', connection_factory=service,
+        )
+
+    def make_tasks(self, names):
+        from kagin.upload import make_task
+        tasks = []
+        for name in names:
+            path = os.path.join(self.dir, name)
+            with open(path, 'wb') as file:
+                file.write(name)
+            tasks.append(make_task(name, path))
+        return tasks
+
+    def test_upload(self):
+        from kagin.upload import Uploader, make_task
+        from kagin.tests.fake_s3 import FakeS3
+        service = FakeS3(latency=0.01)
+        storage = self.make_storage(service)
+        names = ['%d.png' % index for index in xrange(20)] + ['a.css']
+        tasks = self.make_tasks(names)
+        tasks.append(make_task('b.gzip.js', tasks[0].file_path, 
+                               content_encoding='gzip'))
+        uploader = Uploader(storage, jobs=4)
+        self.assertEqual(uploader.upload(tasks), 
+                         sum(len(name) for name in names) + len('0.png'))
+        keys = service.bucket('bucket').keys
+        self.assertEqual(sorted(keys), sorted(names + ['b.gzip.js']))
+        self.assertEqual(keys['a.css'].data, 'a.css')
+        self.assertEqual(keys['b.gzip.js'].headers['Content-Encoding'], 
+                         'gzip')
+        # every worker thread has its own connection
+        self.assertTrue(1 < service.connections <= 4)
+        # bundles are started first
+        puts = [name for method, name in service.requests if method == 'PUT']
+        self.assertTrue(set(['a.css', 'b.gzip.js']) <= set(puts[:4]))
+
+    def test_retry(self):
+        from kagin.upload import Uploader, UploadError
+        from kagin.tests.fake_s3 import FakeS3
+        service = FakeS3(failures={'a.png': 2, 'b.png': 5})
+        storage = self.make_storage(service)
+        uploader = Uploader(storage, jobs=2, retries=2, backoff=0.001)
+        tasks = self.make_tasks(['a.png', 'b.png', 'c.png'])
+        try:
+            uploader.upload(tasks)
+        except UploadError, e:
+            self.assertEqual([task.name for task, _ in e.failed], ['b.png'])
+        else:
+            self.fail('UploadError is not raised')
+        self.assertEqual(sorted(service.bucket('bucket').keys), 
+                         ['a.png', 'c.png'])
+
+
+class TestMultipartUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'video.mp4')
+        self.content = os.urandom(10 * 1000 + 123)
+        with open(self.path, 'wb') as file:
+            file.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def make_storage(self, service, **kwargs):
+        from kagin.storage import S3Storage
+        return S3Storage(
+            'http://example.com/', 'https://example.com/', 'bucket', 
+            'access key', 'secret key', connection_factory=service,
+            multipart_threshold=5000, part_size=1000, retry_backoff=0.001,
+            **kwargs
+        )
+
+    def test_multipart(self):
+        from kagin.tests.fake_s3 import FakeS3
+        service = FakeS3(failures={'video.mp4?partNumber=3': 2})
+        storage = self.make_storage(service)
+        key = storage.upload_file('video.mp4', self.path, 
+                                  metadata=dict(md5='digest'))
+        self.assertEqual(key.data, self.content)
+        self.assertTrue(key.etag.endswith('-11"'))
+        self.assertEqual(key.metadata['md5'], 'digest')
+        parts = [name for method, name in service.requests 
+                 if method == 'PUT']
+        self.assertEqual(len(parts), 11 + 2)
+
+        # small files are uploaded at once
+        small_path = os.path.join(self.dir, 'small.png')
+        with open(small_path, 'wb') as file:
+            file.write('png')
+        storage.upload_file('small.png', small_path)
+        self.assertEqual(service.requests[-1], ('PUT', 'small.png'))
+
+    def test_cancel(self):
+        from kagin.tests.fake_s3 import FakeS3, FakeS3Error
+        service = FakeS3(failures={'video.mp4?partNumber=5': 3})
+        storage = self.make_storage(service, part_retries=2)
+        self.assertRaises(FakeS3Error, storage.upload_file, 'video.mp4', 
+                          self.path)
+        self.assertEqual(service.requests[-1], ('DELETE', 'video.mp4'))
+        self.assertEqual(service.uploads, {})
+        self.assertEqual(service.bucket('bucket').keys, {})
+
+
+class TestHeaderPolicy(unittest.TestCase):
+
+    def test_headers(self):
+        from kagin.upload import HeaderPolicy
+        from kagin.storage import S3Storage
+        policy = HeaderPolicy(unhashed_max_age=60, now=0)
+        args = policy.get_args('0123abcd.gzip.js')
+        self.assertEqual(args, dict(
+            cache_control='public, max-age=31536000, immutable',
+            expires='Fri, 01 Jan 1971 00:00:00 GMT',
+            content_type='application/javascript',
+            content_encoding='gzip',
+            vary='Accept-Encoding',
+        ))
+        args = policy.get_args('robots.txt', hashed=False)
+        self.assertEqual(args, dict(
+            cache_control='public, max-age=60',
+            expires='Thu, 01 Jan 1970 00:01:00 GMT',
+            content_type='text/plain',
+        ))
+
+        storage = S3Storage('http://example.com/', 'https://example.com/',
+                            'bucket', 'access key', 'secret key')
+        headers = storage._upload_args(**policy.get_args('a.br.css'))
+        self.assertEqual(headers['headers'], {
+            'Cache-Control': 'public, max-age=31536000, immutable',
+            'Expires': 'Fri, 01 Jan 1971 00:00:00 GMT',
+            'Content-Type': 'text/css',
+            'Content-Encoding': 'br',
+            'Vary': 'Accept-Encoding',
+        })
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestUploader))
+    suite.addTest(unittest.makeSuite(TestMultipartUpload))
+    suite.addTest(unittest.makeSuite(TestHeaderPolicy))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestPollingWatcher(unittest.TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, 'js'))
+        
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        
+    def write_file(self, name, content):
+        with open(os.path.join(self.dir, name), 'wt') as file:
+            file.write(content)
+    
+    def make_one(self, *args, **kwargs):
+        from kagin.watch import PollingWatcher
+        return PollingWatcher(self.dir, *args, **kwargs)
+    
+    def test_poll(self):
+        self.write_file('js/a.js', 'var a;')
+        watcher = self.make_one(interval=0.01)
+        self.assertEqual(watcher.poll(0.05), set())
+        
+        self.write_file('js/a.js', 'var a = 1;')
+        self.write_file('js/b.js', 'var b;')
+        self.assertEqual(watcher.poll(0.05), set(['js/a.js', 'js/b.js']))
+        
+        os.remove(os.path.join(self.dir, 'js/b.js'))
+        self.assertEqual(watcher.poll(0.05), set(['js/b.js']))
+        
+    def test_iter_changes(self):
+        watcher = self.make_one(interval=0.01)
+        self.write_file('js/a.js', 'var a;')
+        self.write_file('js/b.js', 'var b;')
+        changes = watcher.iter_changes(debounce=0.05)
+        self.assertEqual(next(changes), set(['js/a.js', 'js/b.js']))
+        
+
+class TestFileConfig(unittest.TestCase):
+    
+    def test_subset(self):
+        from kagin.minify import FileConfig
+        config = FileConfig('/input')
+        config.add_group('a', ['a1.js', 'a2.js'])
+        config.add_group('b', ['b1.js'])
+        subset = config.subset(config.include_files(['a2.js']))
+        self.assertEqual(subset.groups.keys(), ['a'])
+        self.assertEqual(subset.include_files(['a1.js']), set(['a']))
+        
+        
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestPollingWatcher))
+    suite.addTest(unittest.makeSuite(TestFileConfig))
+    return suite
+        
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
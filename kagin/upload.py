@@ -0,0 +1,216 @@
+import os
+import time
+import logging
+import mimetypes
+import collections
+from multiprocessing.pool import ThreadPool
+
+from kagin.inventory import get_asset_type
+from kagin.precompress import get_content_encoding
+from kagin.storage import format_http_date
+
+#: priorities of asset types, smaller ones are uploaded first, so that
+#: bundles pages depend on are available as soon as possible
+TYPE_PRIORITIES = {
+    'css': 0,
+    'js': 0,
+    'html': 1,
+    'json': 1,
+    'font': 1,
+}
+
+#: content types of web assets, which may be missing or different in system
+#: MIME type databases
+CONTENT_TYPES = {
+    '.js': 'application/javascript',
+    '.json': 'application/json',
+    '.svg': 'image/svg+xml',
+    '.webp': 'image/webp',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+}
+
+#: an upload of file_path as name, with keyword arguments to the storage
+UploadTask = collections.namedtuple('UploadTask', [
+    'name', 'file_path', 'priority', 'kwargs',
+])
+
+
+class UploadError(RuntimeError):
+    """Raised when some files failed to upload after all retries
+
+    """
+
+    def __init__(self, message, failed):
+        RuntimeError.__init__(self, message)
+        #: list of (UploadTask, exception) of failed uploads
+        self.failed = failed
+
+
+def get_priority(name):
+    """Get upload priority of a file by its name
+
+    """
+    _, ext = os.path.splitext(name)
+    return TYPE_PRIORITIES.get(get_asset_type(ext), 2)
+
+
+def make_task(name, file_path, **kwargs):
+    """Make an UploadTask with priority by file name
+
+    """
+    return UploadTask(name, file_path, get_priority(name), kwargs)
+
+
+class HeaderPolicy(object):
+    """Headers of uploaded files by class, files with content hash in their
+    names never change, so they are cached for hashed_max_age (a year by
+    default) and marked as immutable, other files are cached for
+    unhashed_max_age. Expires of both classes is computed once when the
+    policy is created, which is once per deploy
+
+    """
+
+    def __init__(
+        self,
+        hashed_max_age=365 * 24 * 60 * 60,
+        unhashed_max_age=5 * 60,
+        now=None,
+    ):
+        if now is None:
+            now = time.time()
+        #: upload arguments of hashed files
+        self.hashed = dict(
+            cache_control='public, max-age=%d, immutable' % hashed_max_age,
+            expires=format_http_date(now + hashed_max_age),
+        )
+        #: upload arguments of unhashed files
+        self.unhashed = dict(
+            cache_control='public, max-age=%d' % unhashed_max_age,
+            expires=format_http_date(now + unhashed_max_age),
+        )
+
+    def get_args(self, name, hashed=True):
+        """Get upload arguments of a file, with Content-Type by its name,
+        compressed variants get Content-Encoding and Vary headers
+
+        """
+        if hashed:
+            args = dict(self.hashed)
+        else:
+            args = dict(self.unhashed)
+        _, ext = os.path.splitext(name)
+        content_type = CONTENT_TYPES.get(ext.lower())
+        if content_type is None:
+            content_type, _ = mimetypes.guess_type(name, strict=False)
+        if content_type is not None:
+            args['content_type'] = content_type
+        content_encoding = get_content_encoding(name)
+        if content_encoding is not None:
+            args['content_encoding'] = content_encoding
+            args['vary'] = 'Accept-Encoding'
+        return args
+
+
+class Uploader(object):
+    """Upload files to a storage concurrently, every worker thread uses its
+    own connection of the storage. Failed uploads are retried with
+    exponential backoff
+
+    """
+
+    def __init__(
+        self,
+        storage,
+        jobs=8,
+        retries=3,
+        backoff=0.5,
+        progress_interval=5.0,
+        logger=None,
+    ):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: storage to upload to, such as S3Storage
+        self.storage = storage
+        #: number of concurrent uploads
+        self.jobs = jobs
+        #: number of times to retry a failed upload
+        self.retries = retries
+        #: seconds to wait before the first retry, doubled for every retry
+        self.backoff = backoff
+        #: seconds between progress reports
+        self.progress_interval = progress_interval
+
+    def upload_task(self, task):
+        """Upload a file with retries, return (task, size, key, error),
+        error is None if the upload succeeded
+
+        """
+        for attempt in xrange(self.retries + 1):
+            try:
+                key = self.storage.upload_file(task.name, task.file_path,
+                                               **task.kwargs)
+            except Exception, e:
+                # the connection may be broken, use a new one
+                self.storage.reset_connection()
+                if attempt == self.retries:
+                    self.logger.error('Failed to upload %s: %s',
+                                      task.name, e)
+                    return task, 0, None, e
+                delay = self.backoff * (2 ** attempt)
+                self.logger.warn('Failed to upload %s (%s), retry in %.1fs',
+                                 task.name, e, delay)
+                time.sleep(delay)
+            else:
+                return task, os.path.getsize(task.file_path), key, None
+
+    def upload(self, tasks, callback=None):
+        """Upload UploadTasks in order of priority, return number of
+        uploaded bytes. callback is called with (task, key) of every
+        uploaded file in current thread. Raise UploadError if some of them
+        failed after all other files are uploaded
+
+        """
+        tasks = sorted(tasks, key=lambda task: (task.priority, task.name))
+        if not tasks:
+            return 0
+        begin = time.time()
+        last_report = begin
+        done = 0
+        total_size = 0
+        failed = []
+        pool = ThreadPool(max(1, min(self.jobs, len(tasks))))
+        try:
+            # with chunksize 1, tasks are started in order of priority
+            results = pool.imap_unordered(self.upload_task, tasks, 1)
+            for task, size, key, error in results:
+                done += 1
+                total_size += size
+                if error is not None:
+                    failed.append((task, error))
+                else:
+                    self.logger.info('Uploaded %s', task.name)
+                    if callback is not None:
+                        callback(task, key)
+                now = time.time()
+                if now - last_report >= self.progress_interval:
+                    last_report = now
+                    self.logger.info('Uploaded %s/%s files', done,
+                                     len(tasks))
+        finally:
+            pool.close()
+            pool.join()
+        elapsed = max(time.time() - begin, 1e-6)
+        self.logger.info(
+            'Uploaded %s files (%.1f MB) in %.2fs with %s jobs, '
+            '%.1f files/s, %.1f MB/s',
+            len(tasks) - len(failed), total_size / 1048576.0, elapsed,
+            self.jobs, len(tasks) / elapsed,
+            total_size / 1048576.0 / elapsed
+        )
+        if failed:
+            raise UploadError('Failed to upload %s files: %s' % (
+                len(failed), ', '.join(task.name for task, _ in failed)
+            ), failed)
+        return total_size
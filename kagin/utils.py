@@ -1,4 +1,6 @@
 import os
+import tempfile
+import contextlib
 
 
 def url_path(path, base):
@@ -10,3 +12,22 @@ def url_path(path, base):
     if path.endswith('/') or path.endswith('\\'):
         return relpath + '/'
     return relpath
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode='wb', file_mode=0644):
+    """Open a temporary file for writing, which replaces path when the 
+    block exits without error. As the file is replaced instead of being
+    written in place, other hard links to the old file are not affected
+    
+    """
+    dir = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=dir)
+    try:
+        os.chmod(temp_path, file_mode)
+        with os.fdopen(fd, mode) as file:
+            yield file
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,137 @@
+import os
+import time
+import logging
+
+from kagin.utils import url_path
+
+
+class PollingWatcher(object):
+    """Watch a directory tree for changed files by polling stat of all
+    files
+
+    """
+
+    def __init__(self, path, interval=1.0, logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        #: path to watched directory
+        self.path = path
+        #: seconds between two scans
+        self.interval = interval
+        self._snapshot = self.snapshot()
+
+    def snapshot(self):
+        """Return a map from relative path to (size, mtime) of all files
+
+        """
+        result = {}
+        for root, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                file_path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                result[url_path(file_path, self.path)] = \
+                    (stat.st_size, stat.st_mtime)
+        return result
+
+    def poll(self, timeout=None):
+        """Wait for changes at most timeout seconds (forever if it is None)
+        and return set of changed relative paths, empty if nothing changed
+
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            snapshot = self.snapshot()
+            changed = set()
+            for path in set(snapshot) | set(self._snapshot):
+                if snapshot.get(path) != self._snapshot.get(path):
+                    changed.add(path)
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.time())
+                if delay <= 0:
+                    return changed
+            time.sleep(delay)
+
+    def iter_changes(self, debounce=0.2):
+        """Yield set of changed relative paths, a burst of changes within
+        debounce seconds are yielded as one set
+
+        """
+        while True:
+            changed = self.poll()
+            while True:
+                more = self.poll(debounce)
+                if not more:
+                    break
+                changed |= more
+            yield changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(PollingWatcher):
+    """Watch a directory tree for changed files with inotify (requires
+    pyinotify)
+
+    """
+
+    def __init__(self, path, logger=None):
+        import pyinotify
+
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        self.path = path
+        self._changed = set()
+
+        watcher = self
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if event.dir:
+                    return
+                watcher._changed.add(url_path(event.pathname, watcher.path))
+
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE |
+                pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM |
+                pyinotify.IN_MOVED_TO | pyinotify.IN_ATTRIB)
+        self._manager = pyinotify.WatchManager()
+        self._manager.add_watch(path, mask, rec=True, auto_add=True)
+        self._notifier = pyinotify.Notifier(self._manager, Handler())
+
+    def poll(self, timeout=None):
+        if timeout is not None:
+            timeout = int(timeout * 1000)
+        if self._notifier.check_events(timeout):
+            self._notifier.read_events()
+            self._notifier.process_events()
+        changed = self._changed
+        self._changed = set()
+        return changed
+
+    def close(self):
+        self._notifier.stop()
+
+
+def make_watcher(path, interval=1.0, logger=None):
+    """Create an InotifyWatcher for path if pyinotify is available,
+    otherwise a PollingWatcher
+
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    try:
+        return InotifyWatcher(path, logger=logger)
+    except ImportError:
+        logger.info('pyinotify is not available, poll for changes instead')
+        return PollingWatcher(path, interval=interval, logger=logger)
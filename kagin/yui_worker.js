@@ -0,0 +1,95 @@
+/*
+ * Long-lived YUI Compressor worker
+ *
+ * This script runs in the Rhino shell bundled inside the YUI Compressor jar
+ * and compresses many sources in one JVM. Requests and responses on
+ * stdin/stdout are framed as
+ *
+ *     <type> <length>\n<length bytes of UTF-8 source>
+ *     <status> <length>\n<length bytes of UTF-8 output>
+ *
+ * where type is "js" or "css" and status is "OK" or "ERR". See
+ * kagin/compressor.py for the Python side.
+ */
+importPackage(java.io);
+
+var yui = Packages.com.yahoo.platform.yui.compressor;
+var rhino = Packages.org.mozilla.javascript;
+
+var input = new DataInputStream(
+    new BufferedInputStream(java.lang.System['in']));
+var output = new BufferedOutputStream(java.lang.System.out);
+
+var errors = [];
+
+var reporter = new rhino.ErrorReporter({
+    warning: function (message, sourceName, line, lineSource, lineOffset) {
+    },
+    error: function (message, sourceName, line, lineSource, lineOffset) {
+        errors.push(line + ':' + lineOffset + ': ' + message);
+    },
+    runtimeError: function (message, sourceName, line, lineSource,
+                            lineOffset) {
+        errors.push(line + ':' + lineOffset + ': ' + message);
+        return new rhino.EvaluatorException(message, sourceName, line,
+                                            lineSource, lineOffset);
+    }
+});
+
+function readRequest() {
+    var header = input.readLine();
+    if (header === null) {
+        return null;
+    }
+    var parts = String(header).split(' ');
+    var length = parseInt(parts[1], 10);
+    var data = java.lang.reflect.Array.newInstance(java.lang.Byte.TYPE,
+                                                   length);
+    input.readFully(data);
+    return {
+        type: parts[0],
+        content: new java.lang.String(data, 'UTF-8')
+    };
+}
+
+function writeResponse(status, text) {
+    var data = new java.lang.String(text).getBytes('UTF-8');
+    var header = new java.lang.String(status + ' ' + data.length + '\n')
+        .getBytes('UTF-8');
+    output.write(header, 0, header.length);
+    output.write(data, 0, data.length);
+    output.flush();
+}
+
+function compress(type, content) {
+    var reader = new StringReader(content);
+    var writer = new StringWriter();
+    if (type == 'css') {
+        new yui.CssCompressor(reader).compress(writer, -1);
+    } else {
+        // same defaults as the command line: munge, no verbose output,
+        // do not preserve semicolons, keep micro optimizations
+        new yui.JavaScriptCompressor(reader, reporter)
+            .compress(writer, -1, true, false, false, false);
+    }
+    return writer.toString();
+}
+
+while (true) {
+    var request = readRequest();
+    if (request === null) {
+        break;
+    }
+    errors = [];
+    try {
+        var result = compress(request.type, request.content);
+        if (errors.length) {
+            writeResponse('ERR', errors.join('\n'));
+        } else {
+            writeResponse('OK', result);
+        }
+    } catch (e) {
+        errors.push(String(e));
+        writeResponse('ERR', errors.join('\n'));
+    }
+}